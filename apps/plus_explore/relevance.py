@@ -0,0 +1,62 @@
+""" Search results in relevance order, without loading every result.
+
+We only ask the full text index for the ids of the results, best first (relevance_ids), and intersect them with the
+listing's tag / type / permission filters in the database as ids. RelevanceResults then behaves like a list of the
+GenericReferences in that order, but only loads the ones that are actually looked at (ie. the page being shown).
+"""
+
+from django.conf import settings
+
+from apps.plus_permissions.models import GenericReference
+
+# searches in relevance order are cut off at this many results (the tail is noise). Other orders get everything
+RELEVANCE_LIMIT = getattr(settings, 'SEARCH_RELEVANCE_LIMIT', 1000)
+
+
+def relevance_ids(results, limit=RELEVANCE_LIMIT) :
+    """ the pks of a haystack SearchQuerySet, best first, the first limit of them or (with limit None) all of
+    them. One query to the index and none to the database (we never touch SearchResult.object) """
+    if limit is None :
+        limit = results.count()
+    return [int(result.pk) for result in results[0:limit]]
+
+
+class RelevanceResults(object) :
+    def __init__(self, ids, queryset=None) :
+        """ ids in relevance order. If queryset (of GenericReferences) is given, keep only the ids it contains.
+        Either way ids the index still has, but which have gone from the database, are dropped here, so that
+        indexing and counting don't come up short later """
+        if queryset is None :
+            queryset = GenericReference.objects.all()
+        if ids :
+            allowed = set(queryset.filter(id__in=ids).values_list('id', flat=True))
+            ids = [i for i in ids if i in allowed]
+        self.ids = ids
+
+    def narrow(self, queryset) :
+        """ the results which are also in queryset, in the same order """
+        return RelevanceResults(self.ids, queryset)
+
+    def load(self, ids) :
+        refs = GenericReference.objects.in_bulk(ids)
+        return [refs[i] for i in ids if i in refs]
+
+    def count(self) :
+        return len(self.ids)
+
+    def __len__(self) :
+        return len(self.ids)
+
+    def __nonzero__(self) :
+        return bool(self.ids)
+
+    def __getitem__(self, k) :
+        if isinstance(k, slice) :
+            return self.load(self.ids[k])
+        return self.load([self.ids[k]])[0]
+
+    def __iter__(self) :
+        chunk_size = 50
+        for start in range(0, len(self.ids), chunk_size) :
+            for ref in self.load(self.ids[start:start + chunk_size]) :
+                yield ref
@@ -0,0 +1,131 @@
+""" Cached RSS for the explore feeds, as seen by an anonymous reader.
+
+A feed for some keywords only shows refs tagged with all of them, so it can only change when one of those refs is
+edited, or gains or loses one of the keywords. We keep a version number per keyword, bumped by the tag hooks
+(keyword_changed) and by saving or deleting a listed ref (ref_changed, for every keyword it carries). The feed with
+no keywords has a site version, bumped by every change. Every feed also depends on a permissions version, bumped when
+any Viewer tag or any object's security context changes (a slider move, a custom context), since that changes what an
+anonymous reader may see anywhere. A cached feed remembers the versions it was made from and is used for as long as
+they're current.
+
+Each cached feed also has an ETag and a Last-Modified time, so feed readers polling a feed which hasn't changed get
+a 304 without anything being generated.
+"""
+
+import time
+import hashlib
+import simplejson
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+from django.contrib.contenttypes.models import ContentType
+
+from django.conf import settings
+
+from apps.plus_lib import after_commit
+from apps.plus_lib.redis_lib import redis
+from apps.plus_tags.tag_index import keyword_key
+
+VERSION_KEY = "rss_feed_version"
+PERMISSIONS_VERSION_KEY = "rss_permissions_version"
+SITE = ""
+# the versions are the real invalidation, this just lets redis forget feeds nobody reads
+CACHE_SECONDS = 60 * 60 * 24
+
+MIMETYPE = "application/xhtml+xml"
+
+
+def feed_key(feed_type, tag_string, s_type=None, order='') :
+    key = "feed:" + feed_type + ":" + tag_string
+    if s_type :
+        key = key + ":" + s_type
+    if order :
+        key = key + ":" + order
+    return key
+
+def version_key(keyword) :
+    return keyword_key(VERSION_KEY, keyword)
+
+def permissions_version_key() :
+    return "%s:%s" % (settings.DOMAIN_NAME, PERMISSIONS_VERSION_KEY)
+
+
+def versions(keywords) :
+    """ the current permissions version, and versions of the keywords a feed is made of (or of the site, for no
+    keywords) """
+    keywords = sorted(set(keywords)) or [SITE]
+    pipe = redis.pipeline()
+    pipe.get(permissions_version_key())
+    for keyword in keywords :
+        pipe.get(version_key(keyword))
+    return [int(v or 0) for v in pipe.execute()]
+
+
+def get(key, keywords) :
+    """ the cached feed, if it's still current """
+    cached = redis.get(key)
+    if not cached :
+        return None
+    cached = simplejson.loads(cached)
+    if cached['versions'] != versions(keywords) :
+        return None
+    return cached
+
+def store(key, feed_versions, feed_string) :
+    """ feed_versions should be read before the feed is made, so a change made meanwhile isn't lost """
+    cached = {'versions':feed_versions,
+              'etag':'"%s"' % hashlib.sha1(feed_string).hexdigest(),
+              'modified':int(time.time()),
+              'feed':feed_string.decode('utf-8')}
+    redis.set(key, simplejson.dumps(cached))
+    redis.expire(key, CACHE_SECONDS)
+    return cached
+
+
+def response(request, cached) :
+    """ the cached feed, or a 304 if the reader already has it """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match :
+        if cached['etag'] in if_none_match :
+            return HttpResponseNotModified()
+    elif not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), cached['modified']) :
+        return HttpResponseNotModified()
+
+    response = HttpResponse(cached['feed'].encode('utf-8'), mimetype=MIMETYPE)
+    response['ETag'] = cached['etag']
+    response['Last-Modified'] = http_date(cached['modified'])
+    return response
+
+
+def keyword_changed(keyword) :
+    """ a ref has been tagged or untagged with keyword """
+    pipe = redis.pipeline()
+    pipe.incr(version_key(keyword))
+    pipe.incr(version_key(SITE))
+    pipe.execute()
+
+def ref_changed(ref) :
+    """ ref has been saved or is being deleted. Only the types which show up in the listings matter """
+    from apps.plus_explore.views import listed_models
+    from apps.plus_tags.models import Tag
+    if ContentType.objects.get_for_id(ref.content_type_id).model not in listed_models :
+        return
+    pipe = redis.pipeline()
+    for keyword in Tag.objects.filter(items=ref).values_list('keyword', flat=True).distinct() :
+        pipe.incr(version_key(keyword))
+    pipe.incr(version_key(SITE))
+    pipe.execute()
+
+def bump_permissions() :
+    redis.incr(permissions_version_key())
+
+def permissions_changed() :
+    bump_permissions()
+    # and again once committed, in case a feed was made from the old permissions meanwhile
+    after_commit.defer(bump_permissions)
+
+def tag_changed(tag) :
+    """ tag's agents have changed. Feed items aren't in the listings, any other Viewer could be """
+    if tag.interface.endswith('.Viewer') and not tag.interface.startswith('FeedItem.') :
+        permissions_changed()
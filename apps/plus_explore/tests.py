@@ -0,0 +1,60 @@
+import unittest
+
+from django.test.client import Client
+from django.core.urlresolvers import reverse
+from django.contrib.auth.models import User
+
+from apps.plus_groups.models import TgGroup
+from apps.plus_permissions.models import SecurityTag
+from apps.plus_permissions.default_agents import get_anonymous_group
+from apps.plus_lib.redis_lib import redis
+from apps.plus_explore import rss_cache
+from apps.plus_explore.relevance import RelevanceResults
+from apps.plus_permissions.models import GenericReference
+
+
+class TestRssCache(unittest.TestCase) :
+    def test_anonymous_feed(self) :
+        client = Client()
+        url = reverse('explore_filtered_feed', args=('',)) + '?order=modified'
+        key = rss_cache.feed_key('rss2.0', '', None, 'modified')
+        redis.delete(key)
+
+        first = client.get(url)
+        self.assertEquals(first.status_code, 200)
+        cached = rss_cache.get(key, [])
+        self.assertTrue(cached)
+        self.assertEquals(first['ETag'], cached['etag'])
+
+        # the second time it comes from the cache
+        second = client.get(url)
+        self.assertEquals(second.content, first.content)
+        self.assertEquals(rss_cache.get(key, []), cached)
+
+        # and a reader which already has it just gets told so
+        self.assertEquals(client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        # a change of permissions retires it
+        god = User(username='Portunus', email_address='portunus@the-hub.net')
+        god.save()
+        group, created = TgGroup.objects.get_or_create(group_name='doorway', display_name='Doorway',
+                                                       place=None, level='member', user=god)
+        tag = SecurityTag.objects.get(security_context=group.get_security_context(), interface='TgGroup.Viewer')
+        tag.remove_agents([get_anonymous_group().get_ref()])
+        self.assertEquals(rss_cache.get(key, []), None)
+
+
+class TestRelevanceResults(unittest.TestCase) :
+    def test_gone_from_database(self) :
+        god = User(username='Lethe', email_address='lethe@the-hub.net')
+        god.save()
+        group, created = TgGroup.objects.get_or_create(group_name='forgetting', display_name='Forgetting',
+                                                       place=None, level='member', user=god)
+        ref = group.get_ref()
+        # still in the index, but deleted
+        gone = GenericReference.objects.order_by('-id')[0].id + 1000
+
+        results = RelevanceResults([gone, ref.id])
+        self.assertEquals(len(results), 1)
+        self.assertEquals(results[0], ref)
+        self.assertEquals(results[0:2], [ref])
@@ -14,9 +14,11 @@ from apps.plus_lib.search import side_search_args, listing_args
 from apps.plus_permissions.interfaces import secure_wrap
 from apps.plus_permissions.exceptions import PlusPermissionsNoAccessException
 
-from django.db.models import Q
+from django.db.models import Q, Count
 import settings
 from apps.plus_explore.forms import SearchForm
+from apps.plus_explore.relevance import relevance_ids, RelevanceResults
+from apps.plus_explore import rss_cache
 
 def index(request, template_name="plus_explore/explore.html"):
     form = SearchForm(request.GET)
@@ -111,7 +113,7 @@ def filter(request, tag_string, template_name='plus_explore/explore_filtered.htm
     side_search = side_search_args('', '')
     search_types = get_search_types()
     head_title = settings.EXPLORE_NAME
-    listing_args_dict = listing_args('explore', 'explore_filtered', tag_string=tag_string, search_terms=search, multitabbed=True, order=order, template_base="site_base.html", search_type_label=head_title)
+    listing_args_dict = listing_args('explore', 'explore_filtered', tag_string=tag_string, search_terms=search, multitabbed=True, order=order, template_base="site_base.html", search_type_label=head_title, cursor_paginate=True)
     search_dict = plus_search(listing_args_dict['tag_filter'], search, search_types, order)
     
     return render_to_response(template_name, {'head_title':head_title, 
@@ -124,67 +126,139 @@ from django.utils.feedgenerator import Rss201rev2Feed, Enclosure
 
 # XXX needs refactoring 
 def rss_explore(request, tag_string, s_type=None) :
-    from apps.plus_lib.redis_lib import redis
     feed_type = 'rss2.0' # XXX decide how to send this as parameter to link
-    key = "feed:"+feed_type+":"+tag_string
-    if redis.exists(key) :
-        return HttpResponse(redis.get(key),mimetype="application/xhtml+xml")
+
+    form = SearchForm(request.GET)
+    if form.is_valid():
+        search, order = set_search_order(request, form)
+    else:
+        search = ''
+        order = ''
+
+    head_title = settings.EXPLORE_NAME
+    listing_args_dict = listing_args('explore', 'explore_filtered', tag_string=tag_string, search_terms=search, multitabbed=True, order=order, template_base="site_base.html", search_type_label=head_title)
+
+    # everyone who isn't logged in sees the same feed, so theirs is cached until something in it changes
+    # (AnonUserMiddleware gives them the anon User, for which only is_authenticated() tells)
+    cacheable = not request.user.is_authenticated() and not search
+    if cacheable :
+        key = rss_cache.feed_key(feed_type, tag_string, s_type, order)
+        cached = rss_cache.get(key, listing_args_dict['tag_filter'])
+        if cached :
+            return rss_cache.response(request, cached)
+        feed_versions = rss_cache.versions(listing_args_dict['tag_filter'])
+
+    feed = Rss201rev2Feed(title=settings.SITE_NAME+" : "+tag_string,
+                          link='http://'+settings.DOMAIN_NAME+reverse('explore_filtered_feed',args=(tag_string,)),
+                          description=_("Items tagged with %s" % tag_string) )
+    # XXX decide how to parameterize which feed type, title, description, link
+
+    if s_type :
+        search_types = narrow_search_types(s_type)
     else :
-        feed = Rss201rev2Feed(title=settings.SITE_NAME+" : "+tag_string,
-                              link='http://'+settings.DOMAIN_NAME+reverse('explore_filtered_feed',args=(tag_string,)),
-                              description=_("Items tagged with %s" % tag_string) )
-        # XXX decide how to parameterize which feed type, title, description, link
-
-        form = SearchForm(request.GET)
-        if form.is_valid():
-            search, order = set_search_order(request, form)
-        else:
-            search = ''
-            order = ''
-
-        side_search = side_search_args('', '')
-
-        if s_type :
-            search_types = narrow_search_types(s_type)
-        else :
-            search_types = get_search_types()
-
-        head_title = settings.EXPLORE_NAME
-        listing_args_dict = listing_args('explore', 'explore_filtered', tag_string=tag_string, search_terms=search, multitabbed=True, order=order, template_base="site_base.html", search_type_label=head_title)
-        search_dict = plus_search(listing_args_dict['tag_filter'], search, search_types, order)
-
-        for item_ref in search_dict['All']:
-            item = item_ref.obj
-            item=secure_wrap(item,request.user)
-
-            try :
-                feed.add_item(title=item.get_display_name(), 
-                          link=item.get_url(), 
-                          description=item.get_description(),
-                          author_name=item.get_author_name(),
-                          author_copyright=item.get_author_copyright(),
-                          pubdate=item.get_created_date(),
-                          **(item.get_feed_extras())
-                          )
-            except PlusPermissionsNoAccessException, e :
-                pass
-
-
-        feed_string = feed.writeString('utf-8')
-        # uncomment the following when we start to cache
-        #redis.set(key,feed_string)
-        #redis.expire(key,60*60*1) # sets expire every 1 hour
-        return HttpResponse(feed_string, mimetype="application/xhtml+xml")
+        search_types = get_search_types()
 
-        
+    search_dict = plus_search(listing_args_dict['tag_filter'], search, search_types, order)
 
+    for item_ref in search_dict['All']:
+        item = item_ref.obj
+        item=secure_wrap(item,request.user)
+
+        try :
+            feed.add_item(title=item.get_display_name(), 
+                      link=item.get_url(), 
+                      description=item.get_description(),
+                      author_name=item.get_author_name(),
+                      author_copyright=item.get_author_copyright(),
+                      pubdate=item.get_created_date(),
+                      **(item.get_feed_extras())
+                      )
+        except PlusPermissionsNoAccessException, e :
+            pass
+
+    feed_string = feed.writeString('utf-8')
+    if cacheable :
+        return rss_cache.response(request, rss_cache.store(key, feed_versions, feed_string))
+    return HttpResponse(feed_string, mimetype=rss_cache.MIMETYPE)
+
+        
 
 
+# what GenericReference.listed means, for each type which can be listed. The saves set it for one object, this is
+# only used to set it in bulk (see scripts/version_patches/oct18.py)
 object_type_filters = {Resource:{'stub':False},
                        WikiPage:{'stub':False},
                        Profile:{'user__active':True},
                        TgGroup:{}}
 
+listed_models = [cls.__name__.lower() for cls in object_type_filters]
+
+def search_type_models(search_types):
+    """ the content type models the search types are made of, or None if they're not just content types.
+    (TgGroup types, eg. hubs or virtual groups, are counted as all TgGroups) """
+    models = []
+    for typ, info in search_types:
+        if info[1] or not info[0]:
+            return None
+        for key, value in info[0].items():
+            if key == 'content_type__model':
+                models.append(value)
+            elif key == 'content_type__model__in':
+                models.extend(value)
+            elif key != 'object_id__in':
+                return None
+    return list(set(models))
+
+def type_items(items, info):
+    """ items narrowed to one search type """
+    if info[0]:
+        items = items.filter(**info[0])
+    if info[1]:
+        items = items.exclude(**info[1])
+    return items
+
+def object_ids_of(objs):
+    if hasattr(objs, 'values_list'):
+        return objs.values_list('id', flat=True)
+    return [getattr(obj, 'id', obj) for obj in objs]
+
+def search_type_counts(items, search_types):
+    """ {search type : how many of items are of that type}. One GROUP BY content type for all the types, the types
+    which pick out particular objects (eg. hubs, among the groups) are then split out by object id """
+    by_model = {}
+    for row in items.order_by().values('content_type__model').annotate(count=Count('id')):
+        by_model[row['content_type__model']] = row['count']
+
+    object_ids = {}
+    counts = {}
+    for typ, info in search_types:
+        include, exclude = dict(info[0] or {}), dict(info[1] or {})
+        models = include.pop('content_type__model__in', []) or [include.pop('content_type__model', None)]
+        wanted = include.pop('object_id__in', None)
+        unwanted = exclude.pop('object_id__in', None)
+        if include or exclude or None in models:
+            # not just content type and objects, ask the database
+            counts[typ] = type_items(items, info).count()
+            continue
+
+        count = 0
+        for model in models:
+            if not by_model.get(model):
+                continue
+            if wanted is None and unwanted is None:
+                count += by_model[model]
+                continue
+            if model not in object_ids:
+                object_ids[model] = set(items.filter(content_type__model=model).values_list('object_id', flat=True))
+            ids = object_ids[model]
+            if wanted is not None:
+                ids = ids.intersection(object_ids_of(wanted))
+            if unwanted is not None:
+                ids = ids.difference(object_ids_of(unwanted))
+            count += len(ids)
+        counts[typ] = count
+    return counts
+
 def plus_search(tags, search, search_types, order=None, in_group=None, extra_filter=None):
     items = get_resources_for_tag_intersection(tags)
     q = None
@@ -206,29 +280,11 @@ def plus_search(tags, search, search_types, order=None, in_group=None, extra_fil
     if q:
         items = items.filter(q)
 
-    included = None
-    for obj_class, included_filter in object_type_filters.items():
-        objs = obj_class.objects.filter(**included_filter)
-        included_search = {'content_type__model':obj_class.__name__.lower(),
-                           'object_id__in':objs}
-        
-        if not included:
-            included = Q(**included_search)
-        included = included | Q(**included_search)
-
-    items = items.filter(included)
+    # GenericReference.listed and .owner are kept up to date by the objects' saves (see object_type_filters)
+    items = items.filter(listed=True, content_type__model__in=listed_models)
 
     if in_group:
-        # this should be implemented using the code just above and an external search filter arg
-        page_ids = WikiPage.objects.filter(in_agent=in_group, stub=False)
-        wikipages = Q(**{'content_type__model':'wikipage',
-                         'object_id__in':page_ids})
-        resource_ids = Resource.objects.filter(in_agent=in_group, stub=False)
-        resources = Q(**{'content_type__model':'resource',
-                         'object_id__in':resource_ids})
-
-        q = resources | wikipages
-        items = items.filter(q)
+        items = items.filter(owner=in_group, content_type__model__in=['wikipage', 'resource'])
  
     results_map = {}
     tag_intersection = []
@@ -236,26 +292,24 @@ def plus_search(tags, search, search_types, order=None, in_group=None, extra_fil
         results = RelatedSearchQuerySet().auto_query(search)
         results_map = {}
         if results:
-            all_results = results.load_all_queryset(GenericReference, items)
+            # just the ids from the fulltext index, filtered here by the database
             if order == 'relevance':
-                all_results = all_results.load_all()  # this bit is quite evil and makes things really inefficient for large searches
-                                              # a better approach would be to get all the ids directly from the fulltext index and use them as a filter for GenericReferences 
-                results_map['All'] = [item.object for item in all_results]   #we really really shouldn't do this 
+                # refs are only loaded for the page which gets shown
+                results_map['All'] = RelevanceResults(relevance_ids(results), items)
                 items_len = len(results_map['All'])
             else:
-                search_results = [result.pk for result in all_results]
-                results_map['All'] = items.filter(id__in=search_results).order_by(order)
+                # reordered, so the best RELEVANCE_LIMIT wouldn't be the first of anything : all the matches
+                results_map['All'] = items.filter(id__in=relevance_ids(results, limit=None)).order_by(order)
                 items_len = results_map['All'].count()
         else:
             results_map = {'All':EmptySearchQuerySet()}
             items_len = 0
     else:
-        if items:
-            items = items.order_by('creator')
-            items_len = items.count()
+        items = items.order_by('creator')
+        items_len = items.count()
+        if items_len:
             results_map['All'] = items
         else:
-            items_len = 0
             results_map = {'All':EmptySearchQuerySet()}            
 
     if order == 'modified':
@@ -264,32 +318,34 @@ def plus_search(tags, search, search_types, order=None, in_group=None, extra_fil
         results_map['All'] = results_map['All'].order_by(order)        
 
     if 'All' in results_map:
-        tag_intersection = get_intersecting_tags(results_map['All'], n=15)
+        if search or in_group or extra_filter:
+            tagged_items = results_map['All']
+            if isinstance(tagged_items, RelevanceResults):
+                tagged_items = tagged_items.ids
+            tag_intersection = get_intersecting_tags(tagged_items, n=15)
+        else:
+            tag_intersection = get_intersecting_tags(results_map['All'], n=15, keywords=tags, models=search_type_models(search_types))
 
-        if len(search_types) > 1:
+        if len(search_types) > 1 and items_len:
+            all_items = results_map['All']
+            if isinstance(all_items, RelevanceResults):
+                all_items = GenericReference.objects.filter(id__in=all_items.ids)
+            type_counts = search_type_counts(all_items, search_types)
             for typ, info in search_types:
-                if info[0]:
-                    typ_items = items.filter(**info[0])
-                if info[1]:
-                    typ_items = items.exclude(**info[1])
-                if search and results and order == 'relevance':
-                        # why do this again when we could just separate results using python
-                        typ_items = all_results.load_all_queryset(GenericReference, typ_items)
-                        typ_items = [item.object for item in typ_items] #we really really shouldn't do this
-                if typ_items:
-                    results_map[typ] = typ_items
+                if not type_counts[typ]:
+                    continue
+                if isinstance(results_map['All'], RelevanceResults):
+                    # the same ranked ids, split by type with an id only query
+                    results_map[typ] = results_map['All'].narrow(type_items(items, info))
+                else:
+                    results_map[typ] = type_items(results_map['All'], info)
     else:
         results_map = {'All':EmptySearchQuerySet()}
 
     search_type_data = []
     for typ, data in search_types:
         if results_map.has_key(typ):
-            try:
-                type_len = results_map[typ].count()
-            except TypeError:
-                type_len = len(results_map[typ])
-            
-            search_type_data.append((typ, data[2], results_map[typ], type_len))
+            search_type_data.append((typ, data[2], results_map[typ], type_counts[typ]))
 
     return {'All':results_map['All'], 'items_len':items_len, 'search_types':search_type_data, 'tag_intersection':tag_intersection}
 
@@ -0,0 +1,304 @@
+""" Fan-out of new FeedItems to their readers' redis feeds, off the web request.
+
+update_followers just pushes the item id onto a redis queue. The feed_worker management command pops ids off
+it and calls deliver, which checks FeedItem.Viewer for every follower at once (agents_with_access), pushes the
+item to all of their feeds in one pipeline, trims each feed to FEED_LENGTH and sends any @reply email.
+
+A feed is a redis sorted set of item ids scored by when they were sent (see score), so it's always in order
+whatever order items arrive in, re-adding an item is harmless, and pages before / after a time are range queries.
+
+Each worker pops an id onto a processing list of its own (BRPOPLPUSH) and only removes it once the item's been
+delivered, so a worker that's killed mid-delivery loses nothing : feed_worker --recover, run while no workers are,
+puts what they were holding back on the queue. (Needs redis 2.2 or later.)
+
+Inside a request the ids are held back until FeedDeliveryMiddleware sees the response, ie. after
+TransactionMiddleware has committed the items, otherwise the worker could pop an id before the item exists for it.
+
+With FEED_DELIVERY_QUEUE = False in settings, update_followers calls deliver directly, as it always used to.
+
+Delivery only adds to feeds which already exist. A reader with no feed (new, or redis has been flushed) gets one
+from rebuild_feed the next time it's read : the newest items of each source they follow, merged by sent, permission
+checked in bulk and trimmed to FEED_LENGTH. warm_feeds does the same ahead of time for recent visitors.
+"""
+
+import os
+import sys
+import heapq
+import socket
+import time
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.utils.translation import ugettext as _
+
+from apps.plus_lib.redis_lib import redis
+from apps.plus_permissions.models import GenericReference, agents_with_access, get_refs_for, secure_filter, strip_wrapper
+from apps.microblogging.models import Following
+
+USE_QUEUE = getattr(settings, 'FEED_DELIVERY_QUEUE', True)
+FEED_LENGTH = getattr(settings, 'FEED_LENGTH', 500)
+# how far back into each followed source a rebuild looks
+REBUILD_PER_SOURCE = getattr(settings, 'FEED_REBUILD_PER_SOURCE', 100)
+
+
+def queue_key() :
+    return "feed_delivery_queue:%s" % settings.DOMAIN_NAME
+
+def worker_name() :
+    return "%s:%s" % (socket.gethostname(), os.getpid())
+
+def processing_key(worker=None) :
+    """ the ids worker (by default, this process) has taken off the queue but not finished with """
+    return "feed_delivery_processing:%s:%s" % (settings.DOMAIN_NAME, worker or worker_name())
+
+def feed_key_for_ref_id(ref_id) :
+    """ same as plus_feed.models.feed_for_key, when we already have the GenericReference """
+    return "feed_timeline:%s:%s" % (settings.DOMAIN_NAME, ref_id)
+
+def score(sent) :
+    """ a datetime as the float seconds we order feeds by, and use as the before / after cursors """
+    return time.mktime(sent.timetuple()) + sent.microsecond / 1000000.0
+
+def add_to_feed(pipe, key, items) :
+    for item in items :
+        pipe.zadd(key, item.id, score(item.sent))
+    # keep the newest FEED_LENGTH
+    pipe.zremrangebyrank(key, 0, -(FEED_LENGTH + 1))
+
+
+_local = threading.local()
+
+def start() :
+    _local.pending = []
+
+def flush() :
+    """ queue the items held back during the request, now that they're committed """
+    pending = getattr(_local, 'pending', None)
+    _local.pending = None
+    if pending :
+        pipe = redis.pipeline()
+        for item_id in pending :
+            pipe.lpush(queue_key(), item_id)
+        pipe.execute()
+
+def discard() :
+    """ the request failed, so its items were rolled back """
+    _local.pending = None
+
+def enqueue(item) :
+    pending = getattr(_local, 'pending', None)
+    if pending is not None :
+        pending.append(item.id)
+    else :
+        redis.lpush(queue_key(), item.id)
+
+def queue_length() :
+    return redis.llen(queue_key())
+
+
+def followers_of(source) :
+    """ like Following.objects.followers_of but loads the followers with one query per type rather than one each """
+    ctype = ContentType.objects.get_for_model(source)
+    ids_by_type = {}
+    for type_id, object_id in Following.objects.filter(followed_content_type__pk=ctype.id,
+                                                       followed_object_id=source.id).values_list('follower_content_type', 'follower_object_id') :
+        ids_by_type.setdefault(type_id, []).append(object_id)
+
+    followers = []
+    for type_id, ids in ids_by_type.iteritems() :
+        cls = ContentType.objects.get_for_id(type_id).model_class()
+        followers.extend(cls.objects.filter(id__in=ids))
+    return followers
+
+
+def push_to_feeds(item, agents) :
+    """ push item onto the feed of each of agents, keeping each feed to FEED_LENGTH items. Feeds which don't
+    exist are left alone, a partial feed would stop them being rebuilt. Two round trips to redis """
+    refs = get_refs_for(agents)
+    keys = [feed_key_for_ref_id(refs[(a.__class__, a.id)].id) for a in agents if (a.__class__, a.id) in refs]
+
+    pipe = redis.pipeline()
+    for key in keys :
+        pipe.exists(key)
+    existing = [key for key, exists in zip(keys, pipe.execute()) if exists]
+
+    pipe = redis.pipeline()
+    for key in existing :
+        add_to_feed(pipe, key, [item])
+    pipe.execute()
+
+
+def deliver(item) :
+    """ put item in the feeds of everyone following its source who can see it, and in the feed of anyone it @replies to """
+    from apps.plus_feed.models import reply_rex
+    item = strip_wrapper(item)
+    source = item.source.obj
+    readers = agents_with_access(followers_of(source), item, 'FeedItem.Viewer')
+
+    replied = None
+    # if we mention someone in tweet ... add it to their queue and forward them a mail
+    if '@' in item.short :
+        match = reply_rex.match(item.short)
+        if match :
+            replieds = User.objects.filter(username=match.group(2))
+            if replieds :
+                replied = replieds[0]
+                if replied not in readers :
+                    readers.append(replied)
+
+    push_to_feeds(item, readers)
+
+    if replied :
+        email_reply(source, item, replied)
+    return readers
+
+
+def email_reply(source, item, replied) :
+    expanded = '\n\n%s'%item.expanded if (item.expanded and item.expanded != item.short) else ''
+    click = u'%s : %s' % (_('Follow this link to the item'),
+                          ('http://%s%s'%(settings.DOMAIN_NAME,
+                                          reverse('feed_item',args=[int(item.id)])
+                                          )
+                           )
+                          )
+    msg = u"""%s %s %s
+
+%s%s
+
+%s
+"""% (source.get_display_name(), 'has replied to you on', settings.SITE_NAME_SHORT, item.short, expanded, click)
+    replied.email_user(u'%s %s' %(_('Message from'),source.get_display_name()), msg, settings.SUPPORT_EMAIL)
+
+
+def followed_source_ref_ids(agent) :
+    """ the GenericReference ids of everything agent follows, without loading the things themselves """
+    ctype = ContentType.objects.get_for_model(agent)
+    ids_by_type = {}
+    for type_id, object_id in Following.objects.filter(follower_content_type__pk=ctype.id,
+                                                       follower_object_id=agent.id).values_list('followed_content_type', 'followed_object_id') :
+        ids_by_type.setdefault(type_id, []).append(object_id)
+
+    ref_ids = []
+    for type_id, ids in ids_by_type.iteritems() :
+        ref_ids.extend(GenericReference.objects.filter(content_type=type_id, object_id__in=ids).values_list('id', flat=True))
+    return ref_ids
+
+def sort_key(item) :
+    """ newest first, for heapq, which pops the smallest """
+    return (-score(item.sent), -item.id)
+
+def merge_newest(ref_ids, per_source) :
+    """ k-way merge of the newest per_source items from each of the sources, newest first.
+    One query per source, each only run when the merge first needs something from it """
+    from apps.plus_feed.models import FeedItem
+    heap = []
+    for ref_id in ref_ids :
+        stream = iter(FeedItem.objects.filter(source=ref_id).order_by('-sent', '-id')[:per_source])
+        for item in stream :
+            heap.append((sort_key(item), item, stream))
+            break
+    heapq.heapify(heap)
+    while heap :
+        key, item, stream = heap[0]
+        yield item
+        for following in stream :
+            heapq.heapreplace(heap, (sort_key(following), following, stream))
+            break
+        else :
+            heapq.heappop(heap)
+
+def rebuild_feed(key, agent, length=None) :
+    """ write the newest length (default FEED_LENGTH) items agent may see from what it follows to the feed at key.
+    Returns their ids, newest first """
+    length = length or FEED_LENGTH
+    items = []
+    merged = merge_newest(followed_source_ref_ids(agent), REBUILD_PER_SOURCE)
+    exhausted = False
+    while len(items) < length and not exhausted :
+        candidates = []
+        for item in merged :
+            candidates.append(item)
+            if len(candidates) == length :
+                break
+        exhausted = len(candidates) < length
+        items.extend(secure_filter(agent, candidates, 'Viewer'))
+    items = items[:length]
+
+    # no delete first : anything delivered meanwhile is kept, in its proper place
+    pipe = redis.pipeline()
+    add_to_feed(pipe, key, items)
+    pipe.execute()
+    return [item.id for item in items]
+
+
+def read_feed(key, start=0, stop=39, before=None, after=None) :
+    """ ids from the feed at key, newest first. With before (a score), the stop - start + 1 items sent
+    before it (the next page of an infinite scroll). With after, everything newer than it, up to the same
+    number (polling for what's new) """
+    count = stop - start + 1
+    if after is not None :
+        return redis.zrevrangebyscore(key, '+inf', '(%r' % after, start=0, num=count)
+    if before is not None :
+        return redis.zrevrangebyscore(key, '(%r' % before, '-inf', start=0, num=count)
+    return redis.zrevrange(key, start, stop)
+
+
+def warm_feeds(days=30) :
+    """ rebuild the missing feeds of everyone who has logged in during the last days (eg. after redis has
+    been restarted), so they don't each pay for it on their next visit. Returns how many were rebuilt """
+    since = datetime.now() - timedelta(days=days)
+    users = User.objects.filter(last_login__gte=since)
+    refs = get_refs_for(users)
+    rebuilt = 0
+    for user in users :
+        ref = refs.get((user.__class__, user.id))
+        if not ref :
+            continue
+        key = feed_key_for_ref_id(ref.id)
+        if not redis.exists(key) :
+            rebuild_feed(key, user)
+            rebuilt = rebuilt + 1
+    return rebuilt
+
+
+def recover() :
+    """ put back on the queue whatever workers had taken but not delivered. Only for when no worker is running,
+    since a running worker's items look just the same. Returns how many were put back """
+    recovered = 0
+    for key in redis.keys(processing_key('*')) :
+        while redis.rpoplpush(key, queue_key()) is not None :
+            recovered = recovered + 1
+    return recovered
+
+
+def work(timeout=0, once=False) :
+    """ deliver items from the queue as they arrive. If once, stop when the queue is empty. Returns how many were delivered """
+    from apps.plus_feed.models import FeedItem
+    processing = processing_key()
+    delivered = 0
+    while True :
+        if once :
+            item_id = redis.rpoplpush(queue_key(), processing)
+            if item_id is None :
+                return delivered
+        else :
+            item_id = redis.brpoplpush(queue_key(), processing, timeout)
+            if item_id is None :
+                continue
+
+        try :
+            deliver(FeedItem.objects.get(id=int(item_id)))
+            delivered = delivered + 1
+        except FeedItem.DoesNotExist :
+            # deleted before we got to it
+            pass
+        except Exception, e :
+            # one bad item mustn't stop everyone else's feeds
+            sys.stderr.write('failed to deliver feed item %s\n' % item_id)
+            traceback.print_exc()
+        redis.lrem(processing, item_id)
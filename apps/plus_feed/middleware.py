@@ -0,0 +1,17 @@
+from apps.plus_feed import delivery
+
+class FeedDeliveryMiddleware(object) :
+    """ holds back the feed items posted during a request and only queues them for the feed_worker once the
+    response is on its way. Must come before TransactionMiddleware, so that it sees the response after the commit """
+
+    def process_request(self, request):
+        delivery.start()
+        return None
+
+    def process_response(self, request, response):
+        delivery.flush()
+        return response
+
+    def process_exception(self, request, exception):
+        delivery.discard()
+        return None
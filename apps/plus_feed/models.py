@@ -54,7 +54,7 @@ def if_FEED_ON(f) :
 # feed items are the only data in the table, but reader feeds are cached in redis
  
 def feed_for_key(agent) :
-    return "feed_personal_key:%s:%s" % (settings.DOMAIN_NAME, agent.get_ref().id)
+    return "feed_timeline:%s:%s" % (settings.DOMAIN_NAME, agent.get_ref().id)
 
 def clip(s) :
     if len(s) > 140 :
@@ -62,22 +62,9 @@ def clip(s) :
     return s
 
 def recreate_feed(key, agent) :
-    """ Recreates the queue of feed items for agent """
-    from apps.plus_permissions.interfaces import secure_wrap
-    subscriptions = Following.objects.followed_by(agent)
-
-    ids = set([])
-    for sub in subscriptions :
-        for item in FeedItem.feed_manager.get_from(sub) :
-            secure_item = secure_wrap(item, agent) 
-            if secure_item.has_interface('FeedItem.Viewer') :
-                ids.add(item.id)
-
-    pipe = redis.pipeline()
-    for item_id in ids :
-        pipe.lpush(key, item_id)
-    pipe.execute()
-    return ids
+    """ Recreates the queue of feed items for agent (see delivery.rebuild_feed), returning the ids newest first """
+    from apps.plus_feed.delivery import rebuild_feed
+    return rebuild_feed(key, agent)
 
 class FeedManager(models.Manager) :
     def get_from(self, source) :
@@ -85,55 +72,36 @@ class FeedManager(models.Manager) :
         return self.filter(source=source.get_ref()).order_by('-sent')
 
     def get_from_permissioned(self, source, user) :
-        from apps.plus_permissions.interfaces import secure_wrap
-
-        rets = []
-        # absurdly inefficient
-        count = 0
-        for fi in self.get_from(source) :
-            sfi = secure_wrap(fi,user) 
-            try :
-                sfi.source
-                rets.append(sfi)
-                count=count+1
-                if count > 50 : 
-                    break
-            except Exception, e:
-                pass
-
-        return rets
-
-    def get_for(self, receiver, start_stop = None) :
+        """ the newest items from source which user may see (see timeline). Like get_for, these are plain
+        FeedItems rather than SecureWrappers : they've all passed FeedItem.Viewer, which is all the listing
+        templates (tweet_listing) need """
+        from apps.plus_feed.timeline import source_timeline
+        return self.filter(id__in=source_timeline(source, user)).order_by('-sent')
+
+    def get_for(self, receiver, start_stop = None, before=None, after=None) :
         """ Feed items for receiver.
-        If we already have a redis list for this receiver, then just pull from it,
+        If we already have a redis feed for this receiver, then just pull from it,
         otherwise, recreate from db
-        receiver is user or group"""
+        receiver is user or group
+        before / after are cursors (see feed_cursor) for the page older than, or everything newer than, an item"""
+        from apps.plus_feed.delivery import read_feed
 
         key = feed_for_key(receiver)
-        if redis.exists(key) :
-            if not start_stop :
-                start,stop=[0,39]
-            else :
-                start,stop = start_stop
-            ids = redis.lrange(key,start,stop)
+        if not start_stop :
+            start,stop=[0,39]
         else :
-            # ok, we're going to recreate the whole feed again
-            ids = recreate_feed(key, receiver)
+            start,stop = start_stop
+        if not redis.exists(key) :
+            # ok, we're going to recreate the feed again (just the newest FEED_LENGTH)
+            recreate_feed(key, receiver)
+        ids = read_feed(key, start, stop, before=before, after=after)
 
         return self.filter(id__in=ids).order_by('-sent')
 
     def all_permissioned(self, agent) :
-
-        from apps.plus_permissions.interfaces import secure_wrap
-        def test(x):
-            sx = secure_wrap(x, agent)
-            return sx.has_interface('FeedItem.Viewer')
-
-        cutoff = 50
-        # horribly inefficient, restrict to cutoff for all items
-        allowed = [x.id for x in self.all().order_by('-sent')[0:cutoff] 
-                   if test(x)]
-        return self.filter(id__in=allowed).order_by('-sent')
+        """ the newest items from anyone which agent may see """
+        from apps.plus_feed.timeline import global_timeline
+        return self.filter(id__in=global_timeline(agent)).order_by('-sent')
 
     def get_status(self, source) :
         feed = self.get_from(source).filter(type=0)
@@ -142,40 +110,15 @@ class FeedManager(models.Manager) :
         raise FeedItem.DoesNotExist()
 
     @if_FEED_ON
-    def update_followers(self, source, item) :            
-        from apps.plus_permissions.interfaces import secure_wrap
-        for f in Following.objects.followers_of(source) :
-            # test permission
-            secure_item = secure_wrap(item,f)
-            if secure_item.has_interface('FeedItem.Viewer') :
-                key = feed_for_key(f)
-                redis.lpush(key,item.id)
-
-        # if we mention someone in tweet ... add it to their queue and forward them a mail
-        if '@' in item.short :   
-            match = reply_rex.match(item.short)
-
-            if match :
-                replieds = User.objects.filter(username=match.group(2))
-                if replieds :
-                    replied = replieds[0]
-                    key = feed_for_key(replied)
-                    redis.lpush(key,item.id)
-                    expanded = '\n\n%s'%item.expanded if (item.expanded and item.expanded != item.short) else ''
-                    click = u'%s : %s' % (_('Follow this link to the item'),
-                                          ('http://%s%s'%(settings.DOMAIN_NAME,
-                                                          reverse('feed_item',args=[int(item.id)])
-                                                          )
-                                           )
-                                          )
-                    msg = u"""%s %s %s
-
-%s%s
-
-%s
-"""% (source.get_display_name(), 'has replied to you on', settings.SITE_NAME_SHORT, item.short, expanded, click)
-                    replied.email_user(u'%s %s' %(_('Message from'),source.get_display_name()), msg, settings.SUPPORT_EMAIL)
-
+    def update_followers(self, source, item) :
+        """ get item into the feeds of source's followers (see delivery). Normally that's done later by the
+        feed_worker, so posting doesn't wait for every follower's permission check and feed """
+        from apps.plus_feed import delivery, timeline
+        timeline.add_item(item)
+        if delivery.USE_QUEUE :
+            delivery.enqueue(item)
+        else :
+            delivery.deliver(item)
         return item
 
 
@@ -198,6 +141,11 @@ class FeedItem(models.Model) :
     def __repr__(self) :
         return "<FeedItem %s, from %s, '%s'>" % (self.id, self.source.obj, self.short)
 
+    def feed_cursor(self) :
+        """ where this item is in a feed, for get_for's before / after """
+        from apps.plus_feed.delivery import score
+        return '%r' % score(self.sent)
+
     def has_avatar(self) :
         return (self.source.obj.__class__.__name__ in ['User','TgGroup'])
 
@@ -378,7 +326,13 @@ class FeedItem(models.Model) :
 
 
 
+    def security_context_changed(self) :
+        from apps.plus_feed.timeline import context_changed
+        context_changed(self)
+
     def delete(self) :
+        from apps.plus_feed.timeline import remove_item
+        remove_item(self)
         # permissions
         ref = self.get_ref()    
         ref.delete()
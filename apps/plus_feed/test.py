@@ -1,12 +1,133 @@
 
 import unittest
+from datetime import datetime, timedelta
 
-from apps.plus_feed.models import FeedItem
+from apps.plus_feed.models import FeedItem, STATUS, feed_for_key
+from apps.plus_feed import delivery
 from django.contrib.auth.models import User
 
 from apps.microblogging.models import Following
+from apps.plus_groups.models import TgGroup
+from apps.plus_lib.redis_lib import redis
+from apps.plus_permissions.models import SecurityTag
 
-phil = User.objects.get(username='phil.jones')
-print [x for x in Following.objects.followers_of(phil)]
 
-print [x for x in Following.objects.followed_by(phil)]
+class FakeItem(object) :
+    def __init__(self, id, sent) :
+        self.id = id
+        self.sent = sent
+
+
+class TestDelivery(unittest.TestCase) :
+
+    def post(self, sender, short, sent) :
+        return sender.create_FeedItem(sender.get_creator(), type=STATUS, source=sender.get_ref(),
+                                      short=short, sent=sent).get_inner()
+
+    def test_merge_newest(self) :
+        god = User(username='Hermes', email_address='hermes@the-hub.net')
+        god.save()
+        group, created = TgGroup.objects.get_or_create(group_name='olympus', display_name='Olympus',
+                                                       place=None, level='member', user=god)
+        start = datetime(2010, 1, 1)
+        # interleaved in time, and more from each than per_source
+        from_god = [self.post(god, 'god %s' % i, start + timedelta(hours=2 * i)) for i in range(4)]
+        from_group = [self.post(group, 'group %s' % i, start + timedelta(hours=2 * i + 1)) for i in range(4)]
+
+        merged = list(delivery.merge_newest([god.get_ref().id, group.get_ref().id], 3))
+        self.assertEquals([item.id for item in merged],
+                          [from_group[3].id, from_god[3].id, from_group[2].id, from_god[2].id,
+                           from_group[1].id, from_god[1].id])
+
+    def test_add_and_read(self) :
+        key = 'test_feed:%s' % self.__class__.__name__
+        redis.delete(key)
+        length = delivery.FEED_LENGTH
+        delivery.FEED_LENGTH = 3
+        try :
+            start = datetime(2010, 1, 1)
+            items = [FakeItem(i, start + timedelta(minutes=i)) for i in range(1, 6)]
+            pipe = redis.pipeline()
+            # in any order, and twice over
+            delivery.add_to_feed(pipe, key, [items[4], items[0], items[2], items[1], items[3], items[2]])
+            pipe.execute()
+
+            # only the newest FEED_LENGTH are kept, newest first
+            self.assertEquals(delivery.read_feed(key), ['5', '4', '3'])
+            self.assertEquals(delivery.read_feed(key, 0, 1), ['5', '4'])
+            # pages either side of an item
+            middle = delivery.score(items[3].sent)
+            self.assertEquals(delivery.read_feed(key, 0, 9, before=middle), ['3'])
+            self.assertEquals(delivery.read_feed(key, 0, 9, after=middle), ['5'])
+        finally :
+            delivery.FEED_LENGTH = length
+            redis.delete(key)
+
+    def test_deliver(self) :
+        god = User(username='Iris', email_address='iris@the-hub.net')
+        god.save()
+        group, created = TgGroup.objects.get_or_create(group_name='rainbow', display_name='Rainbow',
+                                                       place=None, level='member', user=god)
+        reader = User(username='noah', email_address='noah@the-hub.net')
+        reader.save()
+        group.add_member(reader)
+        Following.objects.follow(reader, group)
+
+        # the feed is built from what's there on first reading, after that items are delivered to it
+        first = self.post(group, 'cloud', datetime.now() - timedelta(minutes=1))
+        key = feed_for_key(reader)
+        FeedItem.feed_manager.get_for(reader)
+        self.assertTrue(str(first.id) in delivery.read_feed(key))
+        self.assertTrue(redis.exists(key))
+
+        queue = delivery.USE_QUEUE
+        delivery.USE_QUEUE = True
+        try :
+            item = self.post(group, 'arc', datetime.now())
+            FeedItem.feed_manager.update_followers(group, item)
+            # queued, not delivered
+            self.assertFalse(str(item.id) in delivery.read_feed(key))
+            delivery.work(once=True)
+            self.assertTrue(str(item.id) in delivery.read_feed(key))
+            self.assertEquals(redis.llen(delivery.processing_key()), 0)
+        finally :
+            delivery.USE_QUEUE = queue
+
+    def test_made_private(self) :
+        god = User(username='Nyx', email_address='nyx@the-hub.net')
+        god.save()
+        group, created = TgGroup.objects.get_or_create(group_name='night', display_name='Night',
+                                                       place=None, level='member', user=god)
+        other = User(username='hemera', email_address='hemera@the-hub.net')
+        other.save()
+        group.add_member(other)
+
+        item = self.post(group, 'secret', datetime.now())
+        FeedItem.feed_manager.update_followers(group, item)
+        self.assertTrue(item in FeedItem.feed_manager.get_from_permissioned(group, other))
+
+        # a context of its own, which only god may see
+        sc = item.create_custom_security_context()
+        tag = SecurityTag.objects.get(security_context=sc, interface='FeedItem.Viewer')
+        tag.remove_agents(list(tag.agents.all()))
+        tag.add_agents([god.get_ref()])
+
+        self.assertFalse(item in FeedItem.feed_manager.get_from_permissioned(group, other))
+        self.assertTrue(item in FeedItem.feed_manager.get_from_permissioned(group, god))
+
+    def test_recover(self) :
+        dead = delivery.processing_key('dead-worker:1')
+        redis.delete(dead)
+        redis.lpush(dead, 12345)
+        before = delivery.queue_length()
+        self.assertEquals(delivery.recover(), 1)
+        self.assertEquals(delivery.queue_length(), before + 1)
+        self.assertFalse(redis.exists(dead))
+        redis.lrem(delivery.queue_key(), 12345)
+
+
+if __name__ == "__main__" :
+    phil = User.objects.get(username='phil.jones')
+    print [x for x in Following.objects.followers_of(phil)]
+
+    print [x for x in Following.objects.followed_by(phil)]
@@ -0,0 +1,208 @@
+""" The newest FeedItems from one source (for a group or profile page), or from everyone, that a viewer may see.
+
+Rather than wrapping each item in turn until enough pass, we sort a source's items into visibility classes. The
+class of an item is its security context, so all the items of a class are visible to exactly the same agents
+(typically a source has just one or two : everything acquired from the group, or from the profile, plus the odd
+custom context). The classes of each source are kept in redis and added to as items are posted (add_item).
+
+For a viewer, each class is either visible, visible only for items they created, or not visible, decided from the
+FeedItem.Viewer tags of all the classes at once. Then it's one query per visible class for its newest items, and a
+merge. The viewer's visible classes make up their "viewer class" (eg. public only, or public + members), and the
+result is cached per (source, viewer class), so every other viewer in the same position gets it from redis.
+Posting or deleting an item bumps the source's version, which retires its cached timelines. So does giving an item a
+context of its own (context_changed, which also forgets the source's classes) or changing the FeedItem.Viewer tag of
+a context (viewer_tag_changed, for every source with items in it). Those bump again once the change is committed, so a
+timeline cached from the old permissions meanwhile doesn't survive.
+"""
+
+import hashlib
+
+from django.db.models import Q
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+
+from apps.plus_lib import after_commit
+from apps.plus_lib.redis_lib import redis, cache_key
+from apps.plus_permissions.models import GenericReference, strip_wrapper, get_tag_agent_ids, \
+    get_agent_ref_ids, secure_filter, has_access
+from apps.plus_permissions.default_agents import get_anonymous_group, get_creator_agent
+
+TIMELINE_LENGTH = 50
+CACHE_SECONDS = 60 * 60
+
+CLASSES_KEY = "feed_classes"
+VERSION_KEY = "feed_version"
+TIMELINE_KEY = "feed_source_timeline"
+# always in the classes set, so a source with no items is distinguishable from one we haven't looked at
+INDEXED = "-"
+
+VIEWER = 'FeedItem.Viewer'
+
+
+def classes_key(source_ref_id) :
+    return cache_key(CLASSES_KEY, cls=GenericReference, id=source_ref_id)
+
+def version_key(source_ref_id) :
+    return cache_key(VERSION_KEY, cls=GenericReference, id=source_ref_id)
+
+
+def item_class(item) :
+    """ the visibility class of item. (get_security_context stores the acquired context on the ref, so
+    from then on the item can be found by class in the db) """
+    return strip_wrapper(item).get_security_context().id
+
+def add_item(item) :
+    """ item has just been posted """
+    item = strip_wrapper(item)
+    key = classes_key(item.source_id)
+    if redis.exists(key) :
+        redis.sadd(key, item_class(item))
+    else :
+        item_class(item)
+    redis.incr(version_key(item.source_id))
+
+def remove_item(item) :
+    redis.incr(version_key(strip_wrapper(item).source_id))
+
+
+def retire(source_ref_ids, forget_classes=False) :
+    pipe = redis.pipeline()
+    for source_ref_id in source_ref_ids :
+        if forget_classes :
+            pipe.delete(classes_key(source_ref_id))
+        pipe.incr(version_key(source_ref_id))
+    pipe.execute()
+
+def context_changed(item) :
+    """ item has been given a security context of its own, or gone back to the one it acquires """
+    source_ref_ids = [strip_wrapper(item).source_id]
+    retire(source_ref_ids, forget_classes=True)
+    after_commit.defer(retire, source_ref_ids, forget_classes=True)
+
+def viewer_tag_changed(tag) :
+    """ the agents of a FeedItem.Viewer tag have changed, so has what the sources with items in its context show """
+    from apps.plus_feed.models import FeedItem
+    source_ref_ids = list(FeedItem.objects.filter(class_q(tag.security_context_id)).values_list('source', flat=True).distinct())
+    if source_ref_ids :
+        retire(source_ref_ids)
+        after_commit.defer(retire, source_ref_ids)
+
+
+def source_classes(source_ref_id) :
+    """ the visibility classes of the items from source """
+    from apps.plus_feed.models import FeedItem
+    key = classes_key(source_ref_id)
+    classes = redis.smembers(key)
+    if classes :
+        return set([int(c) for c in classes if c != INDEXED])
+
+    feed_type = ContentType.objects.get_for_model(FeedItem)
+    refs = GenericReference.objects.filter(content_type=feed_type,
+                                           object_id__in=FeedItem.objects.filter(source=source_ref_id).values('id'))
+    classes = set()
+    for explicit, acquired in refs.values_list('explicit_scontext', 'acquired_scontext').distinct() :
+        if explicit or acquired :
+            classes.add(explicit or acquired)
+    # older items whose security context has never been asked for
+    for ref in refs.filter(explicit_scontext__isnull=True, acquired_scontext__isnull=True) :
+        classes.add(item_class(ref.obj))
+
+    pipe = redis.pipeline()
+    pipe.sadd(key, INDEXED)
+    for c in classes :
+        pipe.sadd(key, c)
+    pipe.execute()
+    return classes
+
+
+def class_q(context_id) :
+    return Q(ref__explicit_scontext=context_id) | Q(ref__explicit_scontext__isnull=True, ref__acquired_scontext=context_id)
+
+def visible_classes(viewer, source_ref_id, classes) :
+    """ of classes, returns (those whose items viewer can all see, those where viewer can only see their own) """
+    from apps.plus_feed.models import FeedItem
+    tag_agents = get_tag_agent_ids([VIEWER], classes)
+    missing = [c for c in classes if (c, VIEWER) not in tag_agents]
+    if missing :
+        # no tag yet : has_access creates it from the defaults, then we can treat it like the others
+        for c in missing :
+            for item in FeedItem.objects.filter(source=source_ref_id).filter(class_q(c))[:1] :
+                has_access(viewer, item, VIEWER)
+        tag_agents.update(get_tag_agent_ids([VIEWER], missing))
+
+    anonymous_id = get_anonymous_group().get_ref().id
+    creator_id = get_creator_agent().id
+    held = None
+    whole, own = [], []
+    for c in sorted(classes) :
+        allowed = tag_agents.get((c, VIEWER), set())
+        if anonymous_id in allowed :
+            whole.append(c)
+            continue
+        if held is None :
+            held = get_agent_ref_ids(viewer)
+        if allowed.intersection(held) :
+            whole.append(c)
+        elif creator_id in allowed and isinstance(viewer, User) :
+            own.append(c)
+    return whole, own
+
+
+def timeline_key(source_ref_id, viewer, whole, own) :
+    """ whole and own make up the viewer's class. Only a class where they see just their own items makes the
+    key specific to the viewer """
+    version = redis.get(version_key(source_ref_id)) or 0
+    signature = ','.join([str(c) for c in whole])
+    if own :
+        signature = signature + '|%s:%s' % (viewer.id, ','.join([str(c) for c in own]))
+    return cache_key('%s:%s:%s' % (TIMELINE_KEY, version, hashlib.sha1(signature).hexdigest()),
+                     cls=GenericReference, id=source_ref_id)
+
+
+def source_timeline(source, viewer, length=TIMELINE_LENGTH) :
+    """ ids of the newest length items from source which viewer may see, newest first """
+    from apps.plus_feed.models import FeedItem
+    viewer = strip_wrapper(viewer)
+    source_ref_id = strip_wrapper(source).get_ref().id
+
+    whole, own = visible_classes(viewer, source_ref_id, source_classes(source_ref_id))
+    key = timeline_key(source_ref_id, viewer, whole, own)
+    if redis.exists(key) :
+        # (the first entry is always INDEXED, so an empty timeline is cached too)
+        return [int(x) for x in redis.lrange(key, 1, length)]
+
+    found = []
+    for c, own_only in [(c, False) for c in whole] + [(c, True) for c in own] :
+        items = FeedItem.objects.filter(source=source_ref_id).filter(class_q(c))
+        if own_only :
+            items = items.filter(ref__creator=viewer)
+        found.extend(items.order_by('-sent', '-id').values_list('sent', 'id')[:length])
+    found.sort(reverse=True)
+    ids = [item_id for sent, item_id in found[:length]]
+
+    pipe = redis.pipeline()
+    pipe.delete(key)
+    pipe.rpush(key, INDEXED)
+    for item_id in ids :
+        pipe.rpush(key, item_id)
+    pipe.expire(key, CACHE_SECONDS)
+    pipe.execute()
+    return ids
+
+
+def global_timeline(viewer, length=TIMELINE_LENGTH, scan=10) :
+    """ ids of the newest length items from anyone which viewer may see, newest first. The global stream has
+    too many classes to be worth sorting, so secure_filter it a chunk at a time, looking at no more than
+    scan * length items """
+    from apps.plus_feed.models import FeedItem
+    viewer = strip_wrapper(viewer)
+    ids = []
+    chunk_size = length * 2
+    offset = 0
+    while len(ids) < length and offset < length * scan :
+        items = list(FeedItem.objects.all().order_by('-sent', '-id')[offset:offset + chunk_size])
+        offset += chunk_size
+        ids.extend([item.id for item in secure_filter(viewer, items, 'Viewer')])
+        if len(items) < chunk_size :
+            break
+    return ids[:length]
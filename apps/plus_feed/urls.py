@@ -2,6 +2,7 @@ from django.conf.urls.defaults import *
 
 urlpatterns = patterns('',
     url(r'^one_item/(?P<resource_id>[\d]+)/$', 'plus_feed.views.feed_item', name='feed_item'),
+    url(r'^mine/$', 'plus_feed.views.my_feed', name='my_feed'),
 
 )
 
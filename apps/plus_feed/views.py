@@ -1,6 +1,7 @@
 from django.http import HttpResponse, HttpResponseRedirect, HttpResponseForbidden
 from django.template import RequestContext
 from django.shortcuts import render_to_response, get_object_or_404
+from django.contrib.auth.decorators import login_required
 from django.utils.translation import ugettext_lazy as _
 
 from django.core.urlresolvers import reverse
@@ -32,6 +33,23 @@ def feed_item(request, resource) :
 
 
 
+# more of the logged in user's feed : ?before=<cursor> for the next page, ?after=<cursor> for anything new
+
+@login_required
+def my_feed(request) :
+    cursors = {}
+    for name in ['before', 'after'] :
+        try :
+            cursors[name] = float(request.GET[name])
+        except (KeyError, ValueError) :
+            pass
+    tweets = FeedItem.feed_manager.get_for(request.user, **cursors)
+    return render_to_response('home/my_feed.html',
+                              {'tweets':tweets},
+                              context_instance=RequestContext(request))
+
+
+
 # rss for one users
 def rss_of_user(request, username) :
 
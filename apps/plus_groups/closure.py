@@ -0,0 +1,119 @@
+""" Maintains MembershipClosure, the transitive closure of group membership.
+
+Every (group, member) pair carries the number of distinct membership paths between them. Adding the edge
+parent -> child adds paths(a, parent) * paths(child, d) to every pair (a, d) with a at or above the parent and d
+at or below the child. Removing it subtracts the same, and pairs that reach zero are deleted. So both directions
+are incremental and nothing has to walk the tree.
+
+add_edge / remove_edge are idempotent (the direct flag records whether the edge has been counted), so they can be
+called both from add_member / remove_member and from post_join / post_leave, which the syncer calls after
+hubspace has changed the user_group table itself.
+
+Only memberships of groups at ENCLOSURE_LEVELS are recorded, as get_enclosures only ever followed those. So
+eg. a directors group never shows up in anyone's enclosure set.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth.models import User
+
+from apps.plus_groups.models import TgGroup, MembershipClosure, User_Group, ENCLOSURE_LEVELS
+
+
+def member_type(obj_or_cls) :
+    return ContentType.objects.get_for_model(obj_or_cls)
+
+def ancestor_ids(cls, id) :
+    """ the ids of all groups which cls, id is in (at any depth) """
+    return MembershipClosure.objects.filter(member_type=member_type(cls), member_id=id).values_list('group', flat=True)
+
+def ancestor_paths(obj) :
+    return dict(MembershipClosure.objects.filter(member_type=member_type(obj), member_id=obj.id).values_list('group', 'paths'))
+
+def descendant_paths(group) :
+    """ (member_type_id, member_id) -> paths for everything in group at any depth """
+    return dict([((t, m), n) for t, m, n in MembershipClosure.objects.filter(group=group).values_list('member_type', 'member_id', 'paths')])
+
+
+def _apply(ups, downs, sign) :
+    """ add sign * ups[a] * downs[d] paths to each pair. Returns the pairs which were created or deleted
+    as (added, removed), each a list of (group_id, member_type_id, member_id) """
+    added, removed = [], []
+    members_by_type = {}
+    for type_id, member_id in downs :
+        members_by_type.setdefault(type_id, []).append(member_id)
+
+    existing = {}
+    for type_id, member_ids in members_by_type.iteritems() :
+        for row in MembershipClosure.objects.filter(group__in=ups.keys(), member_type=type_id, member_id__in=member_ids) :
+            existing[(row.group_id, row.member_type_id, row.member_id)] = row
+
+    for group_id, up in ups.iteritems() :
+        for (type_id, member_id), down in downs.iteritems() :
+            if group_id == member_id and type_id == member_type(TgGroup).id :
+                # a cycle back to itself, we never store a group as a member of itself
+                continue
+            key = (group_id, type_id, member_id)
+            row = existing.get(key)
+            if row is None :
+                if sign < 0 :
+                    continue
+                row = MembershipClosure(group_id=group_id, member_type_id=type_id, member_id=member_id, paths=0)
+                added.append(key)
+            row.paths = row.paths + sign * up * down
+            if row.paths <= 0 :
+                if row.id :
+                    row.delete()
+                    removed.append(key)
+            else :
+                row.save()
+    return added, removed
+
+
+def _edge(parent, child) :
+    try :
+        return MembershipClosure.objects.get(group=parent, member_type=member_type(child), member_id=child.id)
+    except MembershipClosure.DoesNotExist :
+        return None
+
+def _ups_and_downs(parent, child) :
+    ups = ancestor_paths(parent)
+    ups[parent.id] = ups.get(parent.id, 0) + 1
+    downs = {}
+    if isinstance(child, TgGroup) :
+        downs = descendant_paths(child)
+    key = (member_type(child).id, child.id)
+    downs[key] = downs.get(key, 0) + 1
+    return ups, downs
+
+def add_edge(parent, child) :
+    """ child (a User or TgGroup) has become a direct member of parent """
+    if parent.level not in ENCLOSURE_LEVELS :
+        return [], []
+    edge = _edge(parent, child)
+    if edge and edge.direct :
+        return [], []
+    changes = _apply(*(_ups_and_downs(parent, child) + (1,)))
+    edge = _edge(parent, child)
+    edge.direct = True
+    edge.save()
+    return changes
+
+def remove_edge(parent, child) :
+    """ child is no longer a direct member of parent """
+    edge = _edge(parent, child)
+    if not edge or not edge.direct :
+        return [], []
+    edge.direct = False
+    edge.save()
+    return _apply(*(_ups_and_downs(parent, child) + (-1,)))
+
+
+def rebuild_closure() :
+    """ recreate the whole closure from the user_group table and child_groups. Needed once, when the table
+    is first created, or if anything has changed memberships behind our back """
+    MembershipClosure.objects.all().delete()
+    for ug in User_Group.objects.filter(group__level__in=ENCLOSURE_LEVELS) :
+        add_edge(ug.group, ug.user)
+    for group in TgGroup.objects.filter(level__in=ENCLOSURE_LEVELS) :
+        for child in group.child_groups.all() :
+            add_edge(group, child)
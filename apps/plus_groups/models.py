@@ -229,6 +229,10 @@ try :
             from apps.microblogging.models import Following
             Following.objects.follow(user_or_group,self)
 
+            # (does nothing if add_member already counted it)
+            from apps.plus_groups.closure import add_edge
+            add_edge(self, user_or_group)
+
 
         @invalidates_membership_cache
         def flush_members_cache(self) :
@@ -244,6 +248,8 @@ try :
 
             if isinstance(user_or_group, self.__class__) and not self.child_groups.filter(id=user_or_group.id):
                 self.child_groups.add(user_or_group)
+                from apps.plus_groups.closure import add_edge
+                add_edge(self, user_or_group)
 
 
 
@@ -304,6 +310,9 @@ try :
                 for prof in ProfileInterfaces:
                     user_or_group.get_security_context().remove_arbitrary_agent(admin_group, 'Profile.%s' % prof, admin)
 
+            from apps.plus_groups.closure import remove_edge
+            remove_edge(self, user_or_group)
+
             from apps.plus_feed.models import FeedItem
             FeedItem.post_LEAVE(user_or_group, self)
 
@@ -325,6 +334,8 @@ try :
 
             if isinstance(user_or_group, self.__class__) and self.child_groups.filter(id=user_or_group.id):
                 self.child_groups.remove(user_or_group)
+                from apps.plus_groups.closure import remove_edge
+                remove_edge(self, user_or_group)
 
 
         
@@ -394,6 +405,10 @@ try :
             # remove members
             for m in self.get_members() :
                 self.remove_member(m)
+
+            # and take it out of any groups it's in
+            for parent in self.parent_groups.all() :
+                parent.remove_member(self)
             
             # remove tags, now moved to GenericReference.delete()
 
@@ -451,6 +466,7 @@ try :
             ref = self.get_ref()
             ref.modified = datetime.now()
             ref.display_name = self.get_display_name()
+            ref.listed = True
             ref.save()
 
             
@@ -491,19 +507,36 @@ class User_Group(models.Model):
     user = models.ForeignKey(User)
     
 
+class MembershipClosure(models.Model):
+    """ The transitive closure of group membership : a row for every (group, member) where the member (a User or
+    TgGroup) is in the group at any depth. paths counts the distinct routes up from member to group, which is what
+    lets us remove a membership without recalculating everything. direct is whether one of those routes is the 
+    direct membership. Maintained by apps.plus_groups.closure from add_member / remove_member.
+    """
+    class Meta:
+        unique_together = (("group", "member_type", "member_id"),)
+
+    group = models.ForeignKey(TgGroup, related_name='closure_members')
+    member_type = models.ForeignKey(ContentType)
+    member_id = models.PositiveIntegerField()
+    paths = models.PositiveIntegerField(default=0)
+    direct = models.BooleanField(default=False)
+
+
+# only groups at these levels are enclosures, and only they are in the MembershipClosure
+ENCLOSURE_LEVELS = ['member', 'host', 'public']
+
 # We're going to add the following method to User class (and to group)
 def is_member_of(self, group, already_seen=None) :
-    if not already_seen:
-        already_seen = set([group.id])
+    """ already_seen is no longer needed, now that we can look the answer up in the closure """
     if not group.is_group() : return False
+    member_type = ContentType.objects.get_for_model(self)
+    if group.level in ENCLOSURE_LEVELS :
+        return MembershipClosure.objects.filter(group=group, member_type=member_type, member_id=self.id).count() > 0
+    # eg. a directors group, which isn't in the closure : a direct member, or in one of its member groups
     if group.has_member(self) : return True
-    # not a direct member, but perhaps somewhere up the tree of (enclosures / parents)
-    for x in self.get_enclosures():
-        if x.id not in already_seen:
-            already_seen.add(x.id)
-            if x.is_member_of(group, already_seen): 
-                return True
-    return False
+    child_ids = [x.id for x in group.get_member_groups()]
+    return MembershipClosure.objects.filter(group__in=child_ids, member_type=member_type, member_id=self.id).count() > 0
     
 # add it to TgGroup too
 TgGroup.is_member_of = is_member_of
@@ -526,24 +559,17 @@ def get_enclosure_ids(cls,id) :
     return memberships
 
 def get_enclosure_id_set(cls, self_id, seen=None) :
-
+    """ ids of every group this is in, at any depth (and, for a group, itself). One query against
+    the MembershipClosure when it's not cached. seen is no longer used.
+    """
     key = cache_key(MULTI_LEVEL_MEMBERSHIP_KEY,cls=cls, id=self_id)
     if redis.exists(key) :
         return redis.smembers(key)
 
-    if not seen :
-        seen = set([self_id])
-
+    from apps.plus_groups.closure import ancestor_ids
+    es = set(ancestor_ids(cls, self_id))
     if cls == TgGroup :
-        es = set([self_id])
-    else :
-        es = set([])
-    for e_id in get_enclosure_ids(cls, self_id ) :
-        if e_id not in seen :
-            seen.add(e_id)
-            multi_memberships = get_enclosure_id_set(TgGroup, e_id, seen)
-            es = es.union(set(multi_memberships))
-            seen = seen.union([m for m in multi_memberships])
+        es.add(self_id)
 
     add_to_cached_set(key, es)
     return es
@@ -561,7 +587,7 @@ def get_enclosures(self, levels=None) :
         return TgGroup.objects.filter(id__in=get_enclosure_ids(self.__class__, self.id))
  
     if levels == None:
-        levels = ['member', 'host', 'public']
+        levels = ENCLOSURE_LEVELS
 
     if isinstance(self, User):
         return self.groups.filter(level__in=levels)
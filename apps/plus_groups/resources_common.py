@@ -79,6 +79,8 @@ class ResourceCommonModel(Explorable) :
         ref = self.get_ref()
         ref.modified = datetime.now()
         ref.display_name = self.get_display_name()
+        ref.listed = not self.stub
+        ref.owner_id = self.in_agent_id
         ref.save()
 
 
@@ -49,3 +49,58 @@ class TestPlusModels(unittest.TestCase):
 
     
 
+
+
+from django.contrib.auth.models import User
+
+class TestMembershipClosure(unittest.TestCase):
+
+    def testDiamond(self) :
+        god = User(username='shiva', email_address='shiva@the-hub.net')
+        god.save()
+        def group(name) :
+            g, created = TgGroup.objects.get_or_create(group_name=name, display_name=name, place=None, 
+                                                       level='member', user=god)
+            return g
+        top, left, right = group('top'), group('left'), group('right')
+        u = User(username='parvati', email_address='parvati@the-hub.net')
+        u.save()
+
+        # u is in top by two routes
+        top.add_member(left)
+        top.add_member(right)
+        left.add_member(u)
+        right.add_member(u)
+        self.assertTrue(u.is_member_of(top))
+        self.assertTrue(top in set(u.get_enclosure_set()))
+
+        # and is still in it when one of them goes
+        left.remove_member(u)
+        self.assertTrue(u.is_member_of(top))
+        self.assertFalse(u.is_member_of(left))
+        right.remove_member(u)
+        self.assertFalse(u.is_member_of(top))
+
+        # adding twice doesn't count twice
+        right.add_member(u)
+        right.add_member(u)
+        right.remove_member(u)
+        self.assertFalse(u.is_member_of(top))
+
+    def testDirectors(self) :
+        god = User(username='brahma', email_address='brahma@the-hub.net')
+        god.save()
+        hub, created = TgGroup.objects.get_or_create(group_name='lotus', display_name='Lotus', place=None,
+                                                     level='member', user=god)
+        directors, created = TgGroup.objects.get_or_create(group_name='lotus_directors', display_name='Lotus Directors',
+                                                           place=None, level='director', user=god)
+        u = User(username='saraswati', email_address='saraswati@the-hub.net')
+        u.save()
+        directors.add_member(u)
+        hub.add_member(directors)
+
+        # a direct member, but a directors group isn't an enclosure, so it doesn't pass membership on up
+        self.assertTrue(u.is_member_of(directors))
+        self.assertFalse(directors in set(u.get_enclosure_set()))
+        self.assertFalse(u.is_member_of(hub))
+        self.assertTrue(directors.is_member_of(hub))
@@ -65,7 +65,7 @@ def group_resources(request, group, tag_string, search, order, current_app, **kw
     resource_listings_args = listing_args(current_app + ':group_resources', current_app + ':group_resources_tag', 
                                           tag_string=tag_string, search_terms=search, multitabbed=False, 
                                           order=order, template_base='plus_lib/listing_frag.html', 
-                                          template_base_div_id='resources', group_id=group.id)
+                                          template_base_div_id='resources', group_id=group.id, cursor_paginate=True)
     search_types = narrow_search_types('Resource')
     results = plus_search(resource_listings_args['tag_filter'], search, search_types, order, in_group=group.get_ref())
     return {'search':results, 'listing_args':resource_listings_args}
@@ -82,7 +82,7 @@ def make_group_members(member_or_host, make_profile_id_list) :
                                             current_app + ':group_%s_tag'%member_or_host, 
                                             tag_string=tag_string, search_terms=search, multitabbed=False, 
                                             order=order, template_base='plus_lib/listing_frag.html', 
-                                            template_base_div_id=member_or_host, group_id=group.id)
+                                            template_base_div_id=member_or_host, group_id=group.id, cursor_paginate=True)
 
         search_types = narrow_search_types('Profile')
         member_profile_ids=make_profile_id_list(group)
@@ -313,7 +313,7 @@ def groups(request, site, tag_string='', type='other', template_name='plus_explo
     search_types = narrow_search_types(type_name) 
     side_search = side_search_args(current_app + ':groups', search_types[0][1][2])
 
-    listing_args_dict = listing_args(current_app + ':groups', current_app + ':groups_tag', tag_string=tag_string, search_terms=search, multitabbed=False, order=order, template_base="site_base.html", search_type_label=head_title)
+    listing_args_dict = listing_args(current_app + ':groups', current_app + ':groups_tag', tag_string=tag_string, search_terms=search, multitabbed=False, order=order, template_base="site_base.html", search_type_label=head_title, cursor_paginate=True)
     search_dict = plus_search(listing_args_dict['tag_filter'], search, search_types, order)
 
     return render_to_response(template_name, 
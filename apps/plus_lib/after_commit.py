@@ -0,0 +1,40 @@
+""" Things to do once the request's transaction has committed.
+
+Redis isn't part of the database transaction, so anything written there from inside a request can outlive a
+rollback, or be overwritten by another request that read the database before our commit. defer() holds a call
+back until AfterCommitMiddleware sees the response (it comes before TransactionMiddleware, so that's after the
+commit). If the request fails, the calls are dropped, since nothing was committed.
+
+Outside a request (scripts, crons, tests) there's no middleware, and deferred calls are made at once.
+"""
+
+import sys
+import threading
+import traceback
+
+_local = threading.local()
+
+
+def start() :
+    _local.pending = []
+
+def run() :
+    pending = getattr(_local, 'pending', None)
+    _local.pending = None
+    for f, args, kwargs in pending or [] :
+        try :
+            f(*args, **kwargs)
+        except Exception, e :
+            # the response is already decided, one failure mustn't stop the others
+            sys.stderr.write('after commit call %s failed\n' % f.__name__)
+            traceback.print_exc()
+
+def discard() :
+    _local.pending = None
+
+def defer(f, *args, **kwargs) :
+    pending = getattr(_local, 'pending', None)
+    if pending is None :
+        f(*args, **kwargs)
+    else :
+        pending.append((f, args, kwargs))
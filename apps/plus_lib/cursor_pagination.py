@@ -0,0 +1,143 @@
+""" Keyset ("cursor") pagination of GenericReference listings, securing only the window being shown.
+
+Page numbers need the size of the whole permission-filtered list before page 1 can be drawn. Here we just
+walk the ordered queryset from where the last page stopped, secure_filter a chunk at a time until the window
+is full, and hand back an opaque token marking the last row we looked at. So every page costs about the same
+however many GenericReferences there are.
+
+Tokens are signed with HMAC_KEY so they can't be used to inject arbitrary filter values.
+"""
+import base64
+import hmac as create_hmac
+from hashlib import sha1
+
+import simplejson
+
+from django.conf import settings
+from django.db.models import Q
+from django.contrib.contenttypes.models import ContentType
+
+from apps.plus_permissions.models import secure_filter
+
+# listing order -> (GenericReference field, descending)
+ORDER_KEYS = {'modified': ('modified', True),
+              'display_name': ('display_name', False),
+              # by the id itself, not (as order_by('creator') would) by the User's own ordering
+              'creator': ('creator__id', False),
+              }
+DEFAULT_ORDER = 'modified'
+
+
+class BadCursor(Exception) :
+    pass
+
+
+def encode_cursor(data) :
+    payload = base64.urlsafe_b64encode(simplejson.dumps(data))
+    signature = create_hmac.new(settings.HMAC_KEY, payload, sha1).hexdigest()
+    return '%s.%s' % (payload, signature)
+
+def decode_cursor(token) :
+    try :
+        payload, signature = str(token).rsplit('.', 1)
+    except ValueError :
+        raise BadCursor(token)
+    if create_hmac.new(settings.HMAC_KEY, payload, sha1).hexdigest() != signature :
+        raise BadCursor(token)
+    try :
+        return simplejson.loads(base64.urlsafe_b64decode(payload))
+    except (TypeError, ValueError) :
+        raise BadCursor(token)
+
+
+def key_value(ref, field) :
+    if field == 'creator__id' :
+        value = ref.creator_id
+    else :
+        value = getattr(ref, field)
+    if value is None :
+        return None
+    if isinstance(value, (int, long)) :
+        return value
+    # datetimes come back as strings that django will parse for the lookup
+    return unicode(value)
+
+def after_q(field, descending, value, last_id) :
+    """ everything which comes after (value, last_id) in the listing order.
+    NULLs sort as if they were the biggest value, as postgres does """
+    if descending :
+        if value is None :
+            return Q(**{field + '__isnull': True, 'id__lt': last_id}) | Q(**{field + '__isnull': False})
+        return Q(**{field + '__lt': value}) | Q(**{field: value, 'id__lt': last_id})
+    if value is None :
+        return Q(**{field + '__isnull': True, 'id__gt': last_id})
+    return Q(**{field + '__gt': value}) | Q(**{field: value, 'id__gt': last_id}) | Q(**{field + '__isnull': True})
+
+
+def load_objects(refs) :
+    """ the obj of each GenericReference, with one query per content type rather than one per ref """
+    ids_by_type = {}
+    for ref in refs :
+        ids_by_type.setdefault(ref.content_type_id, []).append(ref.object_id)
+    objs = {}
+    for content_type_id, ids in ids_by_type.iteritems() :
+        cls = ContentType.objects.get_for_id(content_type_id).model_class()
+        for obj in cls.objects.filter(id__in=ids) :
+            objs[(content_type_id, obj.id)] = obj
+    return [objs.get((ref.content_type_id, ref.object_id)) for ref in refs]
+
+
+class CursorPage(object) :
+    def __init__(self, items, next_cursor) :
+        self.items = items
+        self.next_cursor = next_cursor
+        self.has_next = next_cursor is not None
+
+    def __iter__(self) :
+        return iter(self.items)
+
+    def __len__(self) :
+        return len(self.items)
+
+
+def secured_window(refs, user, order=None, cursor=None, per_page=10, interface='Viewer') :
+    """ refs is a GenericReference queryset. Returns a CursorPage of (at most) per_page refs, after cursor,
+    whose objects user has interface on. A bad or stale cursor starts again from the beginning.
+    """
+    field, descending = ORDER_KEYS.get(order, ORDER_KEYS[DEFAULT_ORDER])
+    if descending :
+        refs = refs.order_by('-' + field, '-id')
+    else :
+        refs = refs.order_by(field, 'id')
+
+    if cursor :
+        try :
+            position = decode_cursor(cursor)
+            if position.get('order') == field :
+                refs = refs.filter(after_q(field, descending, position['value'], position['id']))
+        except BadCursor :
+            pass
+
+    items = []
+    last = None
+    chunk_size = per_page * 2
+    offset = 0
+    exhausted = False
+    while len(items) < per_page and not exhausted :
+        chunk = list(refs[offset:offset + chunk_size])
+        offset += len(chunk)
+        exhausted = len(chunk) < chunk_size
+        objs = load_objects(chunk)
+        allowed = set([(o.__class__, o.id) for o in secure_filter(user, [o for o in objs if o is not None], interface)])
+        for ref, obj in zip(chunk, objs) :
+            last = ref
+            if obj is not None and (obj.__class__, obj.id) in allowed :
+                items.append(ref)
+                if len(items) == per_page :
+                    break
+
+    more = not exhausted or (last is not None and chunk and last != chunk[-1])
+    next_cursor = None
+    if more and last is not None :
+        next_cursor = encode_cursor({'order': field, 'value': key_value(last, field), 'id': last.id})
+    return CursorPage(items, next_cursor)
@@ -0,0 +1,29 @@
+import sys
+from optparse import make_option
+from django.utils import termcolors
+from django.core.management.base import NoArgsCommand
+
+style = termcolors.make_style(fg='green', opts=('bold',))
+
+from apps.plus_permissions.acl_index import rebuild_index, check_index
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the redis index of agents allowed on each SecurityTag, or with --check compares it with the database'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--check', action='store_true', dest='check', default=False,
+                    help='Only report tags whose index disagrees with the database'),
+        make_option('--repair', action='store_true', dest='repair', default=False,
+                    help='With --check, reindex the tags which disagree'),
+    )
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        if options.get('check') :
+            bad = 0
+            for tag in check_index(repair=options.get('repair')) :
+                print "Inconsistent %s" % tag
+                bad = bad + 1
+            sys.stderr.write(style('%s inconsistent tags' % bad) + '\n')
+        else :
+            sys.stderr.write(style('Indexed %s tags' % rebuild_index()) + '\n')
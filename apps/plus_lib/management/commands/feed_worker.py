@@ -0,0 +1,28 @@
+import sys
+from optparse import make_option
+from django.utils import termcolors
+from django.core.management.base import NoArgsCommand
+
+style = termcolors.make_style(fg='green', opts=('bold',))
+
+from apps.plus_feed.delivery import work, queue_length, recover
+
+
+class Command(NoArgsCommand):
+    help = 'Delivers queued feed items to their readers\' feeds. Runs until killed (put it under supervisord), or with --once until the queue is empty'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--once', action='store_true', dest='once', default=False,
+                    help='Deliver whatever is queued now and exit'),
+        make_option('--timeout', action='store', dest='timeout', type='int', default=30,
+                    help='Seconds to block waiting for an item before checking again'),
+        make_option('--recover', action='store_true', dest='recover', default=False,
+                    help='Requeue the items of workers which died mid-delivery. Only while no workers are running'),
+    )
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        if options.get('recover'):
+            sys.stderr.write(style('Requeued %s feed items' % recover()) + '\n')
+        sys.stderr.write(style('%s feed items queued' % queue_length()) + '\n')
+        delivered = work(timeout=options.get('timeout'), once=options.get('once'))
+        sys.stderr.write(style('Delivered %s feed items' % delivered) + '\n')
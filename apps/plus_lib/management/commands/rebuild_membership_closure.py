@@ -0,0 +1,21 @@
+import sys
+from django.utils import termcolors
+from django.core.management.base import NoArgsCommand
+
+style = termcolors.make_style(fg='green', opts=('bold',))
+
+from apps.plus_groups.models import MembershipClosure
+from apps.plus_groups.closure import rebuild_closure
+from apps.plus_lib.redis_lib import flush_membership_cache
+
+
+class Command(NoArgsCommand):
+    help = 'Recreates the MembershipClosure table from user_group and child_groups. Run it once after syncdb creates the table'
+    args = ''
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        rebuild_closure()
+        sys.stderr.write(style('%s membership pairs' % MembershipClosure.objects.count()) + '\n')
+        # the cached membership sets were built from the old closure
+        sys.stderr.write(style('flushed %s cached membership sets' % flush_membership_cache()) + '\n')
@@ -0,0 +1,16 @@
+import sys
+from django.utils import termcolors
+from django.core.management.base import NoArgsCommand
+
+style = termcolors.make_style(fg='green', opts=('bold',))
+
+from apps.plus_tags import tag_index, autocomplete
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the redis tag index (the GenericReferences tagged with each keyword) from the database, and clears the autocomplete index'
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        sys.stderr.write(style('Indexed %s keywords' % tag_index.rebuild_index()) + '\n')
+        autocomplete.rebuild_index()
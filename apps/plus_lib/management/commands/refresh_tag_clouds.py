@@ -0,0 +1,20 @@
+import sys
+from optparse import make_option
+from django.utils import termcolors
+from django.core.management.base import NoArgsCommand
+
+style = termcolors.make_style(fg='green', opts=('bold',))
+
+from apps.plus_tags import clouds
+
+
+class Command(NoArgsCommand):
+    help = 'Recomputes the cached tag clouds which tagging has made out of date'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help='Recompute every cached cloud, whether out of date or not'),
+    )
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        sys.stderr.write(style('Refreshed %s tag clouds' % clouds.refresh(force=options.get('all'))) + '\n')
@@ -0,0 +1,30 @@
+import sys
+from optparse import make_option
+from django.utils import termcolors
+from django.core.management.base import NoArgsCommand
+
+style = termcolors.make_style(fg='green', opts=('bold',))
+
+from apps.plus_permissions.search_queue import work, queue_length, recover, BATCH_SIZE
+
+
+class Command(NoArgsCommand):
+    help = 'Indexes queued changes to the search index in batches. Runs until killed (put it under supervisord), or with --once until the queue is empty'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--once', action='store_true', dest='once', default=False,
+                    help='Index whatever is queued now and exit'),
+        make_option('--timeout', action='store', dest='timeout', type='int', default=5,
+                    help='Seconds to wait when the queue is empty before checking again'),
+        make_option('--batch', action='store', dest='batch', type='int', default=BATCH_SIZE,
+                    help='How many refs to send to solr at a time'),
+        make_option('--recover', action='store_true', dest='recover', default=False,
+                    help='Requeue the refs of workers which died mid-batch. Only while no workers are running'),
+    )
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        if options.get('recover'):
+            sys.stderr.write(style('Requeued %s refs' % recover()) + '\n')
+        sys.stderr.write(style('%s refs queued for indexing' % queue_length()) + '\n')
+        handled = work(timeout=options.get('timeout'), once=options.get('once'), batch_size=options.get('batch'))
+        sys.stderr.write(style('Indexed %s refs' % handled) + '\n')
@@ -0,0 +1,20 @@
+import sys
+from optparse import make_option
+from django.utils import termcolors
+from django.core.management.base import NoArgsCommand
+
+style = termcolors.make_style(fg='green', opts=('bold',))
+
+from apps.plus_feed.delivery import warm_feeds
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the missing redis feeds of recent visitors, eg. after redis has been restarted'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', action='store', dest='days', type='int', default=30,
+                    help='Warm the feeds of everyone who has logged in during this many days'),
+    )
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        sys.stderr.write(style('Rebuilt %s feeds' % warm_feeds(days=options.get('days'))) + '\n')
@@ -0,0 +1,17 @@
+from apps.plus_lib import after_commit
+
+class AfterCommitMiddleware(object) :
+    """ runs the calls deferred during a request (see after_commit) once it's committed. Must come before
+    TransactionMiddleware, so that it sees the response after the commit """
+
+    def process_request(self, request):
+        after_commit.start()
+        return None
+
+    def process_response(self, request, response):
+        after_commit.run()
+        return response
+
+    def process_exception(self, request, exception):
+        after_commit.discard()
+        return None
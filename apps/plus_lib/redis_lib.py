@@ -33,40 +33,110 @@ def invalidates_cache_for(keyword) :
     return inner
 
 
-def walk_children(obj, f, seen=None, path='', **kwargs) :
-    """ Recurses through all members and calls f on them"""
-    if seen == None :
-        seen = set([obj])
-    else :
-        if obj in seen :
-            return
-
-    f(obj, **kwargs)
-    seen.add(obj)
-    if getattr(obj,'get_members',False) :
-        for child in obj.get_members() :
-            if not child in seen :
-                walk_children(child, f, seen, path=path+'/%s'%obj, **kwargs)
-
 ONE_LEVEL_MEMBERSHIP_KEY = "membership_ids"
 MULTI_LEVEL_MEMBERSHIP_KEY = "multi_membership_ids"
 
+MEMBERSHIP_INVALIDATION_STATS_KEY = "membership_invalidation_stats"
+
+# set MEMBERSHIP_CACHE_RECOMPUTE = True in settings to rebuild the invalidated sets in a background thread
+# rather than waiting for the next request that needs them
+RECOMPUTE = getattr(settings, 'MEMBERSHIP_CACHE_RECOMPUTE', False)
+
+def membership_cache_keys(obj, member=None) :
+    """ exactly which cached membership sets change when member joins or leaves obj (or, with no member,
+    when obj's members are flushed) : the multi-level sets of member and everything below it, and the
+    one-level set of member itself. Returns (keys, agents) where agents are (cls, id) for each multi-level set.
+    """
+    from apps.plus_groups.models import TgGroup, MembershipClosure
+    from django.contrib.contenttypes.models import ContentType
+
+    top = member or obj
+    agents = [(top.__class__, top.id)]
+    if isinstance(top, TgGroup) :
+        # everything below it, from the closure, in one query
+        types = {}
+        for type_id, member_id in MembershipClosure.objects.filter(group=top).values_list('member_type', 'member_id') :
+            if type_id not in types :
+                types[type_id] = ContentType.objects.get_for_id(type_id).model_class()
+            agents.append((types[type_id], member_id))
+
+    keys = [cache_key(MULTI_LEVEL_MEMBERSHIP_KEY, cls=cls, id=id) for cls, id in agents]
+    if member :
+        keys.append(cache_key(ONE_LEVEL_MEMBERSHIP_KEY, obj=member))
+    else :
+        keys.extend([cache_key(ONE_LEVEL_MEMBERSHIP_KEY, cls=cls, id=id) for cls, id in agents])
+    return keys, agents
+
+def recompute_membership_cache(agents) :
+    from apps.plus_groups.models import get_enclosure_id_set
+    for cls, id in agents :
+        get_enclosure_id_set(cls, id)
+
+def start_recompute(agents) :
+    """ recompute in a thread of its own, which has its own db connection, so it closes it when it's done """
+    import threading
+    from django.db import connection
+    def recompute() :
+        try :
+            recompute_membership_cache(agents)
+        finally :
+            connection.close()
+    t = threading.Thread(target=recompute)
+    t.setDaemon(True)
+    t.start()
+
+def membership_stats_key() :
+    return "%s:%s" % (settings.DOMAIN_NAME, MEMBERSHIP_INVALIDATION_STATS_KEY)
+
+def membership_invalidation_stats() :
+    """ how many membership changes there have been, and how many keys they've touched between them """
+    return redis.hgetall(membership_stats_key())
+
 def invalidates_membership_cache(f) :
-    """ decorator for functions that should invalidate the membership cache"""
+    """ decorator for functions that should invalidate the membership cache. 
+    The first argument after self, if there is one, is the user or group joining or leaving"""
     def _invalidate_membership_cache_closure(self, *args, **kwargs) :
-        """ kills the membership cache and then calls f"""
-        def kill_membership_cache(obj) :
-            """ kills the cached membership information for obj"""
-            key = cache_key(ONE_LEVEL_MEMBERSHIP_KEY, obj=obj)
-            redis.delete(key)
-            key = cache_key(MULTI_LEVEL_MEMBERSHIP_KEY, obj=obj)
-            redis.delete(key)
-        walk_children(self, kill_membership_cache)
+        """ calls f and then deletes the cached membership sets it changed, in one batch """
+        try :
+            return f(self,*args,**kwargs)
+        finally :
+            member = None
+            if args :
+                member = args[0]
+            keys, agents = membership_cache_keys(self, member)
+
+            stats_key = membership_stats_key()
+            pipe = redis.pipeline()
+            for key in keys :
+                pipe.delete(key)
+            pipe.hincrby(stats_key, 'changes', 1)
+            pipe.hincrby(stats_key, 'keys', len(keys))
+            pipe.execute()
+
+            # any access decisions remembered for this request may depend on the old membership
+            from apps.plus_permissions import access_cache
+            access_cache.invalidate()
+
+            if RECOMPUTE :
+                # not until the change is committed, or the thread would just cache the old membership again
+                from apps.plus_lib import after_commit
+                after_commit.defer(start_recompute, agents)
 
-        return f(self,*args,**kwargs)
     return _invalidate_membership_cache_closure
 
 
+def flush_membership_cache() :
+    """ delete every cached membership set (and nothing else) """
+    keys = []
+    for prefix in [ONE_LEVEL_MEMBERSHIP_KEY, MULTI_LEVEL_MEMBERSHIP_KEY] :
+        keys.extend(redis.keys("%s:%s:*" % (settings.DOMAIN_NAME, prefix)))
+    pipe = redis.pipeline()
+    for key in keys :
+        pipe.delete(key)
+    pipe.execute()
+    return len(keys)
+
+
 def cached_for(obj) :
     d = {}
     def add(prefix) :
@@ -1,7 +1,9 @@
 from django import template
 register = template.Library()
 from django.utils.http import urlquote
+from django.template.defaultfilters import slugify
 from apps.plus_lib.utils import search_caption_from_path
+from apps.plus_lib.cursor_pagination import secured_window
 
 @register.inclusion_tag('plus_lib/tag_and_search.html',takes_context=True)
 def tag_and_search(context, listing_args, tag_intersection):
@@ -36,11 +38,27 @@ def tag_and_search(context, listing_args, tag_intersection):
 
 @register.inclusion_tag('plus_lib/listing.html', takes_context=True)
 def listing(context, items, results_label, order, search_terms, listing_args):
+    request = context['request']
+    cursor_page, cursor_param, next_url = None, None, None
+    if listing_args.get('cursor_paginate') and hasattr(items, 'filter') and order != 'relevance':
+        # only secure the window we're showing, see apps.plus_lib.cursor_pagination
+        cursor_param = 'after'
+        if listing_args.get('multitabbed'):
+            cursor_param = 'after_%s' % slugify(results_label)
+        cursor_page = secured_window(items, request.user, order=order, cursor=request.GET.get(cursor_param), 
+                                     per_page=listing_args.get('per_page', 10))
+        if cursor_page.has_next:
+            getvars = request.GET.copy()
+            getvars[cursor_param] = cursor_page.next_cursor
+            next_url = '%s?%s' % (request.path, getvars.urlencode())
 
     return {'items':items,
+            'cursor_paginated':cursor_page is not None,
+            'cursor_page':cursor_page,
+            'next_url':next_url,
             'results_label':results_label,
             'order':order,
-            'request':context['request'],
+            'request':request,
             'search_terms':search_terms,
             'listing_args':listing_args
             }
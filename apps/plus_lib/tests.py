@@ -13,10 +13,55 @@ class TestIt(unittest.TestCase) :
         from django.conf import settings
         self.assertEquals(cache_key('FROM_OBJ',obj=a), settings.DOMAIN_NAME + ":FROM_OBJ:A:123")
         self.assertEquals(cache_key('FROM_CLASS_AND_ID',cls=A,id=456), settings.DOMAIN_NAME + ":FROM_CLASS_AND_ID:A:456")
+
+    def test_membership_cache_keys(self) :
+        class A() :
+            def __init__(self,id) :
+                self.id = id
+        # a user joining touches just its own two sets
+        keys, agents = membership_cache_keys(A(1), A(2))
+        self.assertEquals(keys, [cache_key(MULTI_LEVEL_MEMBERSHIP_KEY,cls=A,id=2), cache_key(ONE_LEVEL_MEMBERSHIP_KEY,cls=A,id=2)])
+        self.assertEquals(agents, [(A, 2)])
+
+    def test_cursor(self) :
+        position = {'order':'modified', 'value':'2010-02-03 10:11:12', 'id':7}
+        token = encode_cursor(position)
+        self.assertEquals(decode_cursor(token), position)
+        # tampered tokens are refused
+        self.assertRaises(BadCursor, decode_cursor, token[:-1] + (token[-1] == 'a' and 'b' or 'a'))
+        self.assertRaises(BadCursor, decode_cursor, 'rubbish')
+
+    def test_cursor_paging(self) :
+        from django.contrib.auth.models import User
+        from django.contrib.contenttypes.models import ContentType
+        from apps.plus_groups.models import TgGroup
+        from apps.plus_permissions.models import GenericReference
+
+        god = User(username='Janus', email_address='janus@the-hub.net')
+        god.save()
+        groups = [TgGroup.objects.get_or_create(group_name='janus%s' % i, display_name='Two Faced',
+                                                place=None, level='member', user=god)[0] for i in range(5)]
+        refs = GenericReference.objects.filter(content_type=ContentType.objects.get_for_model(TgGroup),
+                                               object_id__in=[g.id for g in groups])
+        # every ref has the same display_name and creator, so each page boundary falls inside a run of equal keys
+        refs.update(display_name='Two Faced', creator=god)
+
+        for order in ['display_name', 'creator'] :
+            everything = [ref.id for ref in secured_window(refs, god, order=order, per_page=100)]
+            seen = []
+            cursor = None
+            while True :
+                page = secured_window(refs, god, order=order, cursor=cursor, per_page=2)
+                seen.extend([ref.id for ref in page])
+                if not page.has_next :
+                    break
+                cursor = page.next_cursor
+            self.assertEquals(seen, everything)
         
 
 
-from apps.plus_lib.redis_lib import cache_key
+from apps.plus_lib.redis_lib import cache_key, membership_cache_keys, MULTI_LEVEL_MEMBERSHIP_KEY, ONE_LEVEL_MEMBERSHIP_KEY
+from apps.plus_lib.cursor_pagination import encode_cursor, decode_cursor, BadCursor, secured_window
 
 if __name__ == "__main__":
     unittest.run()
@@ -0,0 +1,69 @@
+""" A per-request memo of has_access decisions, keyed by (agent, security context, interface).
+
+Within a single request the same decision gets asked for many times (TemplateSecureWrapper, check_interfaces,
+the p_ probes in SecureWrapper.__getattr__ etc.) The memo only exists between start() and stop(), which
+AccessCacheMiddleware calls around each request, so scripts and crons see exactly the old behaviour.
+
+Anything which moves a slider or changes membership must call invalidate()
+"""
+
+import threading
+
+from apps.plus_lib.counters import Counter
+
+_local = threading.local()
+
+# stored when the only way the agent could get the interface is by being the creator of the resource
+# so the answer depends on the resource, not just on its security context
+CREATOR_ONLY = 'creator_only'
+
+
+def start() :
+    _local.decisions = {}
+    _local.counter = Counter()
+
+def stop() :
+    """ switch the memo off, returning its counters """
+    counter = stats()
+    _local.decisions = None
+    _local.counter = None
+    return counter
+
+def is_active() :
+    return getattr(_local, 'decisions', None) is not None
+
+def stats() :
+    counter = getattr(_local, 'counter', None)
+    if counter is None :
+        return Counter()
+    return counter
+
+def decision_key(agent, sec_context, interface) :
+    return (agent.__class__.__name__, agent.id, sec_context.id, interface)
+
+def get_decision(agent, sec_context, interface) :
+    """ True, False or CREATOR_ONLY if we've already decided, None if we haven't (or the memo is off)"""
+    if not is_active() :
+        return None
+    decision = _local.decisions.get(decision_key(agent, sec_context, interface))
+    if decision is None :
+        _local.counter('misses')
+    else :
+        _local.counter('hits')
+    return decision
+
+def store_decision(agent, sec_context, interface, decision) :
+    if is_active() :
+        _local.decisions[decision_key(agent, sec_context, interface)] = decision
+
+def invalidate(sec_context=None) :
+    """ forget decisions for one security context (e.g. when its sliders move) or, with no argument,
+    all of them (e.g. when membership changes) """
+    if not is_active() :
+        return
+    _local.counter('invalidations')
+    if sec_context is None :
+        _local.decisions.clear()
+        return
+    for key in [k for k in _local.decisions if k[2] == sec_context.id] :
+        del _local.decisions[key]
@@ -0,0 +1,155 @@
+""" A redis copy of the agents allowed on each SecurityTag, so that has_access can be answered from redis alone.
+
+For each (security_context, interface) we keep a set of agent members :
+  - TgGroups are stored as their bare id, the same as in the MULTI_LEVEL_MEMBERSHIP_KEY sets, so
+    "is the agent in any allowed group" is a single SINTER
+  - other agents (Users) as "User:<id>"
+  - the anonymous group also as ANYONE, and the creator marker as CREATOR, so neither needs a db lookup to test
+
+The database is always the truth. A missing set is built from the database the next time it's needed, so
+flushing redis costs speed but not correctness, and rebuild_index / check_index (see the acl_index
+management command) can recreate or verify the whole thing.
+
+Changing a tag never writes its new agents to redis, since the change may yet be rolled back (eg. move_sliders
+failing validation). It just deletes the set (tag_changed), then deletes it again once the request has committed,
+and the set is rebuilt by the next has_access which needs it. Each tag also has a generation, bumped along with
+both deletes. has_access notes the generation before reading the agents from the database and index_agents
+won't write if it has moved on, so a rebuild from a read made before someone else's commit can't overwrite their
+change. Nor will it write from inside a transaction which has changed anything, as it may be reading its own
+uncommitted changes.
+"""
+
+from django.db import transaction
+
+from apps.plus_lib.redis_lib import redis, cache_key, MULTI_LEVEL_MEMBERSHIP_KEY
+from apps.plus_lib import after_commit
+from apps.plus_permissions.access_cache import CREATOR_ONLY
+
+ACL_INDEX_KEY = "acl_agents"
+GENERATION_KEY = "acl_generation"
+
+# always in the set, so an empty tag is still distinguishable from a missing set
+INDEXED = "-"
+ANYONE = "Anyone"
+CREATOR = "Creator"
+
+
+def acl_key(context_id, interface) :
+    from apps.plus_permissions.models import SecurityContext
+    return cache_key('%s:%s' % (ACL_INDEX_KEY, interface), cls=SecurityContext, id=context_id)
+
+def generation_key(context_id, interface) :
+    from apps.plus_permissions.models import SecurityContext
+    return cache_key('%s:%s' % (GENERATION_KEY, interface), cls=SecurityContext, id=context_id)
+
+def generation(context_id, interface) :
+    return redis.get(generation_key(context_id, interface))
+
+def agent_members(agent) :
+    """ the members that stand for agent (an actual user, group or CreatorMarker, not its GenericReference) """
+    from apps.plus_groups.models import TgGroup
+    from apps.plus_permissions.default_agents import CreatorMarker
+    if isinstance(agent, TgGroup) :
+        # same test as get_anonymous_group, without the query
+        if agent.group_name == 'anonymous' :
+            return [str(agent.id), ANYONE]
+        return [str(agent.id)]
+    if isinstance(agent, CreatorMarker) :
+        return [CREATOR]
+    return ['%s:%s' % (agent.__class__.__name__, agent.id)]
+
+
+def write_agents(context_id, interface, agents) :
+    key = acl_key(context_id, interface)
+    pipe = redis.pipeline()
+    pipe.delete(key)
+    pipe.sadd(key, INDEXED)
+    for agent in agents :
+        for member in agent_members(agent) :
+            pipe.sadd(key, member)
+    pipe.execute()
+
+def index_agents(context_id, interface, agents, read_generation) :
+    """ index agents, which were read from the database for the tag when its generation was read_generation.
+    Does nothing if the tag has changed since, or the read may have seen uncommitted changes """
+    if transaction.is_dirty() :
+        return
+    if generation(context_id, interface) != read_generation :
+        return
+    write_agents(context_id, interface, agents)
+
+def index_tag(tag) :
+    """ for rebuilding the index, outside any request """
+    write_agents(tag.security_context_id, tag.interface, [a.obj for a in tag.agents.all()])
+
+def invalidate(context_id, interface) :
+    pipe = redis.pipeline()
+    pipe.delete(acl_key(context_id, interface))
+    pipe.incr(generation_key(context_id, interface))
+    pipe.execute()
+
+def tag_changed(tag) :
+    """ tag's agents have changed (or it's been created or deleted) """
+    invalidate(tag.security_context_id, tag.interface)
+    after_commit.defer(invalidate, tag.security_context_id, tag.interface)
+
+
+def lookup(agent, context_id, interface) :
+    """ True or False, CREATOR_ONLY if it depends on the agent having created the resource,
+    or None if the tag isn't indexed (in which case ask the database) """
+    key = acl_key(context_id, interface)
+    own = agent_members(agent)[0]
+
+    pipe = redis.pipeline()
+    pipe.exists(key)
+    pipe.sismember(key, own)
+    pipe.sismember(key, ANYONE)
+    pipe.sismember(key, CREATOR)
+    indexed, is_own, is_anyone, is_creator = pipe.execute()
+
+    if not indexed :
+        return None
+    if is_own or is_anyone :
+        return True
+
+    membership_key = cache_key(MULTI_LEVEL_MEMBERSHIP_KEY, obj=agent)
+    if redis.exists(membership_key) :
+        held = redis.sinter(key, membership_key)
+    else :
+        # builds (and caches) the membership set as a side effect
+        from apps.plus_groups.models import get_enclosure_id_set
+        held = redis.smembers(key).intersection([str(x) for x in get_enclosure_id_set(agent.__class__, agent.id)])
+    if held :
+        return True
+
+    if is_creator :
+        return CREATOR_ONLY
+    return False
+
+
+def rebuild_index() :
+    """ throw away the whole index and rebuild it from the SecurityTags, returning how many were indexed """
+    from apps.plus_permissions.models import SecurityTag
+    for key in redis.keys(acl_key('*', '*')) :
+        redis.delete(key)
+    count = 0
+    for tag in SecurityTag.objects.all() :
+        index_tag(tag)
+        count = count + 1
+    return count
+
+def check_index(repair=False) :
+    """ compare the index against the database, yielding each SecurityTag whose indexed agents are wrong.
+    Tags which aren't indexed at all are fine (they'll be built when needed). If repair, reindex the bad ones """
+    from apps.plus_permissions.models import SecurityTag
+    for tag in SecurityTag.objects.all() :
+        key = acl_key(tag.security_context_id, tag.interface)
+        if not redis.exists(key) :
+            continue
+        expected = set([INDEXED])
+        for a in tag.agents.all() :
+            expected.update(agent_members(a.obj))
+        if redis.smembers(key) != expected :
+            if repair :
+                index_tag(tag)
+            yield tag
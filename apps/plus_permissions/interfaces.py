@@ -120,7 +120,7 @@ def is_not_viewable(obj,attr_name) :
     else : 
         return False
 
-from apps.plus_permissions.models import type_interfaces_map, has_access
+from apps.plus_permissions.models import type_interfaces_map, has_access, get_interfaces_for
 
 class SecureWrapper:
     """
@@ -166,13 +166,17 @@ class SecureWrapper:
         interface_map = type_interfaces_map[cls.__name__]
         if not interface_names:
             interface_names = interface_map.keys()
+        if diagnose:
+            # diagnose mode wants has_access to explain itself for each interface
+            allowed = set([cls.__name__ + '.' + iname for iname in interface_names 
+                           if has_access(agent=agent, resource=resource, interface=cls.__name__ + '.' + iname, diagnose=diagnose)])
+        else:
+            allowed = get_interfaces_for(agent, resource, [cls.__name__ + '.' + iname for iname in interface_names])
         for iname in interface_names:
-            interface = interface_map[iname]
-            iface_name = self.get_inner().__class__.__name__ + '.' + iname
-            #XXX we certainly shouldn't do an individual has access check for each interface but rather process them all at the same time
-            if has_access(agent=agent, resource=resource, interface=iface_name, diagnose=diagnose):
+            iface_name = cls.__name__ + '.' + iname
+            if iface_name in allowed:
                 self._interfaces.add(iface_name)
-                self.add_permissions(interface)
+                self.add_permissions(interface_map[iname])
     
     def add_permissions(self, interface):
         for attr, perm in interface.__dict__.iteritems():
@@ -0,0 +1,38 @@
+from django.conf import settings
+
+from apps.plus_permissions import access_cache, search_queue
+
+class AccessCacheMiddleware(object) :
+    """ remembers has_access decisions for the length of one request. Put it after AnonUserMiddleware.
+    With DEBUG on, the hit / miss counts are reported in an X-Access-Cache header """
+
+    def process_request(self, request):
+        access_cache.start()
+        return None
+
+    def process_response(self, request, response):
+        counter = access_cache.stop()
+        if settings.DEBUG :
+            response['X-Access-Cache'] = 'hits=%s; misses=%s; invalidations=%s' % (counter.get('hits', 0), counter.get('misses', 0), counter.get('invalidations', 0))
+        return response
+
+    def process_exception(self, request, exception):
+        access_cache.stop()
+        return None
+
+
+class SearchQueueMiddleware(object) :
+    """ holds back the refs changed during a request and only queues them for the search_worker once the
+    response is on its way. Like FeedDeliveryMiddleware, must come before TransactionMiddleware """
+
+    def process_request(self, request):
+        search_queue.start()
+        return None
+
+    def process_response(self, request, response):
+        search_queue.flush()
+        return response
+
+    def process_exception(self, request, exception):
+        search_queue.discard()
+        return None
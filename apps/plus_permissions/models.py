@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, connection
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 
@@ -7,6 +7,7 @@ from apps.plus_groups.models import TgGroup
 from django.db.transaction import commit_on_success
 
 from apps.plus_permissions.site import Site
+from apps.plus_permissions import access_cache, acl_index, search_queue
 
 import pickle
 import simplejson
@@ -264,10 +265,15 @@ class SecurityContext(models.Model):
      def move_sliders(self, interface_level_map, type_name, user):
          """move multiple sliders at the same time for a particular type, raising an error if the final position violates constraints
          """
-         for interface, agent in interface_level_map.iteritems():
-             if interface.split('.')[0] == type_name:
-                 self.move_slider(agent, interface, user, skip_validation=True)
-         self.validate_constraints(type_name)
+         try:
+             for interface, agent in interface_level_map.iteritems():
+                 if interface.split('.')[0] == type_name:
+                     self.move_slider(agent, interface, user, skip_validation=True)
+             self.validate_constraints(type_name)
+         except:
+             # the moves are about to be rolled back, so forget anything decided from them
+             access_cache.invalidate(self)
+             raise
  
      def can_set_manage_permissions(self, interface, user):
          type_name, iface_name = interface.split('.')
@@ -441,9 +447,40 @@ class GenericReference(models.Model):
 
     attachments = models.ManyToManyField('GenericReference',related_name='attached_to')
 
+    # copied here from obj by its save, so listings and search can filter on the ref alone.
+    # listed : obj shows up in listings (not a stub, not an inactive member's profile)
+    # owner : the group a resource / page is in
+    listed = models.BooleanField(default=True, db_index=True)
+    owner = models.ForeignKey('GenericReference', related_name='owned', null=True)
+
+    def __init__(self, *args, **kwargs) :
+        super(GenericReference, self).__init__(*args, **kwargs)
+        # as loaded, so that save can tell when it changes
+        self._was_listed = self.listed
+
+    def save(self, *args, **kwargs) :
+        """ notify=False for saves which only change how the ref is secured (its security contexts, and where it
+        acquires them from). The search index doesn't hold those, and the feeds hear about permission changes
+        from the tags and contexts themselves """
+        notify = kwargs.pop('notify', True)
+        listed_changed = self.id and self.listed != self._was_listed
+        super(GenericReference, self).save(*args, **kwargs)
+        self._was_listed = self.listed
+        if listed_changed :
+            # only listed refs count towards the related tags
+            from apps.plus_tags import tag_index
+            tag_index.listed_changed(self)
+        if notify :
+            from apps.plus_explore import rss_cache
+            rss_cache.ref_changed(self)
+            search_queue.ref_changed(self)
+
     def delete(self) :
         # remove the generic reference
         # try not to call this directly, but via deleting a group etc. (which we'll wrap in a transaction)
+        from apps.plus_explore import rss_cache
+        rss_cache.ref_changed(self)
+        search_queue.ref_changed(self)
 
         # remove tags                                                                                                    
         from apps.plus_tags.models import TagItem, tag_item_delete
@@ -525,7 +562,7 @@ class SecurityTag(models.Model) :
     def add_agents(self, agents=None):
          """pass in a list of users and groups
          """
-         
+         access_cache.invalidate(self.security_context)
          db_agents = self.agents
          adds = []
          for agent in agents:
@@ -534,6 +571,7 @@ class SecurityTag(models.Model) :
                      adds.append(agent)
          self.agents.add(*adds)
          self.save()
+         self.changed()
 
 
 
@@ -541,6 +579,7 @@ class SecurityTag(models.Model) :
     def remove_agents(self, agents=None):
          """pass in a list of users and groups
          """
+         access_cache.invalidate(self.security_context)
          db_agents = self.agents
          removes = []
          for agent in agents: 
@@ -549,11 +588,24 @@ class SecurityTag(models.Model) :
                      removes.append(agent)
          self.agents.remove(*removes)
          self.save()
+         self.changed()
 
     def clone_for_context(self, other_context) :
         new_st = SecurityTag(interface=self.interface, security_context=other_context)
         new_st.save()
         new_st.add_agents(self.agents.all())
+
+    def changed(self) :
+        acl_index.tag_changed(self)
+        from apps.plus_explore import rss_cache
+        rss_cache.tag_changed(self)
+        if self.interface == 'FeedItem.Viewer' :
+            from apps.plus_feed.timeline import viewer_tag_changed
+            viewer_tag_changed(self)
+
+    def delete(self) :
+        self.changed()
+        super(SecurityTag, self).delete()
             
 
     def __str__(self) :
@@ -562,12 +614,217 @@ class SecurityTag(models.Model) :
 
 
 
+def strip_wrapper(x) :
+    # make sure we've stripped x from any SecureWrappers
+    if x.__class__.__name__ == "SecureWrapper":
+        return x.get_inner()
+    return x
+
+
+def get_refs_for(objects) :
+    """ Map (class, id) of each object to its GenericReference, with one query per content type rather than one per object
+    """
+    ids_by_type = {}
+    for obj in objects :
+        ids_by_type.setdefault(obj.__class__, set()).add(obj.id)
+
+    refs = {}
+    for cls, ids in ids_by_type.iteritems() :
+        content_type = ContentType.objects.get_for_model(cls)
+        for ref in GenericReference.objects.filter(content_type=content_type, object_id__in=list(ids)) :
+            refs[(cls, ref.object_id)] = ref
+    return refs
+
+
+def get_context_id(obj, ref) :
+    """ The id of the SecurityContext of obj, read straight from its GenericReference where possible
+    """
+    if ref :
+        if ref.explicit_scontext_id :
+            return ref.explicit_scontext_id
+        if ref.acquired_scontext_id :
+            return ref.acquired_scontext_id
+    # not resolved yet, so let get_security_context walk acquires_from (and store the result on the ref)
+    return obj.get_security_context().id
+
+
+def get_tag_agent_ids(interfaces, context_ids) :
+    """ For the SecurityTags of each of the interfaces in each of the context_ids, return a dictionary of
+    (security_context_id, interface) -> set of allowed agent GenericReference ids. One query however many
+    contexts and interfaces there are. Pairs which don't have a tag yet are missing from the dictionary.
+    """
+    if isinstance(interfaces, basestring) :
+        interfaces = [interfaces]
+    interfaces = list(set(interfaces))
+    context_ids = list(set(context_ids))
+    if not context_ids or not interfaces :
+        return {}
+
+    # go straight to the tables, the ORM would give us the agents but not which tag they belong to
+    # (left join, because a tag with no agents at all still exists, and so mustn't be re-created)
+    field = SecurityTag._meta.get_field('agents')
+    tag_table = SecurityTag._meta.db_table
+    cursor = connection.cursor()
+    cursor.execute("SELECT t.%s, t.interface, a.%s FROM %s t LEFT JOIN %s a ON a.%s = t.id WHERE t.interface IN (%s) AND t.%s IN (%s)" % \
+                       (SecurityTag._meta.get_field('security_context').column, field.m2m_reverse_name(),
+                        tag_table, field.m2m_db_table(), field.m2m_column_name(),
+                        ",".join(['%s'] * len(interfaces)),
+                        SecurityTag._meta.get_field('security_context').column,
+                        ",".join(['%s'] * len(context_ids))),
+                   interfaces + context_ids)
+
+    agent_ids = {}
+    for context_id, interface, agent_id in cursor.fetchall() :
+        agents = agent_ids.setdefault((context_id, interface), set())
+        if agent_id is not None :
+            agents.add(agent_id)
+    return agent_ids
+
+
+def get_agent_ref_ids(agent) :
+    """ The GenericReference ids of the agent and of every group it is (transitively) a member of.
+    This is the agent side of has_access, computed once so it can be intersected with many tags.
+    """
+    ref_ids = set([agent.get_ref().id])
+    group_ids = [g.id for g in agent.get_enclosure_set()]
+    if group_ids :
+        group_type = ContentType.objects.get_for_model(TgGroup)
+        ref_ids.update(GenericReference.objects.filter(content_type=group_type, object_id__in=group_ids).values_list('id', flat=True))
+    return ref_ids
+
+
 def secure_filter(agent, objects, interface):
     """ Don't do 1000 requests if we have 1000 objects in a list and want to know which ones we can view or search.
     user --> agents --> security context --> security tag <-- interface
     resources --> security_contexts --> security tags <-- interface
+
+    objects is a list or queryset of one or more types; interface is the short name e.g. 'Viewer' which is
+    qualified by each object's class. Returns the (unwrapped) objects the agent has the interface on, in order.
     """
-    pass
+    agent = strip_wrapper(agent)
+    objects = [strip_wrapper(obj) for obj in objects]
+    if not objects :
+        return []
+
+    refs = get_refs_for(objects)
+    contexts = []
+    for obj in objects :
+        contexts.append(get_context_id(obj, refs.get((obj.__class__, obj.id))))
+
+    tag_agents = get_tag_agent_ids(['%s.%s' % (cls.__name__, interface) for cls in set([obj.__class__ for obj in objects])], contexts)
+
+    held = get_agent_ref_ids(agent)
+    anonymous_id = get_anonymous_group().get_ref().id
+    creator_id = get_creator_agent().id
+
+    allowed = []
+    for obj, context_id in zip(objects, contexts) :
+        iface_name = '%s.%s' % (obj.__class__.__name__, interface)
+        allowed_agents = tag_agents.get((context_id, iface_name))
+        if allowed_agents is None :
+            # no tag for this interface yet, has_access knows how to create it from the defaults
+            if has_access(agent, obj, iface_name) :
+                allowed.append(obj)
+            continue
+
+        if anonymous_id in allowed_agents or allowed_agents.intersection(held) :
+            allowed.append(obj)
+        elif creator_id in allowed_agents and isinstance(agent, User) :
+            ref = refs.get((obj.__class__, obj.id))
+            if ref and ref.creator_id == agent.id :
+                allowed.append(obj)
+    return allowed
+
+
+def agents_with_access(agents, resource, interface) :
+    """ The other way round from secure_filter : which of many agents (Users or TgGroups) have interface
+    (full name e.g. 'FeedItem.Viewer') on one resource. Used to fan a feed item out to its followers.
+    Group membership comes from MembershipClosure in one query, rather than each agent's enclosure set.
+    """
+    from apps.plus_groups.models import MembershipClosure
+    agents = [strip_wrapper(a) for a in agents]
+    resource = strip_wrapper(resource)
+    if not agents :
+        return []
+
+    context = resource.get_security_context()
+    allowed_ids = get_tag_agent_ids([interface], [context.id]).get((context.id, interface))
+    if allowed_ids is None :
+        # no tag for this interface yet, has_access knows how to create it from the defaults
+        return [a for a in agents if has_access(a, resource, interface, sec_context=context)]
+
+    if get_anonymous_group().get_ref().id in allowed_ids :
+        return agents
+
+    group_type = ContentType.objects.get_for_model(TgGroup)
+    allowed_pairs = set(GenericReference.objects.filter(id__in=allowed_ids).values_list('content_type', 'object_id'))
+    group_ids = [object_id for type_id, object_id in allowed_pairs if type_id == group_type.id]
+    if group_ids :
+        allowed_pairs.update(MembershipClosure.objects.filter(group__in=group_ids).values_list('member_type', 'member_id'))
+
+    creator_id = None
+    if get_creator_agent().id in allowed_ids :
+        creator_id = resource.get_ref().creator_id
+
+    allowed = []
+    for agent in agents :
+        if (ContentType.objects.get_for_model(agent).id, agent.id) in allowed_pairs :
+            allowed.append(agent)
+        elif creator_id and isinstance(agent, User) and agent.id == creator_id :
+            allowed.append(agent)
+    return allowed
+
+
+def get_interfaces_for(agent, resource, interfaces, sec_context=None) :
+    """ Which of interfaces (full names e.g. 'TgGroup.Viewer') does the agent have on this resource.
+    Same rules as has_access, but all the tags for the security context come back in one query and the
+    agent's enclosures are looked up at most once, rather than once per interface.
+    """
+    agent = strip_wrapper(agent)
+    resource = strip_wrapper(resource)
+    if not sec_context :
+        sec_context = resource.get_security_context()
+
+    decisions = {}
+    for interface in interfaces :
+        decision = access_cache.get_decision(agent, sec_context, interface)
+        if decision is not None :
+            decisions[interface] = decision
+
+    undecided = [i for i in interfaces if i not in decisions]
+    if undecided :
+        tag_agents = get_tag_agent_ids(undecided, [sec_context.id])
+        own_ids = set([agent.get_ref().id, get_anonymous_group().get_ref().id])
+        creator_id = get_creator_agent().id
+        held = None
+        for interface in undecided :
+            allowed_agents = tag_agents.get((sec_context.id, interface))
+            if allowed_agents is None :
+                # no tag for this interface yet, has_access knows how to create it from the defaults
+                # (and remembers its own decision)
+                decisions[interface] = has_access(agent, resource, interface, sec_context=sec_context)
+                continue
+
+            if not allowed_agents.intersection(own_ids) :
+                if held is None :
+                    held = get_agent_ref_ids(agent)
+                if not allowed_agents.intersection(held) :
+                    decisions[interface] = creator_id in allowed_agents and access_cache.CREATOR_ONLY or False
+                    access_cache.store_decision(agent, sec_context, interface, decisions[interface])
+                    continue
+            decisions[interface] = True
+            access_cache.store_decision(agent, sec_context, interface, True)
+
+    allowed = set()
+    is_creator = None
+    for interface, decision in decisions.iteritems() :
+        if decision == access_cache.CREATOR_ONLY :
+            if is_creator is None :
+                is_creator = isinstance(agent, User) and resource.get_ref().creator_id == agent.id
+            decision = is_creator
+        if decision :
+            allowed.add(interface)
+    return allowed
 
 
 def has_access(agent, resource, interface, sec_context=None, diagnose=None) :
@@ -591,6 +848,17 @@ def has_access(agent, resource, interface, sec_context=None, diagnose=None) :
     else:
         context = sec_context
 
+    if not diagnose :
+        decision = access_cache.get_decision(agent, context, interface)
+        if decision is None :
+            decision = acl_index.lookup(agent, context.id, interface)
+            if decision is not None :
+                access_cache.store_decision(agent, context, interface, decision)
+        if decision == access_cache.CREATOR_ONLY :
+            return bool(resource) and agent == resource.get_ref().creator
+        if decision is not None :
+            return decision
+
     if not SecurityTag.objects.filter(interface=interface, security_context=context):
         #lets create it if it is in defaults for the type -- this allows adding new interfaces to the type at runtime
         typ = resource.__class__
@@ -603,30 +871,35 @@ def has_access(agent, resource, interface, sec_context=None, diagnose=None) :
 
 
     # which agents have access?
+    read_generation = acl_index.generation(context.id, interface)
     allowed_agents = SecurityTag.objects.get(interface=interface,
                                              security_context=context).agents
     
 
-    # probably should redis both allowed agents (per .View interface) and 
-    # agents held per user to allow many queries very quickly. 
     allowed_agents = set([a.obj for a in allowed_agents.all()])
+    # so that next time we can answer from redis (see acl_index)
+    acl_index.index_agents(context.id, interface, allowed_agents, read_generation)
 
     # diagnostic
     if diagnose :
         diagnostics['allowed_agents'] = allowed_agents
     
     if agent in allowed_agents : # agent must hold itself. agent.get_enclosures no longer includes agent
+        access_cache.store_decision(agent, context, interface, True)
         return True
 
     if get_anonymous_group() in allowed_agents: 
         # in other words, if this resource is matched with anyone, we don't have to test 
         #that user is in the "anyone" group
+        access_cache.store_decision(agent, context, interface, True)
         return True
 
+    creator_allowed = get_creator_agent().obj in allowed_agents
     if resource:
-        if get_creator_agent().obj in allowed_agents:
+        if creator_allowed:
             actual_creator = resource.get_ref().creator
             if agent == actual_creator:
+                # true for this resource, but says nothing about the rest of the context, so don't remember it
                 return True
 
     agents_held = agent.get_enclosure_set()
@@ -635,8 +908,11 @@ def has_access(agent, resource, interface, sec_context=None, diagnose=None) :
         diagnostics['agents_held'] = agents_held
 
     if allowed_agents.intersection(agents_held):
+        access_cache.store_decision(agent, context, interface, True)
         return True
 
+    access_cache.store_decision(agent, context, interface, creator_allowed and access_cache.CREATOR_ONLY or False)
+
 
     if diagnose :
         print
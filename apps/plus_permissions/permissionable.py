@@ -5,7 +5,6 @@ from django.contrib.auth.models import UserManager, User
 
 from apps.plus_lib.models import extract
 from apps.plus_permissions.interfaces import secure_wrap
-from apps.plus_permissions.decorators import check_interfaces
 from apps.plus_permissions.exceptions import PlusPermissionsNoAccessException
 
 from django.conf import settings
@@ -17,11 +16,127 @@ class MissingSecurityContextException(Exception):
         self.msg = 'Missing %s when creating a %s' % (context,cls)
 
 
+def stable_order(queryset):
+    """ queryset ordered so that slices of it never overlap or skip rows : its own ordering (if any) with pk as
+    the tie-breaker """
+    query = queryset.query
+    if query.extra_order_by:
+        return queryset
+    ordering = list(query.order_by)
+    if not ordering and query.default_ordering:
+        ordering = list(queryset.model._meta.ordering)
+    if '?' in ordering:
+        return queryset
+    if [o for o in ordering if o.lstrip('-') in ('pk', 'id')]:
+        return queryset
+    return queryset.order_by(*(ordering + ['pk']))
+
+def allowed_rows(p_user, rows, required_interfaces, all_or_any='ALL'):
+    """ the rows on which p_user has all (or, with all_or_any 'ANY', any) of required_interfaces, in order.
+    The one test of required_interfaces that both iterating and counting a SecuredQuerySet use """
+    rows = list(rows)
+    if not required_interfaces:
+        return rows
+    if all_or_any == 'ALL':
+        for i_name in required_interfaces:
+            rows = secure_filter(p_user, rows, i_name)
+        return rows
+    allowed = set()
+    for i_name in required_interfaces:
+        allowed.update(secure_filter(p_user, [r for r in rows if r not in allowed], i_name))
+    return [r for r in rows if r in allowed]
+
+
+class SecuredQuerySet(object):
+    """ The results of plus_filter. Pages through the underlying queryset chunk_size rows at a time, securing each
+    chunk as a batch, and only as far as it's been asked to go. So results[:10] or iterating and breaking early
+    doesn't touch the rest of the table. Supports iteration, indexing, slicing, len() and count() like a QuerySet.
+    """
+    chunk_size = 50
+
+    def __init__(self, manager, queryset, p_user, interface_names=None, required_interfaces=None, all_or_any='ALL', chunk_size=None):
+        self.manager = manager
+        # chunks are taken by offset, which needs a total order
+        self.queryset = stable_order(queryset)
+        self.p_user = p_user
+        self.interface_names = interface_names
+        self.required_interfaces = required_interfaces
+        self.all_or_any = all_or_any
+        if chunk_size:
+            self.chunk_size = chunk_size
+        self._results = []   # secured so far
+        self._offset = 0     # how far into queryset we've read
+        self._exhausted = False
+
+    def _fetch_chunk(self):
+        rows = list(self.queryset[self._offset:self._offset + self.chunk_size])
+        self._offset += len(rows)
+        if len(rows) < self.chunk_size:
+            self._exhausted = True
+        self._results.extend(self.manager.secure_results_set(rows, self.p_user, interface_names=self.interface_names, 
+                                                             required_interfaces=self.required_interfaces, all_or_any=self.all_or_any))
+
+    def _fill(self, n=None):
+        """ secure until we have at least n results (or all of them if n is None) """
+        while not self._exhausted and (n is None or len(self._results) < n):
+            self._fetch_chunk()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            self._fill(i + 1)
+            if i >= len(self._results):
+                return
+            yield self._results[i]
+            i += 1
+
+    def __len__(self):
+        self._fill()
+        return len(self._results)
+
+    def __nonzero__(self):
+        self._fill(1)
+        return bool(self._results)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            if (k.start is not None and k.start < 0) or k.stop is None or k.stop < 0:
+                self._fill()
+            else:
+                self._fill(k.stop)
+            return self._results[k]
+        if k < 0:
+            self._fill()
+        else:
+            self._fill(k + 1)
+        return self._results[k]
+
+    def count(self):
+        """ Unlike len(), doesn't wrap the results, so it's cheaper when we only want the number (e.g. for a paginator) """
+        if not self.required_interfaces:
+            # nothing gets filtered out
+            return self.queryset.count()
+
+        count = len(self._results)
+        offset = self._offset
+        exhausted = self._exhausted
+        while not exhausted:
+            rows = list(self.queryset[offset:offset + self.chunk_size])
+            offset += len(rows)
+            exhausted = len(rows) < self.chunk_size
+            count += len(allowed_rows(self.p_user, rows, self.required_interfaces, self.all_or_any))
+        return count
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class PermissionableManager(models.Manager):
     # if a permission_agent is passed, only get or filter items which 
     # pass a security check
     def plus_filter(self, p_user, interface_names=None, required_interfaces=None, all_or_any='ALL', limit=None, distinct=None, **kwargs):
-        """XXX this should itself be evalutated "lazily" e.g. when indexed in the same way as the filter statement which it uses.
+        """Returns a SecuredQuerySet, which is evaluated lazily, a chunk at a time, as it's indexed or iterated.
+        With a limit, returns a list of (at most) the first limit results.
         """            
         if not interface_names:
             interface_names = ['Viewer']
@@ -29,31 +144,16 @@ class PermissionableManager(models.Manager):
         if distinct:
             resources = resources.distinct()
 
+        secured = SecuredQuerySet(self, resources, p_user, interface_names=interface_names, required_interfaces=required_interfaces, all_or_any=all_or_any)
         if limit:
-            high_index = min(limit*2, resources.count())
-            secured = self.secure_results_set(resources[0:high_index], p_user, interface_names=interface_names, required_interfaces=required_interfaces, all_or_any=all_or_any)
-            while len(secured) < limit and high_index < resources.count():
-                offset = high_index
-                high_index = high_index * float(limit) / len(secured)
-                high_index = min(high_index, resources.count())
-                secured += self.secure_results_set(resources[offset:high_index]) 
-            return secured
-        else: 
-            return self.secure_results_set(resources, p_user, interface_names=interface_names, required_interfaces=required_interfaces, all_or_any=all_or_any)
+            return list(secured[:limit])
+        return secured
 
     def secure_results_set(self, resources, p_user, interface_names=None, required_interfaces=None, all_or_any='ALL'):
-        wrapped_resources = []
-        for resource in resources:
-            wrapped = secure_wrap(resource, p_user, interface_names=interface_names)
-            if required_interfaces:
-                try:
-                    check_interfaces(wrapped, resource.__class__, required_interfaces=required_interfaces, all_or_any=all_or_any)
-                    wrapped_resources.append(wrapped)
-                except PlusPermissionsNoAccessException:
-                    pass
-            else:
-                wrapped_resources.append(wrapped)
-        return wrapped_resources
+        # throw away, in a few set-based queries, everything without the required interfaces (the same test
+        # SecuredQuerySet.count uses), so we only pay for wrapping the survivors
+        resources = allowed_rows(p_user, resources, required_interfaces, all_or_any)
+        return [secure_wrap(resource, p_user, interface_names=interface_names) for resource in resources]
 
 
     def plus_get(self, p_user, interface_names=None, **kwargs) :
@@ -61,10 +161,10 @@ class PermissionableManager(models.Manager):
         return secure_wrap(a, p_user, interface_names=interface_names)
  
     def plus_count(self, p_user, **kwargs) :
-        count = 0
-        for res in self.plus_filter(p_user, **kwargs) :
-            count = count + 1
-        return count
+        secured = self.plus_filter(p_user, **kwargs)
+        if isinstance(secured, SecuredQuerySet) :
+            return secured.count()
+        return len(secured)
 
     def is_custom(self) : 
         return True
@@ -112,7 +212,7 @@ def to_security_context(self):
     self.set_security_context(sc)
     return sc
 
-from apps.plus_permissions.models import get_interface_map, PossibleTypes
+from apps.plus_permissions.models import get_interface_map, PossibleTypes, secure_filter
 
 def create_custom_security_context(self) :
     original_sc = self.get_security_context()
@@ -141,15 +241,25 @@ def use_acquired_security_context(self):
     sc.delete()
     # check that related security tags are deleted here
     sc = self.get_security_context()
+    notify_context_changed(self)
     return sc
 
+def notify_context_changed(self) :
+    # who can see self has changed, so may the anonymous feeds. And let types which cache things by security
+    # context know
+    from apps.plus_explore import rss_cache
+    rss_cache.permissions_changed()
+    if hasattr(self, 'security_context_changed') :
+        self.security_context_changed()
+
 def set_security_context(self, scontext):
     """Set the security context used by this object
     """
     ref = self.get_ref()
     #if we are passing in a target, the get its security context 
     ref.explicit_scontext = scontext
-    ref.save()
+    ref.save(notify=False)
+    notify_context_changed(self)
 
 def get_security_context(self):
     """Get the security context for this object """
@@ -161,7 +271,8 @@ def get_security_context(self):
     else:
         try:
             ref.acquired_scontext = ref.acquires_from.obj.get_security_context()
-            ref.save()
+            # just remembering it, nothing has changed
+            ref.save(notify=False)
         except Exception, e:
             print e
             raise e
@@ -178,7 +289,7 @@ def acquires_from(self, content_obj):
     ref = self.get_ref()
     assert(content_obj.get_ref())
     ref.acquires_from = content_obj.get_ref()
-    ref.save()
+    ref.save(notify=False)
     return ref
 
 def get_creator(self):
@@ -22,3 +22,19 @@ class GenericIndex(search_index):
         return GenericReference.objects.filter(content_type__model__in=['wikipage', 'resource', 'profile', 'tggroup'])
 
 site.register(GenericReference, GenericIndex)
+
+
+# so pysolr converts the results by field type, rather than guessing from their values
+import pysolr
+
+solr_types = {'CharField':'string', 'IntegerField':'int', 'FloatField':'float', 'BooleanField':'boolean',
+              'DateTimeField':'datetime', 'DateField':'date'}
+
+def field_types(index) :
+    types = {'id':'string', 'django_ct':'string', 'django_id':'string', 'score':'float'}
+    for name, field in index.fields.items() :
+        if field.__class__.__name__ in solr_types :
+            types[name] = solr_types[field.__class__.__name__]
+    return types
+
+pysolr.set_field_types(field_types(GenericIndex))
@@ -0,0 +1,173 @@
+""" Keeping the search index up to date from a queue, rather than reindexing everything from cron.
+
+Saving or deleting a GenericReference of an indexed type (ie. whenever a resource, page, group or profile is saved
+or deleted, as their saves all save the ref) adds its id to a redis set. The search_worker management command takes
+ids off it a batch at a time, re-reads each ref and either indexes it or, if it's gone (or no longer in
+GenericIndex.get_queryset), removes it from the index. One post of the whole batch and one commit.
+
+As with feed delivery, ids noted during a request are held back until SearchQueueMiddleware sees the response, after
+TransactionMiddleware has committed, so the worker never reads a ref before its changes are there.
+
+The queue is a set, so a ref saved many times before the worker gets to it is only indexed once. Ids being worked on
+are moved (SMOVE) to a set of the worker's own and only removed once they're in Solr. If the batch fails they go back
+on the queue. If the worker is killed they stay put, until search_worker --recover (run while no workers are) puts
+them back, so nothing is lost. update_index / rebuild_index are then only needed to recover a lost index.
+
+Saves which only change how a ref is secured (GenericReference.save(notify=False)) aren't queued, as the index
+doesn't hold anything about permissions.
+
+With SEARCH_INDEX_QUEUE = False in settings nothing is queued (use the hourly update_index, or HAYSTACK_REAL_TIME).
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+import traceback
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+
+from apps.plus_lib.redis_lib import redis
+
+USE_QUEUE = getattr(settings, 'SEARCH_INDEX_QUEUE', True)
+BATCH_SIZE = getattr(settings, 'SEARCH_INDEX_BATCH', 100)
+
+# the types GenericIndex.get_queryset indexes
+INDEXED_MODELS = ['wikipage', 'resource', 'profile', 'tggroup']
+
+
+def queue_key() :
+    return "search_index_queue:%s" % settings.DOMAIN_NAME
+
+def worker_name() :
+    return "%s:%s" % (socket.gethostname(), os.getpid())
+
+def processing_key(worker=None) :
+    """ the ids worker (by default, this process) has taken off the queue but not finished with """
+    return "search_index_processing:%s:%s" % (settings.DOMAIN_NAME, worker or worker_name())
+
+
+_local = threading.local()
+
+def start() :
+    _local.pending = set()
+
+def flush() :
+    """ queue the refs changed during the request, now that they're committed """
+    pending = getattr(_local, 'pending', None)
+    _local.pending = None
+    if pending :
+        pipe = redis.pipeline()
+        for ref_id in pending :
+            pipe.sadd(queue_key(), ref_id)
+        pipe.execute()
+
+def discard() :
+    """ the request failed, so its changes were rolled back """
+    _local.pending = None
+
+def ref_changed(ref) :
+    """ ref has been saved, or is being deleted """
+    if not USE_QUEUE :
+        return
+    if ContentType.objects.get_for_id(ref.content_type_id).model not in INDEXED_MODELS :
+        return
+    pending = getattr(_local, 'pending', None)
+    if pending is not None :
+        pending.add(ref.id)
+    else :
+        redis.sadd(queue_key(), ref.id)
+
+def queue_length() :
+    return redis.scard(queue_key())
+
+
+def give_back(key) :
+    """ put everything in the processing set at key back on the queue """
+    ref_ids = redis.smembers(key)
+    pipe = redis.pipeline()
+    for ref_id in ref_ids :
+        pipe.smove(key, queue_key(), ref_id)
+    pipe.execute()
+    return len(ref_ids)
+
+def recover() :
+    """ put back whatever workers had taken but not finished. Only for when no worker is running, since a running
+    worker's set looks just the same """
+    return sum([give_back(key) for key in redis.keys(processing_key('*'))])
+
+def take(size) :
+    """ move up to size ids from the queue to the processing set, and return them """
+    pipe = redis.pipeline()
+    for i in range(size) :
+        pipe.srandmember(queue_key())
+    ref_ids = list(set([ref_id for ref_id in pipe.execute() if ref_id is not None]))
+
+    pipe = redis.pipeline()
+    for ref_id in ref_ids :
+        pipe.smove(queue_key(), processing_key(), ref_id)
+    # (another worker may have got there first)
+    return [ref_id for ref_id, moved in zip(ref_ids, pipe.execute()) if moved]
+
+def done(ref_ids) :
+    pipe = redis.pipeline()
+    for ref_id in ref_ids :
+        pipe.srem(processing_key(), ref_id)
+    pipe.execute()
+
+
+def solr_id(ref_id) :
+    """ the id haystack gives a GenericReference's document """
+    from apps.plus_permissions.models import GenericReference
+    return '%s.%s.%s' % (GenericReference._meta.app_label, GenericReference._meta.module_name, ref_id)
+
+def index_batch(ref_ids) :
+    """ bring the index up to date for ref_ids : index those which are still there, remove the rest. One commit """
+    from haystack import site
+    from apps.plus_permissions.models import GenericReference
+    index = site.get_index(GenericReference)
+    backend = index.backend
+
+    refs = list(index.get_queryset().filter(id__in=ref_ids))
+    if refs :
+        backend.update(index, refs, commit=False)
+    found = set([ref.id for ref in refs])
+    gone = [solr_id(ref_id) for ref_id in ref_ids if ref_id not in found]
+    if gone :
+        backend.conn.delete_ids(gone, commit=False)
+    backend.conn.commit()
+    return len(refs), len(gone)
+
+
+def work(timeout=5, once=False, batch_size=BATCH_SIZE) :
+    """ index refs from the queue as they're changed. If once, stop when the queue is empty. Returns how many
+    refs were indexed or removed """
+    handled = 0
+    started = time.time()
+    while True :
+        ref_ids = take(batch_size)
+        if not ref_ids :
+            if once :
+                break
+            time.sleep(timeout)
+            continue
+
+        try :
+            updated, removed = index_batch([int(ref_id) for ref_id in ref_ids])
+            done(ref_ids)
+            handled = handled + updated + removed
+        except Exception, e :
+            # leave them to be retried, but don't spin on a batch that keeps failing (eg. solr is down)
+            sys.stderr.write('failed to index %s refs\n' % len(ref_ids))
+            traceback.print_exc()
+            give_back(processing_key())
+            time.sleep(timeout)
+            if once :
+                break
+
+    elapsed = time.time() - started
+    if handled and elapsed :
+        sys.stderr.write('%.1f refs / second\n' % (handled / elapsed))
+    return handled
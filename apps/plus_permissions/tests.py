@@ -21,8 +21,10 @@ from OurPost import OurPost
 from apps.plus_permissions.api import has_access, secure_resource
 from apps.plus_permissions.interfaces import secure_wrap, PlusPermissionsNoAccessException, SecureWrapper
 from apps.plus_permissions.models import InvalidSliderConfiguration
-from apps.plus_permissions.default_agents import get_anonymous_group, get_all_members_group
+from apps.plus_permissions.default_agents import get_anonymous_group, get_all_members_group, get_admin_user
 from apps.plus_permissions.proxy_hmac import attach_hmac, confirm_hmac, hmac_proxy
+from apps.plus_permissions import access_cache, acl_index, search_queue
+from apps.plus_lib.redis_lib import redis
 
 
 class TestHierarchy(unittest.TestCase):
@@ -283,6 +285,12 @@ class TestAccess(unittest.TestCase) :
         
         # so should have same access
         self.assertTrue(has_access(elenor, blog, "OurPost.Editor"))   
+
+        # and resolving all the interfaces at once agrees with asking for them one at a time
+        interfaces = ['OurPost.%s' % i for i in get_interface_map('OurPost')]
+        for agent in [nahia, tuba, elenor, adam] :
+            self.assertEquals(get_interfaces_for(agent, blog2, interfaces), 
+                              set([i for i in interfaces if has_access(agent, blog2, i)]))
                        
 
 
@@ -435,6 +443,10 @@ class TestDecorators(unittest.TestCase) :
         sc2.add_arbitrary_agent(manfred, 'OurPost.Viewer', god)
 
         self.assertEquals(OurPost.objects.plus_count(manfred, body='X'), 1)
+        secured = OurPost.objects.plus_filter(manfred, body='X', required_interfaces=['Viewer'])
+        self.assertEquals(secured.count(), 1)
+        self.assertEquals([p.title for p in secured[:5]], ['post2'])
+        self.assertEquals(len(secured), 1)
         p = OurPost.objects.plus_get(manfred, title='post2')
 
         blog2._inner.get_ref().save()
@@ -448,6 +460,216 @@ class TestDecorators(unittest.TestCase) :
         self.assertRaises(PlusPermissionsNoAccessException, f, p)
 
 
+    def test_secure_filter(self) :
+        god = User(username='Odin', email_address='odin@the-hub.net')
+        god.save()
+
+        group, created= TgGroup.objects.get_or_create(group_name='asgard',
+                                                      display_name="Odin's Group",
+                                                      place=None, level='member', user=god)
+
+        posts = [group.create_OurPost(creator=god, title='post%s' % i, body='Y').get_inner() for i in range(3)]
+
+        freya = User(username='freya', email_address='freya@the-hub.net')
+        freya.save()
+        self.assertEquals(secure_filter(freya, OurPost.objects.filter(body='Y'), 'Viewer'), [])
+
+        sc = posts[1].create_custom_security_context()
+        sc.add_arbitrary_agent(freya, 'OurPost.Viewer', god)
+        self.assertEquals(secure_filter(freya, OurPost.objects.filter(body='Y'), 'Viewer'), [posts[1]])
+
+        # agrees with has_access, for members of the group too
+        group.add_member(freya)
+        for interface in ['Viewer', 'Editor'] :
+            expected = [p for p in posts if has_access(freya, p, 'OurPost.%s' % interface)]
+            self.assertEquals(secure_filter(freya, posts, interface), expected)
+
+        # a chunk at a time, count() and iterating agree, and no row is seen twice
+        from apps.plus_permissions.permissionable import SecuredQuerySet
+        for required, all_or_any in [(['Viewer', 'Editor'], 'ALL'), (['Viewer', 'Editor'], 'ANY')] :
+            secured = SecuredQuerySet(OurPost.objects, OurPost.objects.filter(body='Y'), freya,
+                                      required_interfaces=required, all_or_any=all_or_any, chunk_size=1)
+            titles = [p.title for p in secured]
+            self.assertEquals(len(titles), len(set(titles)))
+            self.assertEquals(secured.count(), len(titles))
+
+    def test_agents_with_access(self) :
+        god = User(username='Loki', email_address='loki@the-hub.net')
+        god.save()
+        group, created= TgGroup.objects.get_or_create(group_name='jotunheim',
+                                                      display_name="Loki's Group",
+                                                      place=None, level='member', user=god)
+        post = group.create_OurPost(creator=god, title='trick', body='L').get_inner()
+
+        thor = User(username='thor', email_address='thor@the-hub.net')
+        thor.save()
+        sif = User(username='sif', email_address='sif@the-hub.net')
+        sif.save()
+        sub, created = TgGroup.objects.get_or_create(group_name='bifrost', display_name='Bifrost',
+                                                     place=None, level='member', user=god)
+        sub.add_member(sif)
+        group.add_member(sub)
+
+        agents = [thor, sif, sub]
+        for interface in ['OurPost.Viewer', 'OurPost.Editor'] :
+            expected = [a for a in agents if has_access(a, post, interface)]
+            self.assertEquals(agents_with_access(agents, post, interface), expected)
+
+
+
+class TestAccessCache(unittest.TestCase) :
+
+    def test_access_cache(self) :
+        god = User(username='Zeus', email_address='zeus@the-hub.net')
+        god.save()
+        group, created= TgGroup.objects.get_or_create(group_name='olympus',
+                                                      display_name="Zeus's Group", 
+                                                      place=None, level='member', user=god)
+        post = group.create_OurPost(creator=god, title='thunder', body='Z')
+        hera = User(username='hera', email_address='hera@the-hub.net')
+        hera.save()
+
+        access_cache.start()
+        try :
+            self.assertFalse(has_access(hera, post, 'OurPost.Editor'))
+            self.assertFalse(has_access(hera, post, 'OurPost.Editor'))
+            self.assertEquals(access_cache.stats()['hits'], 1)
+
+            # moving agents in the tag forgets the decision
+            sc = post.get_inner().get_security_context()
+            sc.add_arbitrary_agent(hera, 'OurPost.Editor', god)
+            self.assertTrue(has_access(hera, post, 'OurPost.Editor'))
+            sc.remove_arbitrary_agent(hera, 'OurPost.Editor', god)
+            self.assertFalse(has_access(hera, post, 'OurPost.Editor'))
+
+            # as does changing membership
+            group.add_member(hera)
+            self.assertEquals(has_access(hera, post, 'OurPost.Viewer'), 'OurPost.Viewer' in secure_wrap(post, hera)._interfaces)
+        finally :
+            access_cache.stop()
+
+        self.assertFalse(access_cache.is_active())
+
+
+
+class TestAclIndex(unittest.TestCase) :
+
+    def test_acl_index(self) :
+        god = User(username='Ra', email_address='ra@the-hub.net')
+        god.save()
+        group, created= TgGroup.objects.get_or_create(group_name='heliopolis',
+                                                      display_name="Ra's Group", 
+                                                      place=None, level='member', user=god)
+        post = group.create_OurPost(creator=god, title='sun', body='R')
+        isis = User(username='isis', email_address='isis@the-hub.net')
+        isis.save()
+
+        sc = post.get_inner().get_security_context()
+        # first time from the db, which indexes the tag, then from redis
+        self.assertFalse(has_access(isis, post, 'OurPost.Editor'))
+        self.assertFalse(acl_index.lookup(isis, sc.id, 'OurPost.Editor'))
+
+        sc.add_arbitrary_agent(isis, 'OurPost.Editor', god)
+        # a change just drops the set, the next has_access rebuilds it
+        self.assertEquals(acl_index.lookup(isis, sc.id, 'OurPost.Editor'), None)
+        self.assertTrue(has_access(isis, post, 'OurPost.Editor'))
+        self.assertTrue(acl_index.lookup(isis, sc.id, 'OurPost.Editor'))
+        sc.move_slider(group, 'OurPost.Editor', god)
+        group.add_member(isis)
+        self.assertTrue(has_access(isis, post, 'OurPost.Editor'))
+        self.assertEquals(list(acl_index.check_index()), [])
+
+        # losing the index loses nothing
+        acl_index.rebuild_index()
+        redis.delete(acl_index.acl_key(sc.id, 'OurPost.Editor'))
+        self.assertEquals(acl_index.lookup(isis, sc.id, 'OurPost.Editor'), None)
+        self.assertTrue(has_access(isis, post, 'OurPost.Editor'))
+
+    def test_rolled_back_sliders(self) :
+        adam = get_admin_user()
+        group, created= TgGroup.objects.get_or_create(group_name='memphis', display_name="Ptah's Group", 
+                                                      place=None, level='member', user=adam)
+        post = group.create_OurPost(creator=adam, title='creation', body='P')
+        apis = User(username='apis', email_address='apis@the-hub.net')
+        apis.save()
+        sc = post.get_inner().get_security_context()
+
+        self.assertFalse(has_access(apis, post, 'OurPost.Editor'))
+        self.assertFalse(acl_index.lookup(apis, sc.id, 'OurPost.Editor'))
+
+        # Editor can't be anonymous, so this is rolled back after the sliders have moved
+        anonymous_group = get_anonymous_group()
+        self.assertRaises(InvalidSliderConfiguration, sc.move_sliders,
+                          {'OurPost.Editor':anonymous_group, 'OurPost.Viewer':anonymous_group}, 'OurPost', adam)
+        self.assertFalse(acl_index.lookup(apis, sc.id, 'OurPost.Editor'))
+        self.assertFalse(has_access(apis, post, 'OurPost.Editor'))
+        self.assertFalse(acl_index.lookup(apis, sc.id, 'OurPost.Editor'))
+
+    def test_stale_rebuild(self) :
+        adam = get_admin_user()
+        group, created= TgGroup.objects.get_or_create(group_name='thebes', display_name="Amun's Group", 
+                                                      place=None, level='member', user=adam)
+        post = group.create_OurPost(creator=adam, title='hidden', body='A')
+        mut = User(username='mut', email_address='mut@the-hub.net')
+        mut.save()
+        sc = post.get_inner().get_security_context()
+
+        # agents read before a change can't be written after it
+        read_generation = acl_index.generation(sc.id, 'OurPost.Editor')
+        sc.add_arbitrary_agent(mut, 'OurPost.Editor', adam)
+        acl_index.index_agents(sc.id, 'OurPost.Editor', [], read_generation)
+        self.assertEquals(acl_index.lookup(mut, sc.id, 'OurPost.Editor'), None)
+        self.assertTrue(has_access(mut, post, 'OurPost.Editor'))
+
+
+
+class TestSearchQueue(unittest.TestCase) :
+
+    def test_search_queue(self) :
+        god = User(username='Hermes', email_address='hermes@the-hub.net')
+        god.save()
+        redis.delete(search_queue.queue_key())
+        redis.delete(search_queue.processing_key())
+
+        # held back until the request is over
+        search_queue.start()
+        group, created= TgGroup.objects.get_or_create(group_name='kyllene',
+                                                      display_name="Hermes' Group", 
+                                                      place=None, level='member', user=god)
+        group.save()
+        post = group.create_OurPost(creator=god, title='message', body='H')
+        ref_id = str(group.get_ref().id)
+        self.assertEquals(search_queue.queue_length(), 0)
+        search_queue.flush()
+        # only the types which are indexed
+        queued = redis.smembers(search_queue.queue_key())
+        self.assertTrue(ref_id in queued)
+        self.assertFalse(str(post.get_inner().get_ref().id) in queued)
+
+        # taken ids come back if they're not finished
+        self.assertEquals(set(search_queue.take(len(queued))), queued)
+        self.assertEquals(search_queue.queue_length(), 0)
+        self.assertEquals(search_queue.recover(), len(queued))
+        taken = search_queue.take(len(queued))
+        search_queue.done(taken)
+        self.assertEquals(search_queue.recover(), 0)
+
+        # each worker has its own set, a failed batch only gives back its own
+        other = search_queue.processing_key('elsewhere:1')
+        redis.sadd(other, '999999')
+        search_queue.take(len(queued))
+        self.assertEquals(search_queue.give_back(search_queue.processing_key()), len(queued))
+        self.assertTrue(redis.sismember(other, '999999'))
+        self.assertEquals(search_queue.recover(), 1)
+        redis.delete(search_queue.queue_key())
+
+        # saves which only secure the ref aren't queued
+        group.get_ref().save(notify=False)
+        self.assertEquals(search_queue.queue_length(), 0)
+        group.get_ref().save()
+        self.assertEquals(search_queue.queue_length(), 1)
+
+
 
 class TestHMAC(unittest.TestCase):
         
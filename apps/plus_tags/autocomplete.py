@@ -0,0 +1,113 @@
+""" A redis prefix index of tag keywords for autocomplete.
+
+For each prefix of each word of a keyword (so "open source" is found by "op" and by "sou", as the old
+startswith / contains ' ' query did) there's a sorted set of the keywords, scored by how many times they've been
+used, ie. how many TagItems they have. A lookup is then one ZREVRANGE, best used first, however many tags there are.
+
+There's a separate index for each scope autocomplete can be narrowed to : everything, one tag_type, one
+tagged_for agent, or both. A scope is built from the database the first time it's asked for, then tag_add and
+tag_delete / tag_item_delete keep its counts up to date.
+"""
+
+from django.conf import settings
+from django.db.models import Count
+
+from apps.plus_lib.redis_lib import redis
+
+PREFIX_KEY = "tag_prefix"
+BUILT_KEY = "tag_prefix_built"
+# longer prefixes aren't indexed, the query is cut down to this and the results filtered
+MAX_PREFIX = 12
+
+
+def scope_name(tag_type=None, tagged_for_id=None) :
+    return '%s|%s' % (tag_type or '', tagged_for_id or '')
+
+def scopes_of(tag) :
+    """ every scope tag's keyword shows up in """
+    return [scope_name(), scope_name(tag.tag_type), scope_name(None, tag.tagged_for_id),
+            scope_name(tag.tag_type, tag.tagged_for_id)]
+
+def prefix_key(scope, prefix) :
+    if isinstance(scope, unicode) :
+        scope = scope.encode('utf-8')
+    if isinstance(prefix, unicode) :
+        prefix = prefix.encode('utf-8')
+    return "%s:%s:%s:%s" % (settings.DOMAIN_NAME, PREFIX_KEY, scope, prefix)
+
+def built_key() :
+    return "%s:%s" % (settings.DOMAIN_NAME, BUILT_KEY)
+
+
+def prefixes(keyword) :
+    found = set()
+    for word in keyword.lower().split() :
+        for i in range(1, min(len(word), MAX_PREFIX) + 1) :
+            found.add(word[:i])
+    return found
+
+def _add(pipe, scope, keyword, count) :
+    for prefix in prefixes(keyword) :
+        key = prefix_key(scope, prefix)
+        pipe.zincrby(key, keyword, count)
+        if count < 0 :
+            pipe.zremrangebyscore(key, '-inf', 0)
+
+
+def build(scope) :
+    from apps.plus_tags.models import Tag
+    tag_type, tagged_for_id = scope.split('|')
+    tags = Tag.objects.all()
+    if tag_type :
+        tags = tags.filter(tag_type=tag_type)
+    if tagged_for_id :
+        tags = tags.filter(tagged_for=int(tagged_for_id))
+
+    pipe = redis.pipeline()
+    for row in tags.values('keyword').annotate(count=Count('items')) :
+        if row['count'] :
+            _add(pipe, scope, row['keyword'], row['count'])
+    pipe.sadd(built_key(), scope)
+    pipe.execute()
+
+
+def tag_used(tag, change=1) :
+    """ an item has been tagged with tag (or, with change -1, untagged). Built scopes are adjusted, the rest will
+    be built as they're needed """
+    built = redis.smembers(built_key())
+    pipe = redis.pipeline()
+    for scope in scopes_of(tag) :
+        if scope in built :
+            _add(pipe, scope, tag.keyword, change)
+    pipe.execute()
+
+
+def complete(value, limit, tag_type=None, tagged_for_id=None) :
+    """ up to limit keywords with a word starting with value, most used first """
+    value = value.lower().strip()
+    if not value :
+        return []
+    scope = scope_name(tag_type, tagged_for_id)
+    if not redis.sismember(built_key(), scope) :
+        build(scope)
+
+    key = prefix_key(scope, value.split()[-1][:MAX_PREFIX])
+    if len(value) <= MAX_PREFIX and ' ' not in value :
+        return redis.zrevrange(key, 0, limit - 1)
+
+    # the index only gets us so far, check the rest of the value ourselves
+    keywords = []
+    for keyword in redis.zrevrange(key, 0, -1) :
+        keyword = keyword.decode('utf-8')
+        if keyword.startswith(value) or (' ' + value) in keyword :
+            keywords.append(keyword)
+            if len(keywords) == limit :
+                break
+    return keywords
+
+
+def rebuild_index() :
+    """ throw away all the scopes, they'll be built again as they're needed """
+    for key in redis.keys(prefix_key('*', '*')) :
+        redis.delete(key)
+    redis.delete(built_key())
@@ -0,0 +1,95 @@
+""" Tag clouds, computed once and kept in redis with their levels already worked out.
+
+A cloud has a scope : the whole site, the items of some search types (eg. just Members, for the profile listing),
+or the resources of one group. The first time a (scope, size) is shown it's computed and remembered, and from then on
+pages get it from redis. Any tagging bumps a version number, and the refresh_tag_clouds command (run from
+cron.hourly) recomputes every remembered cloud which is older than the current version. So a cloud is at most an
+hour behind, and nothing on the request path aggregates over the Tag table.
+"""
+
+import simplejson
+
+from django.conf import settings
+
+from apps.plus_lib.redis_lib import redis
+
+CLOUD_KEY = "tag_cloud"
+VERSION_KEY = "tag_cloud_version"
+SCOPES_KEY = "tag_cloud_scopes"
+
+
+def domain_key(name) :
+    return "%s:%s" % (settings.DOMAIN_NAME, name)
+
+def cloud_key(scope, n) :
+    return domain_key('%s:%s:%s' % (CLOUD_KEY, scope, n))
+
+
+def scope_for(search_types=None, in_group=None) :
+    """ search_types as for plus_search, in_group a group's GenericReference """
+    if in_group :
+        return 'group:%s' % in_group.id
+    if search_types :
+        return 'types:%s' % ','.join(sorted([typ for typ, info in search_types]))
+    return 'site'
+
+def tags_for_scope(scope) :
+    from apps.plus_tags.models import get_tags, Tag
+    from apps.plus_explore.views import plus_search, get_search_types, narrow_search_types
+    from apps.plus_permissions.models import GenericReference
+    kind, arg = (scope.split(':', 1) + [''])[:2]
+    if kind == 'types' :
+        types = dict(get_search_types())
+        return get_tags(tagged=tuple([(typ, types[typ]) for typ in arg.split(',') if typ in types]))
+    if kind == 'group' :
+        group_ref = GenericReference.objects.get(id=int(arg))
+        return Tag.objects.filter(items__in=plus_search([], '', narrow_search_types('Resource'), in_group=group_ref)['All'])
+    return get_tags()
+
+
+def compute(scope, n) :
+    """ the cloud of the n most used keywords in scope, in alphabetical order, each with its level """
+    from apps.plus_tags.models import tag_counts, scale_tag_weights, keyword_sort
+    counts = tag_counts(n=n, tag_set=tags_for_scope(scope))
+    if not counts :
+        return []
+    tag_levels = scale_tag_weights(counts)
+    tag_levels.sort(keyword_sort)
+    return tag_levels
+
+def store(scope, n, version=None) :
+    if version is None :
+        version = current_version()
+    tags = compute(scope, n)
+    pipe = redis.pipeline()
+    pipe.set(cloud_key(scope, n), simplejson.dumps({'version':version, 'tags':tags}))
+    pipe.sadd(domain_key(SCOPES_KEY), '%s|%s' % (scope, n))
+    pipe.execute()
+    return tags
+
+
+def get_cloud(n, search_types=None, in_group=None) :
+    scope = scope_for(search_types, in_group)
+    cached = redis.get(cloud_key(scope, n))
+    if cached :
+        return simplejson.loads(cached)['tags']
+    return store(scope, n)
+
+
+def current_version() :
+    return int(redis.get(domain_key(VERSION_KEY)) or 0)
+
+def tags_changed() :
+    redis.incr(domain_key(VERSION_KEY))
+
+def refresh(force=False) :
+    """ recompute the remembered clouds which are out of date (or all of them, if force). Returns how many """
+    version = current_version()
+    refreshed = 0
+    for entry in redis.smembers(domain_key(SCOPES_KEY)) :
+        scope, n = entry.rsplit('|', 1)
+        cached = redis.get(cloud_key(scope, n))
+        if force or not cached or simplejson.loads(cached)['version'] != version :
+            store(scope, int(n), version)
+            refreshed = refreshed + 1
+    return refreshed
@@ -5,6 +5,9 @@ from apps.plus_permissions.models import GenericReference
 from django.contrib.auth.models import User
 from django.db.models import Q
 
+from apps.plus_tags import tag_index, autocomplete, clouds
+from apps.plus_explore import rss_cache
+
 class Tag(models.Model):
     """This is the actual tag. It should be created when the first TagItem is added. It should be deleted when no more TagItems refer to it. 
     """
@@ -29,20 +32,22 @@ class TagItem(models.Model):
 
 
 def tag_autocomplete(tag_value, limit, tagged_for=None, tagged=None, tag_type=None):
-    """XXX should use a similar algorithm to top_tags here to determine 'weight'/level, but it order by weight (not alphabetically)
+    """keywords with a word starting with tag_value, of tag_type and tagged_for if given, ordered by weight
+    (how many times they've been used). Comes from the prefix index in autocomplete
     """
-    query_dict = {'partial_tag_value':tag_value}
-    if tag_type:
-        query_dict['tag_type'] = tag_type
-    tags = get_tags(**query_dict)
-    keywords = tags.values('keyword').distinct()
-    return keywords[0:limit]
+    tagged_for_id = None
+    if tagged_for != None:
+        if not isinstance(tagged_for, GenericReference):
+            tagged_for = tagged_for.get_ref()
+        tagged_for_id = tagged_for.id
+    keywords = autocomplete.complete(tag_value, int(limit), tag_type=tag_type, tagged_for_id=tagged_for_id)
+    return [{'keyword':keyword} for keyword in keywords]
 
 def get_resources_for_tag_intersection(keywords):
     items = GenericReference.objects
     if keywords:
-        for keyword in keywords:
-            items = items.filter(tag__keyword=keyword).distinct()
+        # intersect the keywords' sets in the tag index, rather than joining TagItem once per keyword
+        items = items.filter(id__in=list(tag_index.intersection(keywords)))
     return items
 
 def get_tags_for_object(tagged, user):
@@ -55,8 +60,8 @@ from django.db.models import Count
 
 
 def scale_tag_weights(tag_counts, levels=8):
-    n = tag_counts.count()
     tag_counts = [tag for tag in tag_counts] #slicing of an already sliced query set yield incorrect results
+    n = len(tag_counts)
     start_index = 0
     weighted_tags = []
     for level in range(1, levels+1):
@@ -80,10 +85,10 @@ def keyword_sort(A, B):
     return 1
 
 def tag_counts(n=50, tag_set=None):
-    counts = tag_set.values('keyword').annotate(count=Count('items')).order_by('count')
-    count = counts.count()
-    min_count = max(count-n, 0)
-    return counts[min_count:count]
+    """ the n most used keywords in tag_set, least used first. One query """
+    counts = list(tag_set.values('keyword').annotate(count=Count('items')).order_by('-count')[:n])
+    counts.reverse()
+    return counts
 
 
 from django.db.models.query import QuerySet
@@ -93,41 +98,26 @@ def counts_sort(a, b):
         return -1
     return 1
 
-def get_intersecting_tags(items, n=10, levels=8):
-    #get the tags on these items, these should not be distinct but one tag per intersection
-    # may need to get all the "TagItems here"
+def get_intersecting_tags(items, n=10, levels=8, keywords=None, models=None):
+    """ the n keywords most common amongst items, other than those on every one of them.
+    If items are just "the listed refs of these models (eg. ['profile']) tagged with keyword", give keywords and
+    models and the counts come from the tag index, rather than from items' TagItems.
+    """
     try:
         total = items.count()
     except TypeError:
         total = len(items)
 
-    # the problem with below is that when you have a single item that is tagged more than once with the same keyword - inflating the count
-    # i.e. with different tag_type, or tagged_for different users
-
-    # keywords_count = Tag.objects.filter(items__in=items).values('keyword').annotate(count=Count('keyword')).exclude(count=total)
-
-    # solution a) immediate -- add keyword to each tag_item and count tag_items by distinct (ref, keyword) combinations
-    #          b) 'a)' will not work when we need to count only items in a user's tagspace or of a particular type. 
-    #             This could be rectified by filtering tag_items by certain tag types 
-    #             OR creating a join/view of tag_items with tag_types which can then be queried.  The former is preferable if practical within the ORM constraints 
-
-    #if not isinstance(items, QuerySet):
-    #    items = GenericReference.objects.filter(id__in=items)
-
-    keywords_count = TagItem.objects.filter(ref__in=items).values('keyword', 'ref').distinct()  #keywords_count.annotate(count=Count('keyword')).exclude(count=total)
-    counts = {}
-    # not how I wanted to do it. -- maybe very inefficient with large datasets
-    for entry in keywords_count:
-        counts.setdefault(entry['keyword'], {'keyword':entry['keyword'], 'count':0})
-        counts[entry['keyword']]['count'] += 1
-        if counts[entry['keyword']]['count'] == total:
-            del counts[entry['keyword']]
-            
-
-    #top_intersections = keywords_count.order_by('-count')[:n]
-    counts = counts.values()
-    counts.sort(counts_sort)
-    top_intersections = counts[:n]
+    if models and keywords is not None and len(keywords) <= 1:
+        keyword = keywords and keywords[0] or tag_index.ALL
+        counts = tag_index.related(keyword, models, n + 1)
+        top_intersections = [{'keyword':k, 'count':int(c)} for k, c in counts if k != keyword and c < total][:n]
+    else:
+        # count items by distinct (ref, keyword), so that an item tagged more than once with the same keyword
+        # (i.e. with different tag_type, or tagged_for different users) only counts once.
+        # The database does the counting, rather than us pulling every (keyword, ref) pair into python
+        counts = TagItem.objects.filter(ref__in=items, keyword__isnull=False).values('keyword').annotate(count=Count('ref', distinct=True))
+        top_intersections = [{'keyword':c['keyword'], 'count':c['count']} for c in counts.filter(count__lt=total).order_by('-count')[:n]]
 
     if top_intersections:
         max_level = top_intersections[0]['count']
@@ -205,6 +195,10 @@ def tag_add(tagged, tag_type, tag_value, tagged_by, tagged_for=None):
                            keyword=keyword,
                            tagged_by=tagged_by)
         tag_item.save()
+        tag_index.add_ref(tag.keyword, tag_item.ref)
+        autocomplete.tag_used(tag)
+        clouds.tags_changed()
+        rss_cache.keyword_changed(tag.keyword)
         return (tag, True) 
 
 
@@ -218,7 +212,12 @@ def tag_delete(tagged, tag_type, tag_value, tagged_by, tagged_for=None):
     except Tag.DoesNotExist:
         return (None, False)
 
-    existing_tag_item = existing_tag.items.remove(tagged.get_ref())
+    ref = tagged.get_ref()
+    existing_tag_item = existing_tag.items.remove(ref)
+    tag_index.remove_ref(existing_tag.keyword, ref)
+    autocomplete.tag_used(existing_tag, -1)
+    clouds.tags_changed()
+    rss_cache.keyword_changed(existing_tag.keyword)
 
     if not existing_tag.items.count():
         existing_tag.delete()
@@ -229,6 +228,10 @@ def tag_item_delete(tag_item):
     tag = tag_item.tag
     ref = tag_item.ref
     tag.items.remove(ref)
+    tag_index.remove_ref(tag.keyword, ref)
+    autocomplete.tag_used(tag, -1)
+    clouds.tags_changed()
+    rss_cache.keyword_changed(tag.keyword)
     if not tag.items.count():
         tag.delete()
 
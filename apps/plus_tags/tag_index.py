@@ -0,0 +1,208 @@
+""" An inverted index of tags : for each keyword, a redis set of the ids of the GenericReferences tagged with it.
+
+A keyword's set is built from TagItem the first time it's needed and then kept up to date by tag_add, tag_delete
+and tag_item_delete. Intersecting several keywords is then a matter of intersecting the sets, smallest first, rather
+than joining TagItem to itself once per keyword. As with the acl index, the database stays the truth, so flushing
+redis (or the rebuild_tag_index command) only costs speed.
+
+Alongside, for the related tags shown next to a listing, we keep co-occurrence counts : for each keyword and each
+content type, a sorted set of the other keywords scored by how many refs of that type carry both (the keyword
+itself is scored with how many carry it at all). ALL is a pseudo-keyword every tagged ref has, so its sets count
+each keyword's use per type. These are also built from the database when first asked for, and then adjusted
+whenever a ref gains or loses a keyword. Only listed refs are counted, as the listings they're shown next to
+leave out the others (stubs, inactive members' profiles), so a ref being listed or unlisted adjusts them too.
+"""
+
+from django.conf import settings
+from django.db.models import Count
+from django.contrib.contenttypes.models import ContentType
+
+from apps.plus_lib.redis_lib import redis
+
+TAG_REFS_KEY = "tag_refs"
+RELATED_KEY = "tag_related"
+RELATED_BUILT_KEY = "tag_related_built"
+ALL = ""
+# always in a built set, so a keyword with no items is distinguishable from one we haven't indexed
+INDEXED = "-"
+
+
+def keyword_key(prefix, keyword) :
+    if isinstance(keyword, unicode) :
+        keyword = keyword.encode('utf-8')
+    return "%s:%s:%s" % (settings.DOMAIN_NAME, prefix, keyword)
+
+def refs_key(keyword) :
+    return keyword_key(TAG_REFS_KEY, keyword)
+
+
+def build(keyword) :
+    """ (re)index keyword from the database, returning its ref ids """
+    from apps.plus_tags.models import TagItem
+    ref_ids = set(TagItem.objects.filter(tag__keyword=keyword).values_list('ref', flat=True))
+    key = refs_key(keyword)
+    pipe = redis.pipeline()
+    pipe.delete(key)
+    pipe.sadd(key, INDEXED)
+    for ref_id in ref_ids :
+        pipe.sadd(key, ref_id)
+    pipe.execute()
+    return ref_ids
+
+def ensure_indexed(keywords) :
+    pipe = redis.pipeline()
+    for keyword in keywords :
+        pipe.exists(refs_key(keyword))
+    for keyword, exists in zip(keywords, pipe.execute()) :
+        if not exists :
+            build(keyword)
+
+
+def add_ref(keyword, ref) :
+    """ ref (a GenericReference) has been tagged with keyword. Only the first tag with a keyword changes anything,
+    ref may already have had another (eg. of a different tag_type). If keyword isn't indexed yet, leave it to be
+    built when it's needed """
+    from apps.plus_tags.models import TagItem
+    if TagItem.objects.filter(tag__keyword=keyword, ref=ref).count() != 1 :
+        return
+    key = refs_key(keyword)
+    if redis.exists(key) :
+        redis.sadd(key, ref.id)
+    adjust_related(keyword, ref, 1)
+
+def remove_ref(keyword, ref) :
+    """ a tag with keyword has been taken off ref, which may still have another """
+    from apps.plus_tags.models import TagItem
+    if TagItem.objects.filter(tag__keyword=keyword, ref=ref).count() :
+        return
+    key = refs_key(keyword)
+    if redis.exists(key) :
+        redis.srem(key, ref.id)
+    adjust_related(keyword, ref, -1)
+
+
+def related_key(model, keyword) :
+    return keyword_key('%s:%s' % (RELATED_KEY, model), keyword)
+
+def related_built_key() :
+    return "%s:%s" % (settings.DOMAIN_NAME, RELATED_BUILT_KEY)
+
+def build_related(keyword) :
+    """ count, from the database, the keywords on the refs tagged with keyword (or on all tagged refs, for ALL) """
+    from apps.plus_tags.models import TagItem
+    tag_items = TagItem.objects.filter(ref__listed=True)
+    if keyword != ALL :
+        tag_items = tag_items.filter(ref__in=TagItem.objects.filter(tag__keyword=keyword).values('ref'))
+    counts = tag_items.values('tag__keyword', 'ref__content_type').annotate(count=Count('ref', distinct=True))
+
+    pipe = redis.pipeline()
+    for row in counts :
+        model = ContentType.objects.get_for_id(row['ref__content_type']).model
+        pipe.zadd(related_key(model, keyword), row['tag__keyword'], row['count'])
+    pipe.sadd(related_built_key(), keyword)
+    pipe.execute()
+
+def adjust_related(keyword, ref, change) :
+    """ ref has gained (change 1) or lost (change -1) keyword. Adjust the counts of every built keyword that's affected """
+    from apps.plus_tags.models import Tag
+    if not ref.listed :
+        return
+    model = ContentType.objects.get_for_id(ref.content_type_id).model
+    others = [k for k in Tag.objects.filter(items=ref).values_list('keyword', flat=True).distinct() if k != keyword]
+
+    built = redis.smembers(related_built_key())
+    pipe = redis.pipeline()
+    touched = []
+    if ALL in built :
+        pipe.zincrby(related_key(model, ALL), keyword, change)
+        touched.append(related_key(model, ALL))
+    if keyword in built :
+        for other in others + [keyword] :
+            pipe.zincrby(related_key(model, keyword), other, change)
+        touched.append(related_key(model, keyword))
+    for other in others :
+        if other in built :
+            pipe.zincrby(related_key(model, other), keyword, change)
+            touched.append(related_key(model, other))
+    for key in touched :
+        pipe.zremrangebyscore(key, '-inf', 0)
+    pipe.execute()
+
+def listed_changed(ref) :
+    """ ref has been listed or unlisted : all its keywords start or stop counting """
+    from apps.plus_tags.models import Tag
+    change = ref.listed and 1 or -1
+    model = ContentType.objects.get_for_id(ref.content_type_id).model
+    keywords = list(set(Tag.objects.filter(items=ref).values_list('keyword', flat=True)))
+    if not keywords :
+        return
+
+    built = redis.smembers(related_built_key())
+    pipe = redis.pipeline()
+    touched = []
+    if ALL in built :
+        for keyword in keywords :
+            pipe.zincrby(related_key(model, ALL), keyword, change)
+        touched.append(related_key(model, ALL))
+    for keyword in keywords :
+        if keyword in built :
+            for other in keywords :
+                pipe.zincrby(related_key(model, keyword), other, change)
+            touched.append(related_key(model, keyword))
+    for key in touched :
+        pipe.zremrangebyscore(key, '-inf', 0)
+    pipe.execute()
+
+def related(keyword, models, n) :
+    """ [(keyword, count)] of the n keywords most often found on refs of the models (eg. 'profile', 'resource')
+    along with keyword, (or the n most used keywords, for ALL), biggest count first. Includes keyword itself """
+    if not redis.sismember(related_built_key(), keyword) :
+        build_related(keyword)
+    keys = [related_key(model, keyword) for model in models]
+    if len(keys) == 1 :
+        return redis.zrevrange(keys[0], 0, n - 1, withscores=True)
+    counts = {}
+    for key in keys :
+        for other, count in redis.zrevrange(key, 0, -1, withscores=True) :
+            counts[other] = counts.get(other, 0) + count
+    counts = sorted(counts.items(), key=lambda x: -x[1])
+    return counts[:n]
+
+
+def intersection(keywords) :
+    """ the ids of the GenericReferences tagged with all of keywords """
+    keywords = list(set(keywords))
+    if not keywords :
+        return set()
+    ensure_indexed(keywords)
+
+    pipe = redis.pipeline()
+    for keyword in keywords :
+        pipe.scard(refs_key(keyword))
+    by_size = sorted(zip(pipe.execute(), keywords))
+
+    ref_ids = None
+    for size, keyword in by_size :
+        members = redis.smembers(refs_key(keyword))
+        members.discard(INDEXED)
+        if ref_ids is None :
+            ref_ids = members
+        else :
+            ref_ids = ref_ids.intersection(members)
+        if not ref_ids :
+            break
+    return set([int(ref_id) for ref_id in ref_ids])
+
+
+def rebuild_index() :
+    """ throw away the whole index and rebuild it from the Tags, returning how many keywords were indexed.
+    The co-occurrence counts are just thrown away, to be built again as they're needed """
+    from apps.plus_tags.models import Tag
+    for key in redis.keys(keyword_key(TAG_REFS_KEY, '*')) + redis.keys(keyword_key(RELATED_KEY + ':*', '*')) :
+        redis.delete(key)
+    redis.delete(related_built_key())
+    count = 0
+    for keyword in Tag.objects.values_list('keyword', flat=True).distinct() :
+        build(keyword)
+        count = count + 1
+    return count
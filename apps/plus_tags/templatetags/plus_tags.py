@@ -1,4 +1,5 @@
 from apps.plus_tags.models import  tag_add, tag_delete, get_tags, tag_autocomplete, tag_counts, keyword_sort, scale_tag_weights
+from apps.plus_tags import clouds
 
 from apps.plus_permissions.api import TemplateSecureWrapper
 
@@ -7,16 +8,14 @@ register = template.Library()
 
 
 @register.inclusion_tag('plus_tags/tag_cloud.html')
-def tag_cloud(n, size, search_types, tag_search_url='explore_filtered'):
+def tag_cloud(n, size, search_types, tag_search_url='explore_filtered', group=None):
+    """ the cloud comes ready made from redis, see clouds. With group, it's the cloud of the group's resources """
     if not search_types:
         search_types = None
-    tags = get_tags(tagged=search_types)
-    counts = tag_counts(n=n, tag_set=tags)
-    if counts :
-        tag_levels = scale_tag_weights(counts)
-        tag_levels.sort(keyword_sort)
-    else :
-        tag_levels = []
+    in_group = None
+    if group:
+        in_group = group.get_ref()
+    tag_levels = clouds.get_cloud(n, search_types=search_types, in_group=in_group)
     return {'tags':tag_levels, 'size':size, 'tag_search_url':tag_search_url}
 
 
@@ -40,3 +40,126 @@ class TestGenericTags(unittest.TestCase):
 
 
 
+
+class TestTagIndex(unittest.TestCase):
+    def test_intersection(self) :
+        from apps.plus_tags import tag_index
+        u = User(username='tagger', email_address='tagger@the-hub.net')
+        u.save()
+        others = []
+        for name in ['tagged1', 'tagged2'] :
+            other = User(username=name, email_address='%s@the-hub.net' % name)
+            other.save()
+            others.append(other)
+        a, b = [o.get_profile() for o in others]
+
+        tag_add(a, 'interest', 'python', u)
+        tag_add(a, 'interest', 'django', u)
+        tag_add(b, 'interest', 'python', u)
+        tag_index.rebuild_index()
+
+        def intersect(keywords) :
+            return set(get_resources_for_tag_intersection(keywords))
+        self.assertEquals(intersect(['python']), set([a.get_ref(), b.get_ref()]))
+        self.assertEquals(intersect(['python', 'django']), set([a.get_ref()]))
+
+        # kept up to date by tagging, and agrees with the database
+        tag_add(b, 'skill', 'django', u)
+        self.assertEquals(intersect(['python', 'django']), set([a.get_ref(), b.get_ref()]))
+        tag_delete(b, 'skill', 'django', u)
+        tag_delete(a, 'interest', 'django', u)
+        self.assertEquals(intersect(['python', 'django']), set())
+        self.assertEquals(tag_index.intersection(['python']),
+                          set(TagItem.objects.filter(tag__keyword='python').values_list('ref', flat=True)))
+
+    def test_related(self) :
+        from apps.plus_tags import tag_index
+        u = User(username='relater', email_address='relater@the-hub.net')
+        u.save()
+        profiles = []
+        for i in range(3) :
+            other = User(username='related%s' % i, email_address='related%s@the-hub.net' % i, active=1)
+            other.save()
+            profiles.append(other.get_profile())
+        a, b, c = profiles
+        tag_index.rebuild_index()
+
+        tag_add(a, 'interest', 'cooking', u)
+        tag_add(a, 'interest', 'baking', u)
+        tag_add(b, 'interest', 'cooking', u)
+        tag_add(b, 'skill', 'baking', u)
+        tag_add(b, 'interest', 'knitting', u)
+        # built from the database, then kept up to date
+        self.assertEquals(dict(tag_index.related('cooking', ['profile'], 10)), {'cooking':2, 'baking':2, 'knitting':1})
+        tag_add(c, 'interest', 'cooking', u)
+        tag_add(c, 'interest', 'knitting', u)
+        tag_delete(b, 'skill', 'baking', u)
+        self.assertEquals(dict(tag_index.related('cooking', ['profile'], 10)), {'cooking':3, 'baking':1, 'knitting':2})
+
+        # agrees with counting the items
+        items = get_resources_for_tag_intersection(['cooking']).filter(listed=True)
+        self.assertEquals(get_intersecting_tags(items, keywords=['cooking'], models=['profile']),
+                          get_intersecting_tags(items))
+
+        # an inactive member's profile isn't listed, so its tags stop counting
+        c.user.active = 0
+        c.user.save()
+        self.assertEquals(dict(tag_index.related('cooking', ['profile'], 10)), {'cooking':2, 'baking':1, 'knitting':1})
+        items = get_resources_for_tag_intersection(['cooking']).filter(listed=True)
+        # (baking and knitting tie, so compare regardless of order)
+        def counts(tags) :
+            return dict([(tag['keyword'], tag['count']) for tag in tags])
+        self.assertEquals(counts(get_intersecting_tags(items, keywords=['cooking'], models=['profile'])),
+                          {'baking':1, 'knitting':1})
+        self.assertEquals(counts(get_intersecting_tags(items)), {'baking':1, 'knitting':1})
+        c.user.active = 1
+        c.user.save()
+        self.assertEquals(dict(tag_index.related('cooking', ['profile'], 10)), {'cooking':3, 'baking':1, 'knitting':2})
+
+    def test_autocomplete(self) :
+        from apps.plus_tags import autocomplete
+        u = User(username='completer', email_address='completer@the-hub.net')
+        u.save()
+        profiles = []
+        for i in range(3) :
+            other = User(username='completed%s' % i, email_address='completed%s@the-hub.net' % i)
+            other.save()
+            profiles.append(other.get_profile())
+        autocomplete.rebuild_index()
+
+        for p in profiles :
+            tag_add(p, 'interest', 'open source', u)
+        tag_add(profiles[0], 'skill', 'opera', u)
+        def complete(value, **kwargs) :
+            return [op['keyword'] for op in tag_autocomplete(value, 10, **kwargs)]
+        self.assertEquals(complete('ope'), ['open source', 'opera'])
+        self.assertEquals(complete('sou'), ['open source'])
+        self.assertEquals(complete('ope', tag_type='skill'), ['opera'])
+
+        # kept up to date by tagging
+        for p in profiles :
+            tag_add(p, 'skill', 'opera', u)
+            tag_add(p, 'hobby', 'opera', u)
+        self.assertEquals(complete('ope'), ['opera', 'open source'])
+        for p in profiles :
+            tag_delete(p, 'interest', 'open source', u)
+        self.assertEquals(complete('ope'), ['opera'])
+        self.assertEquals(complete('ope', tagged_for=u), ['opera'])
+
+    def test_clouds(self) :
+        from apps.plus_tags import clouds
+        u = User(username='clouder', email_address='clouder@the-hub.net')
+        u.save()
+        p = u.get_profile()
+        tag_add(p, 'interest', 'cumulus', u)
+
+        cloud = clouds.get_cloud(1000)
+        self.assertTrue('cumulus' in [t['keyword'] for t in cloud])
+        self.assertEquals(cloud, clouds.compute('site', 1000))
+
+        # served from the cache until it's refreshed
+        tag_add(p, 'interest', 'nimbus', u)
+        self.assertFalse('nimbus' in [t['keyword'] for t in clouds.get_cloud(1000)])
+        self.assertTrue(clouds.refresh() >= 1)
+        self.assertTrue('nimbus' in [t['keyword'] for t in clouds.get_cloud(1000)])
+        self.assertEquals(clouds.refresh(), 0)
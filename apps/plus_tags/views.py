@@ -54,12 +54,16 @@ def autocomplete_tag(request, tag_type=None, tagged=None, tagged_for=None):
       3. all the user's enclosures, 
       4. all tags in the system ++ filter by the type of tags
 
-      for now its very basic and completes on the tag_type and the partial value, globally
+      for now it completes on the tag_type and the partial value, with tagged_for's own tags first and then globally
       """
     q = request.GET['q']
-    limit = request.GET['limit']
-    options = tag_autocomplete(q, limit, tagged_for, tagged, tag_type)
-    options = [op['keyword'] for op in options]
+    limit = int(request.GET['limit'])
+    options = []
+    if tagged_for:
+        options = [op['keyword'] for op in tag_autocomplete(q, limit, tagged_for, tagged, tag_type)]
+    if len(options) < limit:
+        options = options + [op['keyword'] for op in tag_autocomplete(q, limit, None, tagged, tag_type) if op['keyword'] not in options]
+    options = options[:limit]
     options = '\n'.join(options)
     return HttpResponse(options)
 
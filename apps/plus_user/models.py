@@ -51,6 +51,7 @@ def post_save(self) :
     # 
     ref.modified = datetime.datetime.now()
     ref.display_name = self.get_display_name()
+    ref.listed = bool(self.active)
     ref.save()
 
     
@@ -115,6 +115,7 @@ class Profile(Explorable):
       ref = self.get_ref()
       ref.modified = datetime.now()
       ref.display_name = self.get_display_name()
+      ref.listed = bool(self.user.active)
       ref.save()
 
    def change_avatar(self) :
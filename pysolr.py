@@ -135,13 +135,15 @@ except ImportError:
     # For Python >= 2.6
     import json
 
-try:
-    # Desirable from a timeout perspective.
-    from httplib2 import Http
-    TIMEOUTS_AVAILABLE = True
-except ImportError:
-    from httplib import HTTPConnection
-    TIMEOUTS_AVAILABLE = False
+import errno
+import httplib
+from httplib import HTTPConnection
+import socket
+import threading
+import time
+
+# Connections are pooled and kept alive, with the timeout set on each socket.
+TIMEOUTS_AVAILABLE = True
 
 try:
     set
@@ -149,7 +151,7 @@ except NameError:
     from sets import Set as set
 
 __author__ = 'Joseph Kocherhans, Jacob Kaplan-Moss, Daniel Lindsley'
-__all__ = ['Solr']
+__all__ = ['Solr', 'IndexingSession', 'set_field_types']
 __version__ = (2, 0, 10)
 
 def get_version():
@@ -160,6 +162,243 @@ DATETIME_REGEX = re.compile('^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})T(?
 class SolrError(Exception):
     pass
 
+
+def _to_bool(value):
+    if isinstance(value, basestring):
+        return value == 'true'
+    return bool(value)
+
+def _to_datetime(value):
+    possible_datetime = DATETIME_REGEX.search(value)
+    if not possible_datetime:
+        return value
+    date_values = possible_datetime.groupdict()
+    return datetime(int(date_values['year']), int(date_values['month']), int(date_values['day']),
+                    int(date_values['hour']), int(date_values['minute']), int(date_values['second']))
+
+def _to_date(value):
+    value = _to_datetime(value)
+    if isinstance(value, datetime):
+        return date(value.year, value.month, value.day)
+    return value
+
+def _unchanged(value):
+    return value
+
+# How to convert a value of each declared field type.
+CONVERTERS = {
+    'string': _unchanged,
+    'text': _unchanged,
+    'int': int,
+    'long': long,
+    'float': float,
+    'double': float,
+    'boolean': _to_bool,
+    'datetime': _to_datetime,
+    'date': _to_date,
+}
+
+# The types of the fields of every Solr instance which isn't given its own,
+# eg. {'title': 'string', 'pub_date': 'datetime'}. See set_field_types.
+FIELD_TYPES = {}
+
+def set_field_types(field_types):
+    """
+    Declares the types of fields (as in CONVERTERS), so their values are
+    converted by type rather than guessed at.
+    """
+    for name, field_type in field_types.items():
+        if field_type not in CONVERTERS:
+            raise ValueError("Unknown field type %r for %r." % (field_type, name))
+    FIELD_TYPES.update(field_types)
+
+
+class Document(dict):
+    """
+    A result document. Each value is converted to python the first time it's
+    looked at, by its declared type, or else by Solr._to_python.
+    """
+    def __init__(self, raw, field_types, to_python):
+        dict.__init__(self, raw)
+        self.field_types = field_types
+        self.to_python = to_python
+        self.converted = set()
+    
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if key not in self.converted:
+            value = self.convert(key, value)
+            dict.__setitem__(self, key, value)
+            self.converted.add(key)
+        return value
+    
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.converted.add(key)
+    
+    def convert(self, key, value):
+        field_type = self.field_types.get(key)
+        if field_type is None:
+            return self.to_python(value)
+        converter = CONVERTERS[field_type]
+        if value is None:
+            return None
+        if isinstance(value, list):
+            return [converter(v) for v in value]
+        return converter(value)
+    
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+    
+    def items(self):
+        return [(key, self[key]) for key in self]
+    
+    def iteritems(self):
+        for key in self:
+            yield key, self[key]
+    
+    def values(self):
+        return [self[key] for key in self]
+    
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of persistent connections to one Solr server.
+    
+    Connections are handed out one per request and put back once its response
+    has been read, so a connection is only ever used by one thread at a time.
+    Connections left idle for longer than ``max_idle`` seconds are closed
+    rather than reused, since the server has probably dropped them.
+    """
+    def __init__(self, host, port, timeout, maxsize=10, max_idle=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = []
+    
+    def get(self):
+        """
+        Returns ``(connection, reused)``, where reused is True if the
+        connection has been used before (and so may have been dropped).
+        """
+        self.lock.acquire()
+        try:
+            while self.idle:
+                conn, last_used = self.idle.pop()
+                if time.time() - last_used < self.max_idle:
+                    return conn, True
+                conn.close()
+        finally:
+            self.lock.release()
+        return HTTPConnection(self.host, self.port, timeout=self.timeout), False
+    
+    def put(self, conn):
+        self.lock.acquire()
+        try:
+            if len(self.idle) < self.maxsize:
+                self.idle.append((conn, time.time()))
+                return
+        finally:
+            self.lock.release()
+        conn.close()
+    
+    def clear(self):
+        self.lock.acquire()
+        try:
+            idle, self.idle = self.idle, []
+        finally:
+            self.lock.release()
+        for conn, last_used in idle:
+            conn.close()
+
+
+# Solr instances are cheap and often short lived (eg. one per query), so the
+# pools are shared by every instance talking to the same server.
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(host, port, timeout):
+    key = (host, port, timeout)
+    _pools_lock.acquire()
+    try:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(host, port, timeout)
+        return _pools[key]
+    finally:
+        _pools_lock.release()
+
+
+class LatencyStats(object):
+    """
+    Request counts and timings per endpoint (select, update, mlt...), for
+    every Solr instance in the process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        self.endpoints = {}
+    
+    def record(self, endpoint, seconds, failed=False):
+        self.lock.acquire()
+        try:
+            stats = self.endpoints.setdefault(endpoint, {'requests': 0, 'failures': 0, 'total': 0.0, 'max': 0.0})
+            stats['requests'] += 1
+            if failed:
+                stats['failures'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+        finally:
+            self.lock.release()
+    
+    def summary(self):
+        """
+        Returns a dictionary of endpoint to its requests, failures and total,
+        average and maximum time in seconds.
+        """
+        self.lock.acquire()
+        try:
+            summary = {}
+            for endpoint, stats in self.endpoints.items():
+                summary[endpoint] = dict(stats, average=stats['total'] / stats['requests'])
+            return summary
+        finally:
+            self.lock.release()
+
+latency = LatencyStats()
+
+
+def is_dropped_connection(error):
+    """
+    True if ``error`` is what sending on a keep-alive connection the server
+    has already closed looks like: a reset or broken pipe, or an empty status
+    line. Not a timeout, which means the server is there but slow.
+    """
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, socket.error):
+        return bool(error.args) and error.args[0] in (errno.ECONNRESET, errno.EPIPE)
+    return False
+
+
+def endpoint_of(path):
+    """
+    The handler a request path is for, eg. 'select' for /solr/select/?q=...
+    """
+    return path.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+
 class Results(object):
     def __init__(self, docs, hits, highlighting={}, facets={}, spellcheck={}):
         self.docs = docs
@@ -175,8 +414,11 @@ class Results(object):
         return iter(self.docs)
 
 class Solr(object):
-    def __init__(self, url, decoder=None, timeout=60):
+    def __init__(self, url, decoder=None, timeout=60, field_types=None):
         self.decoder = decoder or json.JSONDecoder()
+        if field_types is None:
+            field_types = FIELD_TYPES
+        self.field_types = field_types
         self.url = url
         self.scheme, netloc, path, query, fragment = urlsplit(url)
         netloc = netloc.split(':')
@@ -189,27 +431,44 @@ class Solr(object):
         self.timeout = timeout
     
     def _send_request(self, method, path, body=None, headers=None):
-        if TIMEOUTS_AVAILABLE:
-            url = self.url.replace(self.path, '')
-            http = Http(timeout=self.timeout)
-            headers, response = http.request(url + path, method=method, body=body, headers=headers)
-            
-            if int(headers['status']) != 200:
-                raise SolrError(self._extract_error(headers, response))
-            
-            return response
+        """
+        Sends the request on a pooled keep-alive connection. A GET which finds
+        that a reused connection has been dropped by the server is retried on
+        another. Other failures, and other requests, are not retried, since
+        they may already have been acted on.
+        """
+        if headers is None:
+            headers = {}
+        
+        pool = get_pool(self.host, self.port, self.timeout)
+        endpoint = endpoint_of(path)
+        start = time.time()
+        
+        while True:
+            conn, reused = pool.get()
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                content = response.read()
+            except (socket.error, httplib.HTTPException), e:
+                conn.close()
+                if reused and method == 'GET' and is_dropped_connection(e):
+                    continue
+                latency.record(endpoint, time.time() - start, failed=True)
+                raise
+            break
+        
+        if response.will_close:
+            conn.close()
         else:
-            if headers is None:
-                headers = {}
-            
-            conn = HTTPConnection(self.host, self.port)
-            conn.request(method, path, body, headers)
-            response = conn.getresponse()
-            
-            if response.status != 200:
-                raise SolrError(self._extract_error(dict(response.getheaders()), response.read()))
-            
-            return response.read()
+            pool.put(conn)
+        
+        latency.record(endpoint, time.time() - start, failed=response.status != 200)
+        
+        if response.status != 200:
+            raise SolrError(self._extract_error(dict(response.getheaders(), reason=response.reason), content))
+        
+        return content
 
     def _select(self, params):
         # encode the query as utf-8 so urlencode can handle it
@@ -225,7 +484,7 @@ class Solr(object):
         path = '%s/mlt/?%s' % (self.path, urlencode(params, True))
         return self._send_request('GET', path)
 
-    def _update(self, message, clean_ctrl_chars=True):
+    def _update(self, message, clean_ctrl_chars=True, commit=False):
         """
         Posts the given xml message to http://<host>:<port>/solr/update and
         returns the result.
@@ -234,8 +493,13 @@ class Solr(object):
         of control characters (default True). This is done by default because
         these characters would cause Solr to fail to parse the XML. Only pass
         False if you're positive your data is clean.
+        
+        Passing `commit` as True asks Solr to commit once the message has been
+        handled, in the same request.
         """
         path = '%s/update/' % self.path
+        if commit:
+            path = path + '?commit=true'
         
         # Clean the message of ctrl characters.
         if clean_ctrl_chars:
@@ -274,45 +538,30 @@ class Solr(object):
     
     def _to_python(self, value):
         """
-        Converts values from Solr to native Python values.
+        Converts values from Solr to native Python values, for fields with no
+        declared type. Numbers and booleans have already been decoded from the
+        json, so only strings which look like booleans or dates are converted.
         """
-        if isinstance(value, (int, float, long, complex)):
-            return value
-        
         if isinstance(value, (list, tuple)):
             value = value[0]
         
+        if not isinstance(value, basestring):
+            return value
+        
         if value == 'true':
             return True
         elif value == 'false':
             return False
         
-        if isinstance(value, basestring):
-            possible_datetime = DATETIME_REGEX.search(value)
-        
-            if possible_datetime:
-                date_values = possible_datetime.groupdict()
-            
-                for dk, dv in date_values.items():
-                    date_values[dk] = int(dv)
-            
-                return datetime(date_values['year'], date_values['month'], date_values['day'], date_values['hour'], date_values['minute'], date_values['second'])
-        
-        try:
-            # This is slightly gross but it's hard to tell otherwise what the
-            # string's original type might have been. Be careful who you trust.
-            converted_value = eval(value)
-            
-            # Try to handle most built-in types.
-            if isinstance(converted_value, (list, tuple, set, dict, int, float, long, complex)):
-                return converted_value
-        except:
-            # If it fails (SyntaxError or its ilk) or we don't trust it,
-            # continue on.
-            pass
+        # Only try the regex on strings the right shape to be a date.
+        if len(value) >= 20 and value[4:5] == '-' and value[-1] == 'Z':
+            return _to_datetime(value)
         
         return value
 
+    def _documents(self, docs):
+        return [Document(doc, self.field_types, self._to_python) for doc in docs]
+
     # API Methods ############################################################
 
     def search(self, q, **kwargs):
@@ -334,8 +583,45 @@ class Solr(object):
         if result.get('spellcheck'):
             result_kwargs['spellcheck'] = result['spellcheck']
         
-        return Results(result['response']['docs'], result['response']['numFound'], **result_kwargs)
+        return Results(self._documents(result['response']['docs']), result['response']['numFound'], **result_kwargs)
     
+    def iter_search(self, q, rows=500, key='id', **kwargs):
+        """
+        Performs a search and yields every result, fetching them ``rows`` at a
+        time, so only one page is ever held in memory.
+        
+        Rather than asking for ever larger offsets (which Solr has to count
+        through every time), the results are sorted by ``key``, which must be
+        unique (eg. the uniqueKey), and each page asks for those after the
+        last key of the one before. So the results come in key order, not
+        relevance order, and the hundredth page is as cheap as the first.
+        """
+        fq = kwargs.pop('fq', [])
+        if isinstance(fq, basestring):
+            fq = [fq]
+        if 'fl' in kwargs and key not in kwargs['fl'].split(','):
+            kwargs['fl'] = kwargs['fl'] + ',' + key
+        kwargs.pop('start', None)
+        
+        last = None
+        while True:
+            page_fq = list(fq)
+            if last is not None:
+                page_fq.append((u'%s:{%s TO *}' % (key, self._quote(last))).encode('utf-8'))
+            results = self.search(q, sort='%s asc' % key, rows=rows, fq=page_fq, **kwargs)
+            
+            for doc in results:
+                yield doc
+            
+            if len(results) < rows:
+                break
+            last = results.docs[-1][key]
+
+    def _quote(self, value):
+        """Quotes a value for use in a query."""
+        value = self._from_python(value)
+        return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
     def more_like_this(self, q, mltfl, **kwargs):
         """
         Finds and returns results similar to the provided query.
@@ -357,35 +643,40 @@ class Solr(object):
                 'numFound': 0,
             }
         
-        return Results(result['response']['docs'], result['response']['numFound'])
+        return Results(self._documents(result['response']['docs']), result['response']['numFound'])
+
+    def _build_doc(self, doc):
+        d = ET.Element('doc')
+        for key, value in doc.items():
+            # handle lists, tuples, and other iterabes
+            if hasattr(value, '__iter__'):
+                for v in value:
+                    f = ET.Element('field', name=key)
+                    f.text = self._from_python(v)
+                    d.append(f)
+            # handle strings and unicode
+            else:
+                f = ET.Element('field', name=key)
+                f.text = self._from_python(value)
+                d.append(f)
+        return d
 
-    def add(self, docs, commit=True):
+    def add(self, docs, commit=True, commitWithin=None):
         """Adds or updates documents. For now, docs is a list of dictionaies
         where each key is the field name and each value is the value to index.
+        
+        With commitWithin (in milliseconds) Solr commits by itself within that
+        time, rather than at once.
         """
-        message = ET.Element('add')
+        # The docs are serialised one at a time, rather than as one big tree.
+        if commitWithin:
+            parts = ['<add commitWithin="%d">' % commitWithin]
+        else:
+            parts = ['<add>']
         for doc in docs:
-            d = ET.Element('doc')
-            for key, value in doc.items():
-                # handle lists, tuples, and other iterabes
-                if hasattr(value, '__iter__'):
-                    for v in value:
-                        f = ET.Element('field', name=key)
-                        f.text = self._from_python(v)
-                        d.append(f)
-                # handle strings and unicode
-                else:
-                    f = ET.Element('field', name=key)
-                    f.text = self._from_python(value)
-                    d.append(f)
-            message.append(d)
-        m = ET.tostring(message)
-        response = self._update(m)
-        # TODO: Supposedly, we can put a <commit /> element in the same post body
-        # as the add element. That isn't working for some reason, and it would save us
-        # an extra trip to the server. This works for now.
-        if commit:
-            self.commit()
+            parts.append(ET.tostring(self._build_doc(doc)))
+        parts.append('</add>')
+        response = self._update(''.join(parts), commit=commit and not commitWithin)
 
     def delete(self, id=None, q=None, commit=True, fromPending=True, fromCommitted=True):
         """Deletes documents."""
@@ -397,12 +688,20 @@ class Solr(object):
             m = '<delete><id>%s</id></delete>' % id
         elif q is not None:
             m = '<delete><query>%s</query></delete>' % q
-        response = self._update(m)
-        # TODO: Supposedly, we can put a <commit /> element in the same post body
-        # as the delete element. That isn't working for some reason, and it would save us
-        # an extra trip to the server. This works for now.
-        if commit:
-            self.commit()
+        response = self._update(m, commit=commit)
+
+    def delete_ids(self, ids, commit=True):
+        """Deletes several documents by id, in one request."""
+        message = ET.Element('delete')
+        for id in ids:
+            i = ET.Element('id')
+            i.text = self._from_python(id)
+            message.append(i)
+        response = self._update(ET.tostring(message), commit=commit)
+
+    def session(self, **kwargs):
+        """Returns an IndexingSession on this connection."""
+        return IndexingSession(self, **kwargs)
 
     def commit(self):
         response = self._update('<commit />')
@@ -411,6 +710,96 @@ class Solr(object):
         response = self._update('<optimize />')
 
 
+class IndexingSession(object):
+    """
+    Buffers adds and deletes, and sends them in batches without committing
+    each one.
+    
+    The buffered documents are sent as a single ``<add>`` once there are
+    ``batch_size`` of them, or the oldest has been waiting ``max_wait``
+    seconds (checked as more are added). If ``commit_within`` (milliseconds)
+    is given each batch asks Solr to commit within that time, otherwise
+    nothing is committed until ``close``, which sends what's left and commits
+    once.
+    
+    A document added and then deleted by id (or the other way round) within
+    one batch is only sent as the last of the two.
+    
+    For example::
+    
+        session = conn.session(batch_size=1000)
+        for doc in docs:
+            session.add([doc])
+        session.close()
+        print session.docs_per_second()
+    """
+    def __init__(self, solr, batch_size=500, max_wait=10, commit_within=None):
+        self.solr = solr
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.commit_within = commit_within
+        self.docs = []
+        self.deletes = set()
+        self.oldest = None
+        self.started = time.time()
+        self.finished = None
+        self.added = 0
+        self.deleted = 0
+        self.batches = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Only commit if the block finished normally.
+        if exc_type is None:
+            self.close()
+    
+    def _buffered(self):
+        if self.oldest is None:
+            self.oldest = time.time()
+        if len(self.docs) + len(self.deletes) >= self.batch_size or time.time() - self.oldest >= self.max_wait:
+            self.flush()
+    
+    def add(self, docs):
+        for doc in docs:
+            self.deletes.discard(doc.get('id'))
+        self.docs.extend(docs)
+        self._buffered()
+    
+    def delete(self, id):
+        self.docs = [doc for doc in self.docs if doc.get('id') != id]
+        self.deletes.add(id)
+        self._buffered()
+    
+    def flush(self):
+        """Sends whatever is buffered, without committing."""
+        if self.deletes:
+            self.solr.delete_ids(self.deletes, commit=False)
+            self.deleted += len(self.deletes)
+            self.deletes = set()
+            self.batches += 1
+        if self.docs:
+            self.solr.add(self.docs, commit=False, commitWithin=self.commit_within)
+            self.added += len(self.docs)
+            self.docs = []
+            self.batches += 1
+        self.oldest = None
+    
+    def close(self):
+        """Sends whatever is buffered and, unless Solr has been left to do it, commits."""
+        self.flush()
+        if not self.commit_within:
+            self.solr.commit()
+        self.finished = time.time()
+    
+    def docs_per_second(self):
+        elapsed = (self.finished or time.time()) - self.started
+        if not elapsed:
+            return 0.0
+        return (self.added + self.deleted) / elapsed
+
+
 # Using two-tuples to preserve order.
 REPLACEMENTS = (
     # Nuke nasty control characters.
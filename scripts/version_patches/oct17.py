@@ -0,0 +1,53 @@
+import psycopg2
+import local_settings as db_config
+
+def patch_db(patch):
+    con = getPostgreSQLConnection()
+    cur = con.cursor()
+    try:
+        cur.execute(patch)
+        con.commit()
+    except Exception, e:
+        print `e`
+
+
+def getPostgreSQLConnection():
+
+    user = db_config.DATABASE_USER
+    password = db_config.DATABASE_PASSWORD
+    host = db_config.DATABASE_HOST and db_config.DATABASE_HOST or 'localhost'
+    dbname = db_config.DATABASE_NAME
+    con = psycopg2.connect("host=%(host)s user=%(user)s password=%(password)s dbname=%(dbname)s" %{'host':host,
+                                                                                                   'user':user,
+                                                                                                   'password':password,
+                                                                                                   'dbname':dbname})
+    return con
+
+
+# the MembershipClosure table, which is_member_of, get_enclosure_set etc. now read from
+
+def various_db() :
+    patch_db('''create table plus_groups_membershipclosure (
+                    id serial not null primary key,
+                    group_id integer not null references tg_group (id) deferrable initially deferred,
+                    member_type_id integer not null references django_content_type (id) deferrable initially deferred,
+                    member_id integer not null check (member_id >= 0),
+                    paths integer not null check (paths >= 0),
+                    direct boolean not null,
+                    unique (group_id, member_type_id, member_id));''')
+    patch_db('create index plus_groups_membershipclosure_group_id on plus_groups_membershipclosure (group_id);')
+    patch_db('create index plus_groups_membershipclosure_member_type_id on plus_groups_membershipclosure (member_type_id);')
+    patch_db('create index plus_groups_membershipclosure_member on plus_groups_membershipclosure (member_type_id, member_id);')
+
+
+def fill_closure() :
+    """ the same as manage.py rebuild_membership_closure """
+    from apps.plus_groups.closure import rebuild_closure
+    from apps.plus_lib.redis_lib import flush_membership_cache
+    rebuild_closure()
+    flush_membership_cache()
+
+
+if __name__ == "__main__":
+    various_db()
+    fill_closure()
@@ -0,0 +1,64 @@
+import psycopg2
+import local_settings as db_config
+
+def patch_db(patch):
+    con = getPostgreSQLConnection()
+    cur = con.cursor()
+    try:
+        cur.execute(patch)
+        con.commit()
+    except Exception, e:
+        print `e`
+
+
+def getPostgreSQLConnection():
+
+    user = db_config.DATABASE_USER
+    password = db_config.DATABASE_PASSWORD
+    host = db_config.DATABASE_HOST and db_config.DATABASE_HOST or 'localhost'
+    dbname = db_config.DATABASE_NAME
+    con = psycopg2.connect("host=%(host)s user=%(user)s password=%(password)s dbname=%(dbname)s" %{'host':host,
+                                                                                                   'user':user,
+                                                                                                   'password':password,
+                                                                                                   'dbname':dbname})
+    return con
+
+
+# GenericReference.listed and .owner, which plus_search filters on
+
+def various_db() :
+    patch_db('alter table plus_permissions_genericreference add listed boolean not null default true;')
+    patch_db('alter table plus_permissions_genericreference add owner_id integer null references plus_permissions_genericreference (id) deferrable initially deferred;')
+    patch_db('create index plus_permissions_genericreference_listed on plus_permissions_genericreference (listed);')
+    patch_db('create index plus_permissions_genericreference_owner_id on plus_permissions_genericreference (owner_id);')
+
+
+def set_listed() :
+    """ from now on the saves keep these up to date, this sets them for what's already there """
+    from django.contrib.contenttypes.models import ContentType
+    from apps.plus_permissions.models import GenericReference
+    from apps.plus_explore.views import object_type_filters
+
+    for cls, included_filter in object_type_filters.items() :
+        refs = GenericReference.objects.filter(content_type=ContentType.objects.get_for_model(cls))
+        refs.update(listed=False)
+        refs.filter(object_id__in=cls.objects.filter(**included_filter).values('id')).update(listed=True)
+
+    from apps.plus_wiki.models import WikiPage
+    from apps.plus_resources.models import Resource
+    for cls in [WikiPage, Resource] :
+        content_type = ContentType.objects.get_for_model(cls)
+        for obj_id, in_agent_id in cls.objects.values_list('id', 'in_agent') :
+            GenericReference.objects.filter(content_type=content_type, object_id=obj_id).update(owner=in_agent_id)
+
+
+def rebuild_related_tags() :
+    """ the related tag counts only count listed refs, and set_listed went round the saves which adjust them """
+    from apps.plus_tags import tag_index
+    tag_index.rebuild_index()
+
+
+if __name__ == "__main__":
+    various_db()
+    set_listed()
+    rebuild_related_tags()
@@ -82,6 +82,10 @@ MIDDLEWARE_CLASSES = (
 
     'apps.django403.middleware.Django403Middleware',
     'apps.plus_user.middleware.AnonUserMiddleware',
+    'apps.plus_permissions.middleware.AccessCacheMiddleware',
+    'apps.plus_feed.middleware.FeedDeliveryMiddleware',
+    'apps.plus_permissions.middleware.SearchQueueMiddleware',
+    'apps.plus_lib.middleware.AfterCommitMiddleware',
     'django_openid.consumer.SessionConsumer',
     'account.middleware.LocaleMiddleware',
     'django.middleware.doc.XViewMiddleware',
@@ -196,6 +200,15 @@ HAYSTACK_SITECONF = 'search_sites'
 HAYSTACK_SEARCH_ENGINE = 'solr'
 HAYSTACK_SOLR_URL = 'http://127.0.0.1:8983/solr' # override in local_settings
 HAYSTACK_REAL_TIME = False # do we use RealTimeSearchIndex? over-ride in local settings if we want
+SEARCH_INDEX_QUEUE = True # queue changed refs for the search_worker management command to index
+SEARCH_INDEX_BATCH = 100 # how many queued refs the search_worker indexes per post / commit to solr
+SEARCH_RELEVANCE_LIMIT = 1000 # most results a search returns when ordered by relevance (other orders get them all)
+
+MEMBERSHIP_CACHE_RECOMPUTE = False # rebuild invalidated membership sets in a background thread after joins / leaves
+
+FEED_DELIVERY_QUEUE = True # deliver new feed items from the feed_worker management command rather than in the request
+FEED_LENGTH = 500 # longest a reader's redis feed is allowed to get
+FEED_REBUILD_PER_SOURCE = 100 # how many of each followed source's newest items a feed rebuild considers
 
 ABSOLUTE_URL_OVERRIDES = {
     "auth.user": lambda o: "/profiles/%s/" % o.username,
@@ -399,7 +412,9 @@ try:
     JS_FILES = ["jquery.min.js", "jq.noconflict.js", "ui.core.js", "effects.core.js", "effects.highlight.js", "jquery.bgiframe.min.js", "jquery.autocomplete.min.js", "tools.overlay-1.0.4.min.js", "json2.js", "yui2/build/yahoo-dom-event/yahoo-dom-event.js", "yui2/build/element/element-min.js", "yui2/build/container/container_core-min.js", "yui2/build/menu/menu-min.js", "yui2/build/button/button-min.js", "yui2/build/editor/editor-min.js", "yui2/build/animation/animation-min.js", "yui2/build/logger/logger-min.js", "yui2/build/dragdrop/dragdrop-min.js", "yui2/build/selector/selector-min.js", "yui2/build/tabview/tabview-min.js", "yui2/build/history/history-min.js", "yui2/build/datasource/datasource-min.js", "yui2/build/connection/connection-min.js", "yui2/build/autocomplete/autocomplete-min.js", "editor.js", "ui.accordion.js", "json2.js", "jquery.confirm.js", "jquery.confirm-1.1.js", "hubcms.js", "tab_hist.js", "hubplus.js", "yui2/build/slider/slider-min.js", "plus_resources/replace_file.js", "plus_permissions/views.js", "pinax_libs/comments.js", "plus_links/plus_links.js", "listings.js", "home.js", "plus_microblogging/plus_microblogging.js", "ready.js" ] # , "tinymce/jscripts/tiny_mce/tiny_mce.js"]
 
     import sys
-    if sys.argv[1] not in ['shell','execfile','evolve', 'flush_cache', 'fix_failed_syncing', 'reindex'] :
+    if sys.argv[1] not in ['shell','execfile','evolve', 'flush_cache', 'fix_failed_syncing', 'reindex',
+                           'search_worker', 'feed_worker', 'warm_feeds', 'acl_index', 'rebuild_membership_closure',
+                           'rebuild_tag_index', 'refresh_tag_clouds'] :
         # only recompile javascript if we're really running
         js_compiler = JsCompile(css=CSS_FILES, js=JS_FILES)
         js_compiler.startThread()
@@ -0,0 +1,347 @@
+""" Unit tests for the pysolr additions which don't need a running Solr.
+
+Run with python -m unittest tests.test_pysolr from the top directory.
+"""
+import errno
+import httplib
+import socket
+import threading
+import time
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import pysolr
+
+
+class FakeSolrHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        if 'slow' in self.path:
+            time.sleep(0.5)
+        body = '{"response": {"numFound": 0, "docs": []}}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if server.drop:
+            # close the connection without saying so, as a server timing out an idle connection does
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeSolr(HTTPServer):
+    def __init__(self, drop=False):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeSolrHandler)
+        self.drop = drop
+        self.requests = []
+        self.connections = 0
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        thread = threading.Thread(target=self.serve, args=(request, client_address))
+        thread.setDaemon(True)
+        thread.start()
+
+    def serve(self, request, client_address):
+        try:
+            HTTPServer.process_request(self, request, client_address)
+        except socket.error:
+            # the client has given up on us (see test_timeout_not_retried)
+            pass
+
+    def url(self):
+        return 'http://127.0.0.1:%s/solr' % self.server_address[1]
+
+
+class TestConnections(unittest.TestCase):
+    def setUp(self):
+        pysolr.latency.reset()
+
+    def tearDown(self):
+        for pool in pysolr._pools.values():
+            pool.clear()
+        pysolr._pools.clear()
+
+    def test_pool(self):
+        pool = pysolr.ConnectionPool('127.0.0.1', 1, 5, maxsize=1)
+        conn, reused = pool.get()
+        self.assertFalse(reused)
+        pool.put(conn)
+        self.assertEqual(pool.get(), (conn, True))
+
+        # no more than maxsize are kept
+        first, second = pool.get()[0], pool.get()[0]
+        pool.put(first)
+        pool.put(second)
+        self.assertEqual(len(pool.idle), 1)
+        pool.clear()
+        self.assertEqual(pool.idle, [])
+
+        # connections idle for too long aren't handed out again
+        pool = pysolr.ConnectionPool('127.0.0.1', 1, 5, max_idle=0)
+        pool.put(conn)
+        self.assertEqual(pool.get()[1], False)
+
+        # one pool per server
+        self.assert_(pysolr.get_pool('127.0.0.1', 1, 5) is pysolr.get_pool('127.0.0.1', 1, 5))
+        self.assert_(pysolr.get_pool('127.0.0.1', 1, 5) is not pysolr.get_pool('127.0.0.1', 2, 5))
+
+    def test_keep_alive(self):
+        server = FakeSolr()
+        conn = pysolr.Solr(server.url())
+        for i in range(3):
+            conn._send_request('GET', '/solr/select/?q=x')
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(server.connections, 1)
+
+    def test_dropped_connection_retried(self):
+        server = FakeSolr(drop=True)
+        conn = pysolr.Solr(server.url())
+        conn._send_request('GET', '/solr/select/?q=x')
+        # the pooled connection has been closed by the server, so this goes on a new one
+        conn._send_request('GET', '/solr/select/?q=y')
+        self.assertEqual(server.requests, ['/solr/select/?q=x', '/solr/select/?q=y'])
+        self.assertEqual(server.connections, 2)
+
+    def test_timeout_not_retried(self):
+        server = FakeSolr()
+        conn = pysolr.Solr(server.url(), timeout=0.1)
+        conn._send_request('GET', '/solr/select/?q=x')
+        self.assertRaises(socket.timeout, conn._send_request, 'GET', '/solr/select/?q=slow')
+        time.sleep(0.6)
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(pysolr.latency.summary()['select']['failures'], 1)
+
+    def test_is_dropped_connection(self):
+        self.assert_(pysolr.is_dropped_connection(httplib.BadStatusLine('')))
+        self.assert_(pysolr.is_dropped_connection(socket.error(errno.ECONNRESET, 'reset')))
+        self.assert_(pysolr.is_dropped_connection(socket.error(errno.EPIPE, 'broken pipe')))
+        self.failIf(pysolr.is_dropped_connection(socket.timeout('timed out')))
+        self.failIf(pysolr.is_dropped_connection(socket.error(errno.ECONNREFUSED, 'refused')))
+        self.failIf(pysolr.is_dropped_connection(httplib.IncompleteRead('')))
+
+
+class RecordingSolr(pysolr.Solr):
+    """ sends nothing, just remembers the requests and answers each select with the next of responses """
+    def __init__(self, responses=None, **kwargs):
+        pysolr.Solr.__init__(self, 'http://127.0.0.1:8983/solr', **kwargs)
+        self.requests = []
+        self.responses = list(responses or [])
+
+    def _send_request(self, method, path, body=None, headers=None):
+        self.requests.append((method, path, body))
+        if self.responses:
+            return self.responses.pop(0)
+        return '<response />'
+
+
+class TestUpdates(unittest.TestCase):
+    def test_add(self):
+        conn = RecordingSolr()
+        conn.add([{'id': 'a', 'name': 'A'}])
+        method, path, body = conn.requests[-1]
+        self.assertEqual((method, path), ('POST', '/solr/update/?commit=true'))
+        self.assert_(body.startswith('<add><doc>'))
+
+        conn.add([{'id': 'a'}], commit=False)
+        self.assertEqual(conn.requests[-1][1], '/solr/update/')
+
+        # with commitWithin solr commits by itself, so there's no commit
+        conn.add([{'id': 'a'}], commitWithin=5000)
+        method, path, body = conn.requests[-1]
+        self.assertEqual(path, '/solr/update/')
+        self.assert_(body.startswith('<add commitWithin="5000"><doc>'))
+
+    def test_delete_ids(self):
+        conn = RecordingSolr()
+        conn.delete_ids(['a', 'b'], commit=False)
+        self.assertEqual(conn.requests, [('POST', '/solr/update/', '<delete><id>a</id><id>b</id></delete>')])
+        conn.delete_ids(['c'])
+        self.assertEqual(conn.requests[-1][1], '/solr/update/?commit=true')
+
+
+class TestIndexingSession(unittest.TestCase):
+    def bodies(self, conn):
+        return [body for method, path, body in conn.requests]
+
+    def test_batches(self):
+        conn = RecordingSolr()
+        session = conn.session(batch_size=3)
+        session.add([{'id': 'a'}, {'id': 'b'}])
+        self.assertEqual(conn.requests, [])
+        session.delete('c')
+        # a batch, sent without committing
+        self.assertEqual(self.bodies(conn), ['<delete><id>c</id></delete>',
+                                             '<add><doc><field name="id">a</field></doc><doc><field name="id">b</field></doc></add>'])
+        self.assertEqual([path for method, path, body in conn.requests], ['/solr/update/', '/solr/update/'])
+
+        session.add([{'id': 'd'}])
+        session.close()
+        self.assertEqual(self.bodies(conn)[2:], ['<add><doc><field name="id">d</field></doc></add>', '<commit />'])
+        self.assertEqual((session.added, session.deleted, session.batches), (3, 1, 3))
+        self.assert_(session.docs_per_second() > 0)
+
+    def test_add_then_delete(self):
+        conn = RecordingSolr()
+        session = conn.session()
+        session.add([{'id': 'a'}])
+        session.delete('a')
+        session.delete('b')
+        session.add([{'id': 'b'}])
+        session.close()
+        # only the last of each
+        self.assertEqual(self.bodies(conn), ['<delete><id>a</id></delete>',
+                                             '<add><doc><field name="id">b</field></doc></add>',
+                                             '<commit />'])
+
+    def test_max_wait(self):
+        conn = RecordingSolr()
+        session = conn.session(max_wait=0)
+        session.add([{'id': 'a'}])
+        self.assertEqual(len(conn.requests), 1)
+
+    def test_commit_within(self):
+        conn = RecordingSolr()
+        session = conn.session(commit_within=1000)
+        session.add([{'id': 'a'}])
+        session.close()
+        self.assertEqual(self.bodies(conn), ['<add commitWithin="1000"><doc><field name="id">a</field></doc></add>'])
+
+    def test_with(self):
+        conn = RecordingSolr()
+        session = conn.session()
+        session.__enter__()
+        session.add([{'id': 'a'}])
+        session.__exit__(None, None, None)
+        self.assertEqual(self.bodies(conn)[-1], '<commit />')
+
+        # a failure leaves the batch unsent and nothing committed
+        conn = RecordingSolr()
+        session = conn.session()
+        session.__enter__()
+        session.add([{'id': 'a'}])
+        session.__exit__(ValueError, ValueError(), None)
+        self.assertEqual(conn.requests, [])
+
+
+class TestDocuments(unittest.TestCase):
+    field_types = {'title': 'string', 'year': 'string', 'answer': 'string', 'count': 'int', 'sizes': 'int',
+                   'pub_date': 'datetime', 'day': 'date', 'flag': 'boolean'}
+
+    def search(self, doc, field_types=None):
+        response = pysolr.json.dumps({'response': {'numFound': 1, 'docs': [doc]}})
+        conn = RecordingSolr([response], field_types=field_types or self.field_types)
+        return conn.search('*:*').docs[0]
+
+    def test_declared(self):
+        doc = self.search({'title': 'A title', 'year': '1984', 'answer': 'true', 'count': '3', 'sizes': ['1', '2'],
+                           'pub_date': '2010-02-03T10:11:12Z', 'day': '2010-02-03T00:00:00Z', 'flag': 'false'})
+        # strings stay strings, however much they look like something else
+        self.assertEqual(doc['year'], '1984')
+        self.assertEqual(doc['answer'], 'true')
+        self.assertEqual(doc['count'], 3)
+        self.assertEqual(doc['sizes'], [1, 2])
+        self.assertEqual(doc['pub_date'], pysolr.datetime(2010, 2, 3, 10, 11, 12))
+        self.assertEqual(doc['day'], pysolr.date(2010, 2, 3))
+        self.assertEqual(doc['flag'], False)
+        self.assertEqual(doc.get('missing', 'default'), 'default')
+        self.assertEqual(dict(doc.items())['count'], 3)
+
+    def test_undeclared(self):
+        doc = self.search({'year': '1984', 'answer': 'true', 'count': 3, 'when': '2010-02-03T10:11:12Z',
+                           'code': "__import__('os').getcwd()"}, field_types={'unused': 'string'})
+        # nothing is eval'd
+        self.assertEqual(doc['year'], '1984')
+        self.assertEqual(doc['code'], "__import__('os').getcwd()")
+        self.assertEqual(doc['count'], 3)
+        self.assertEqual(doc['answer'], True)
+        self.assertEqual(doc['when'], pysolr.datetime(2010, 2, 3, 10, 11, 12))
+
+    def test_converted_once(self):
+        doc = pysolr.Document({'count': '3'}, {'count': 'int'}, None)
+        self.assertEqual(doc['count'], 3)
+        self.assertEqual(doc['count'], 3)
+        doc['count'] = '4'
+        self.assertEqual(doc['count'], '4')
+
+    def test_set_field_types(self):
+        saved = dict(pysolr.FIELD_TYPES)
+        try:
+            pysolr.set_field_types({'year': 'string'})
+            self.assertEqual(RecordingSolr().field_types['year'], 'string')
+            self.assertRaises(ValueError, pysolr.set_field_types, {'year': 'roman'})
+        finally:
+            pysolr.FIELD_TYPES.clear()
+            pysolr.FIELD_TYPES.update(saved)
+
+
+class PagingSolr(pysolr.Solr):
+    """ answers each select with the next page of docs, remembering what was asked for """
+    def __init__(self, pages):
+        pysolr.Solr.__init__(self, 'http://127.0.0.1:8983/solr')
+        self.pages = list(pages)
+        self.selects = []
+
+    def _select(self, params):
+        self.selects.append(dict(params))
+        docs = self.pages.pop(0)
+        return pysolr.json.dumps({'response': {'numFound': len(docs), 'docs': docs}})
+
+
+class TestIterSearch(unittest.TestCase):
+    def test_paging(self):
+        conn = PagingSolr([[{'id': 'a'}, {'id': 'b'}], [{'id': 'c'}, {'id': u'd"\u00e9'}], [{'id': 'e'}]])
+        ids = [doc['id'] for doc in conn.iter_search('text:x', rows=2, fq='type:page', fl='name')]
+        self.assertEqual(ids, ['a', 'b', 'c', u'd"\u00e9', 'e'])
+
+        self.assertEqual(len(conn.selects), 3)
+        for params in conn.selects:
+            self.assertEqual((params['q'], params['sort'], params['rows'], params['fl']), ('text:x', 'id asc', 2, 'name,id'))
+        # each page after the last key of the one before, quoted, as utf-8
+        self.assertEqual(conn.selects[0]['fq'], ['type:page'])
+        self.assertEqual(conn.selects[1]['fq'], ['type:page', 'id:{"b" TO *}'])
+        self.assertEqual(conn.selects[2]['fq'], ['type:page', u'id:{"d\\"\u00e9" TO *}'.encode('utf-8')])
+
+    def test_exact_pages(self):
+        # a last page which happens to be full needs one more (empty) page to be sure
+        conn = PagingSolr([[{'id': 'a'}, {'id': 'b'}], []])
+        self.assertEqual([doc['id'] for doc in conn.iter_search('*:*', rows=2)], ['a', 'b'])
+        self.assertEqual(len(conn.selects), 2)
+
+    def test_start_ignored(self):
+        conn = PagingSolr([[{'id': 'a'}]])
+        list(conn.iter_search('*:*', rows=2, start=10))
+        self.failIf('start' in conn.selects[0])
+
+
+class TestLatencyStats(unittest.TestCase):
+    def test_stats(self):
+        stats = pysolr.LatencyStats()
+        stats.record('select', 0.1)
+        stats.record('select', 0.3, failed=True)
+        stats.record('update', 1.0)
+        summary = stats.summary()
+        self.assertEqual(summary['select']['requests'], 2)
+        self.assertEqual(summary['select']['failures'], 1)
+        self.assertAlmostEqual(summary['select']['average'], 0.2)
+        self.assertAlmostEqual(summary['select']['max'], 0.3)
+        self.assertEqual(summary['update']['requests'], 1)
+        stats.reset()
+        self.assertEqual(stats.summary(), {})
+
+    def test_endpoint_of(self):
+        self.assertEqual(pysolr.endpoint_of('/solr/select/?q=x'), 'select')
+        self.assertEqual(pysolr.endpoint_of('/solr/update/'), 'update')
+        self.assertEqual(pysolr.endpoint_of('/solr/update/?commit=true'), 'update')
+
+
+if __name__ == '__main__':
+    unittest.main()